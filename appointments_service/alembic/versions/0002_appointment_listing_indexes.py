@@ -0,0 +1,31 @@
+"""Índices para la paginación por cursor de los listados de citas
+
+Revision ID: 0002_appointment_listing_indexes
+Revises: 0001_appointment_end_datetime
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '0002_appointment_listing_indexes'
+down_revision = '0001_appointment_end_datetime'
+branch_labels = None
+depends_on = None
+
+LISTING_INDEXES = {
+    "ix_appointments_doctor_listing": ["doctor_id", "appointment_datetime", "id"],
+    "ix_appointments_patient_listing": ["patient_id", "appointment_datetime", "id"],
+}
+
+def upgrade() -> None:
+    # La tabla puede haber sido creada por create_tables() con el modelo actual
+    indexes = {index["name"] for index in sa.inspect(op.get_bind()).get_indexes("appointments")}
+    for name, index_columns in LISTING_INDEXES.items():
+        if name not in indexes:
+            op.create_index(name, "appointments", index_columns)
+
+def downgrade() -> None:
+    for name in LISTING_INDEXES:
+        op.drop_index(name, table_name="appointments")
@@ -0,0 +1,29 @@
+"""Versiones de agenda por paciente y médico para GET condicionales
+
+Revision ID: 0003_schedule_versions
+Revises: 0002_appointment_listing_indexes
+Create Date: 2026-10-17 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '0003_schedule_versions'
+down_revision = '0002_appointment_listing_indexes'
+branch_labels = None
+depends_on = None
+
+def upgrade() -> None:
+    # La tabla puede haber sido creada por create_tables() con el modelo actual
+    if "schedule_versions" in sa.inspect(op.get_bind()).get_table_names():
+        return
+    op.create_table(
+        "schedule_versions",
+        sa.Column("owner_type", sa.String(), primary_key=True),
+        sa.Column("owner_id", sa.Integer(), primary_key=True),
+        sa.Column("version", sa.Integer(), nullable=False),
+    )
+
+def downgrade() -> None:
+    op.drop_table("schedule_versions")
@@ -0,0 +1,41 @@
+"""Outbox de cambios de citas y posiciones de sus consumidores
+
+Revision ID: 0004_appointment_outbox
+Revises: 0003_schedule_versions
+Create Date: 2026-10-17 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '0004_appointment_outbox'
+down_revision = '0003_schedule_versions'
+branch_labels = None
+depends_on = None
+
+def upgrade() -> None:
+    # Las tablas pueden haber sido creadas por create_tables() con el modelo actual
+    existing = set(sa.inspect(op.get_bind()).get_table_names())
+    if "appointment_outbox" not in existing:
+        op.create_table(
+            "appointment_outbox",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("event_type", sa.String(), nullable=False),
+            sa.Column("appointment_id", sa.Integer(), nullable=False),
+            sa.Column("patient_id", sa.Integer(), nullable=False),
+            sa.Column("doctor_id", sa.Integer(), nullable=False),
+            sa.Column("previous_doctor_id", sa.Integer(), nullable=True),
+            sa.Column("payload", sa.Text(), nullable=False),
+            sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+        )
+    if "appointment_outbox_offsets" not in existing:
+        op.create_table(
+            "appointment_outbox_offsets",
+            sa.Column("consumer", sa.String(), primary_key=True),
+            sa.Column("last_event_id", sa.Integer(), nullable=False),
+        )
+
+def downgrade() -> None:
+    op.drop_table("appointment_outbox_offsets")
+    op.drop_table("appointment_outbox")
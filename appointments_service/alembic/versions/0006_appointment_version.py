@@ -0,0 +1,28 @@
+"""Versión de cada cita para el control de concurrencia optimista
+
+Revision ID: 0006_appointment_version
+Revises: 0005_idempotency_keys
+Create Date: 2026-10-17 19:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '0006_appointment_version'
+down_revision = '0005_idempotency_keys'
+branch_labels = None
+depends_on = None
+
+def upgrade() -> None:
+    # La tabla puede haber sido creada por create_tables() con el modelo actual
+    columns = {column["name"] for column in sa.inspect(op.get_bind()).get_columns("appointments")}
+    if "version" not in columns:
+        # Las citas existentes empiezan en la versión 1
+        op.add_column(
+            "appointments", sa.Column("version", sa.Integer(), nullable=False, server_default="1")
+        )
+
+def downgrade() -> None:
+    with op.batch_alter_table("appointments") as batch_op:
+        batch_op.drop_column("version")
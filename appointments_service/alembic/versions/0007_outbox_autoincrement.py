@@ -0,0 +1,46 @@
+"""Ids del outbox sin reutilización en SQLite (AUTOINCREMENT)
+
+Revision ID: 0007_outbox_autoincrement
+Revises: 0006_appointment_version
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '0007_outbox_autoincrement'
+down_revision = '0006_appointment_version'
+branch_labels = None
+depends_on = None
+
+def _has_autoincrement(bind) -> bool:
+    sql = bind.execute(sa.text(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'appointment_outbox'"
+    )).scalar()
+    return "AUTOINCREMENT" in (sql or "").upper()
+
+def upgrade() -> None:
+    # En PostgreSQL el id es una secuencia y nunca se reutiliza
+    bind = op.get_bind()
+    if bind.dialect.name != "sqlite" or _has_autoincrement(bind):
+        return
+    with op.batch_alter_table("appointment_outbox", recreate="always",
+                              table_kwargs={"sqlite_autoincrement": True}):
+        pass
+    # Los ids ya eliminados por prune() pueden estar por encima del máximo actual:
+    # la secuencia continúa desde la mayor posición entregada a un consumidor
+    op.execute("DELETE FROM sqlite_sequence WHERE name = 'appointment_outbox'")
+    op.execute(
+        "INSERT INTO sqlite_sequence (name, seq) SELECT 'appointment_outbox', max(seq) FROM ("
+        " SELECT coalesce(max(id), 0) AS seq FROM appointment_outbox"
+        " UNION ALL SELECT coalesce(max(last_event_id), 0) FROM appointment_outbox_offsets)"
+    )
+
+def downgrade() -> None:
+    bind = op.get_bind()
+    if bind.dialect.name != "sqlite" or not _has_autoincrement(bind):
+        return
+    with op.batch_alter_table("appointment_outbox", recreate="always",
+                              table_kwargs={"sqlite_autoincrement": False}):
+        pass
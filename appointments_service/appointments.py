@@ -1,36 +1,124 @@
-from typing import Optional, List
-from datetime import datetime, timedelta
-from sqlalchemy.orm import Session
-from sqlalchemy import and_, or_
-import httpx
+from typing import Collection, Iterable, Optional, List, Tuple
+from datetime import datetime, timedelta, timezone
+import base64
+import time
+from contextlib import asynccontextmanager
+from bisect import bisect_right
+from collections import defaultdict
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import and_, insert, or_, select, text
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Row
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import StaleDataError
 from jose import JWTError, jwt
 
-from database import Appointment
-from schemas import AppointmentCreate, AppointmentUpdate, UserInfo
+from database import Appointment, ScheduleVersion, OutboxEvent, DOCTOR_OVERLAP_CONSTRAINT, PATIENT_OVERLAP_CONSTRAINT
+from schemas import (
+    AppointmentCreate,
+    AppointmentUpdate,
+    AppointmentResponse,
+    AppointmentDetailResponse,
+    UserInfo,
+    MAX_DURATION_MINUTES,
+    DEFAULT_PAGE_SIZE,
+    MAX_FREE_SLOT_RANGE_DAYS
+)
 from config import settings
+from events import event_hub
+from serialization import appointments_to_json
+from token_cache import token_cache
+from metrics import registry
+from tracing import tracer
+from users_client import users_client
 
-def verify_token(token: str) -> Optional[dict]:
-    """Verificar y decodificar token JWT"""
+# Clave del advisory lock que ordena las escrituras del outbox en PostgreSQL
+OUTBOX_LOCK_KEY = 0x6F7574626F78
+
+# Duración y resultado de las verificaciones de conflictos (/metrics)
+CONFLICT_CHECK_SECONDS = registry.histogram(
+    "appointment_conflict_check_duration_seconds", "Duración de check_appointment_conflicts"
+).labels()
+CONFLICT_CHECKS = registry.counter(
+    "appointment_conflict_checks_total", "Verificaciones de conflictos por resultado", ("outcome",)
+)
+
+# Mensajes de error por conflicto de horario
+DOCTOR_CONFLICT_ERROR = "El médico ya tiene una cita programada en ese horario"
+PATIENT_CONFLICT_ERROR = "El paciente ya tiene una cita programada en ese horario"
+INVALID_CURSOR_ERROR = "Cursor de paginación inválido"
+BATCH_ABORTED_ERROR = "No se creó porque otra cita del lote tiene conflictos"
+
+class AppointmentVersionConflict(Exception):
+    """La cita no está en la versión que espera el cliente (If-Match) o cambió durante la operación"""
+
+    def __init__(self, current_version: Optional[int] = None):
+        super().__init__("La cita fue modificada por otra petición")
+        self.current_version = current_version
+
+def decode_token(token: str) -> Optional[dict]:
+    """Verificar y decodificar token JWT (sin caché)"""
     try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        return payload
+        with tracer.span("jwt.decode"):
+            payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+        token_cache.set(token, payload, payload.get("exp"))
+        return dict(payload)
     except JWTError:
         return None
 
-async def get_user_info(user_id: int) -> Optional[UserInfo]:
-    """Obtener información de usuario desde el servicio de autenticación"""
-    try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(f"{settings.AUTH_SERVICE_URL}/users/{user_id}")
-            if response.status_code == 200:
-                user_data = response.json()
-                return UserInfo(**user_data)
-    except Exception:
-        pass
-    return None
-
-def check_appointment_conflicts(
-    db: Session, 
+def verify_token(token: str) -> Optional[dict]:
+    """Verificar token JWT usando la caché de payloads verificados"""
+    payload = token_cache.get(token)
+    if payload is not None:
+        # Copia para que quien llama no altere la entrada cacheada
+        return dict(payload)
+    return decode_token(token)
+
+async def get_user_info(user_id: int, token: str) -> Optional[UserInfo]:
+    """Obtener información de usuario desde el servicio de autenticación (con caché)"""
+    return await users_client.get_user(user_id, token)
+
+async def enrich_appointments(appointments: List, token: str) -> List[AppointmentDetailResponse]:
+    """
+    Agregar la información de paciente y médico a un listado de citas.
+
+    Todos los IDs del listado se resuelven con una sola consulta en lote al
+    servicio de autenticación (o ninguna si ya están en caché).
+    """
+    user_ids = [apt.patient_id for apt in appointments] + [apt.doctor_id for apt in appointments]
+    users = await users_client.get_users(user_ids, token) if user_ids else {}
+    return [
+        AppointmentDetailResponse(
+            **AppointmentResponse.from_orm(apt).dict(),
+            patient_info=users.get(apt.patient_id),
+            doctor_info=users.get(apt.doctor_id)
+        )
+        for apt in appointments
+    ]
+
+def _as_utc(value: datetime) -> datetime:
+    """Asegurar que un datetime sea timezone-aware (UTC si no tiene zona horaria)"""
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+def _overlaps(
+    start: datetime,
+    end: datetime,
+    existing_start: datetime,
+    existing_end: datetime
+) -> bool:
+    """Verificar si el intervalo [start, end) se cruza con una cita existente"""
+    return (
+        (existing_start <= start < existing_end) or        # Nueva cita empieza durante existente
+        (existing_start < end <= existing_end) or          # Nueva cita termina durante existente
+        (start <= existing_start and end >= existing_end)  # Nueva cita engloba existente
+    )
+
+@tracer.traced("check_appointment_conflicts")
+async def check_appointment_conflicts(
+    db: AsyncSession, 
     doctor_id: int, 
     patient_id: int, 
     appointment_datetime: datetime, 
@@ -40,136 +128,277 @@ def check_appointment_conflicts(
     """
     Verificar conflictos de horarios para citas médicas.
     Retorna una lista de errores encontrados.
+
+    Solo se consultan las citas del médico y del paciente cuyo inicio cae en la
+    ventana [inicio - duración máxima, fin] y cuyo fin no es anterior al inicio,
+    lo que permite usar los índices compuestos (doctor_id, rango) y (patient_id, rango).
+    El cruce exacto se evalúa en Python con la misma normalización de zona horaria.
     """
     errors = []
+    started_at = time.perf_counter()
     
-    # Asegurar que appointment_datetime sea timezone-aware
-    from datetime import timezone
-    if appointment_datetime.tzinfo is None:
-        appointment_datetime = appointment_datetime.replace(tzinfo=timezone.utc)
-    
-    # Calcular tiempo de fin de la nueva cita
+    appointment_datetime = _as_utc(appointment_datetime)
     end_time = appointment_datetime + timedelta(minutes=duration_minutes)
     
-    # Query base para conflictos - obtener todas las citas relevantes y filtrar en Python
-    base_query = db.query(Appointment)
-    if exclude_appointment_id:
-        base_query = base_query.filter(Appointment.id != exclude_appointment_id)
+    # Ventana acotada: una cita existente solo puede cruzarse si empieza antes del fin
+    # de la nueva y como mucho MAX_DURATION_MINUTES antes de su inicio
+    window_start = (appointment_datetime - timedelta(minutes=MAX_DURATION_MINUTES)).astimezone(timezone.utc)
+    window_end = end_time.astimezone(timezone.utc)
     
-    # Obtener todas las citas y hacer la verificación en Python para evitar problemas de timezone en SQL
-    all_appointments = base_query.all()
+    query = select(
+        Appointment.doctor_id,
+        Appointment.patient_id,
+        Appointment.appointment_datetime,
+        Appointment.end_datetime
+    ).where(
+        or_(Appointment.doctor_id == doctor_id, Appointment.patient_id == patient_id),
+        Appointment.appointment_datetime >= window_start,
+        Appointment.appointment_datetime <= window_end,
+        Appointment.end_datetime >= appointment_datetime.astimezone(timezone.utc)
+    )
+    if exclude_appointment_id:
+        query = query.where(Appointment.id != exclude_appointment_id)
     
-    # 1. Verificar conflictos del médico
-    doctor_conflicts = []
-    for apt in all_appointments:
+    doctor_conflict = False
+    patient_conflict = False
+    for apt in await db.execute(query):
+        apt_datetime = _as_utc(apt.appointment_datetime)
+        apt_end_time = _as_utc(apt.end_datetime)
+        if not _overlaps(appointment_datetime, end_time, apt_datetime, apt_end_time):
+            continue
         if apt.doctor_id == doctor_id:
-            # Asegurar que el datetime de la cita existente sea timezone-aware
-            apt_datetime = apt.appointment_datetime
-            if apt_datetime.tzinfo is None:
-                apt_datetime = apt_datetime.replace(tzinfo=timezone.utc)
-            
-            apt_end_time = apt_datetime + timedelta(minutes=apt.duration_minutes)
-            
-            # Verificar si hay conflicto
-            if (
-                (apt_datetime <= appointment_datetime < apt_end_time) or  # Nueva cita empieza durante existente
-                (apt_datetime < end_time <= apt_end_time) or              # Nueva cita termina durante existente
-                (appointment_datetime <= apt_datetime and end_time >= apt_end_time)  # Nueva cita engloba existente
-            ):
-                doctor_conflicts.append(apt)
-    
-    if doctor_conflicts:
-        errors.append(f"El médico ya tiene una cita programada en ese horario")
-    
-    # 2. Verificar conflictos del paciente
-    patient_conflicts = []
-    for apt in all_appointments:
+            doctor_conflict = True
         if apt.patient_id == patient_id:
-            # Asegurar que el datetime de la cita existente sea timezone-aware
-            apt_datetime = apt.appointment_datetime
-            if apt_datetime.tzinfo is None:
-                apt_datetime = apt_datetime.replace(tzinfo=timezone.utc)
-            
-            apt_end_time = apt_datetime + timedelta(minutes=apt.duration_minutes)
-            
-            # Verificar si hay conflicto
-            if (
-                (apt_datetime <= appointment_datetime < apt_end_time) or  # Nueva cita empieza durante existente
-                (apt_datetime < end_time <= apt_end_time) or              # Nueva cita termina durante existente
-                (appointment_datetime <= apt_datetime and end_time >= apt_end_time)  # Nueva cita engloba existente
-            ):
-                patient_conflicts.append(apt)
-    
-    if patient_conflicts:
-        errors.append(f"El paciente ya tiene una cita programada en ese horario")
+            patient_conflict = True
     
+    # 1. Conflictos del médico
+    if doctor_conflict:
+        errors.append(DOCTOR_CONFLICT_ERROR)
+    
+    # 2. Conflictos del paciente
+    if patient_conflict:
+        errors.append(PATIENT_CONFLICT_ERROR)
+    
+    outcome = "both" if doctor_conflict and patient_conflict else (
+        "doctor" if doctor_conflict else "patient" if patient_conflict else "free"
+    )
+    CONFLICT_CHECKS.labels(outcome).inc()
+    CONFLICT_CHECK_SECONDS.observe(time.perf_counter() - started_at)
     return errors
+
+def _merge_intervals(intervals: List[Tuple[datetime, datetime]]) -> List[Tuple[datetime, datetime]]:
+    """Unir intervalos ordenados por inicio en bloques ocupados disjuntos"""
+    merged = []
+    for start, end in intervals:
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+def _sweep_free_slots(
+    busy: List[Tuple[datetime, datetime]],
+    first_start: datetime,
+    range_end: datetime,
+    duration: timedelta,
+    step: timedelta
+) -> List[Tuple[datetime, datetime]]:
+    """
+    Recorrer una sola vez los bloques ocupados (disjuntos y ordenados) generando
+    los horarios [inicio, inicio + duración) alineados a step que no se cruzan.
+    Ante un bloque ocupado se salta directamente al primer inicio alineado
+    posterior a su fin.
+    """
+    slots = []
+    i = 0
+    slot_start = first_start
+    while slot_start + duration <= range_end:
+        slot_end = slot_start + duration
+        while i < len(busy) and busy[i][1] <= slot_start:
+            i += 1
+        if i < len(busy) and _overlaps(slot_start, slot_end, busy[i][0], busy[i][1]):
+            slot_start += -((slot_start - busy[i][1]) // step) * step
+            continue
+        slots.append((slot_start, slot_end))
+        slot_start += step
+    return slots
+
+async def find_free_slots(
+    db: AsyncSession,
+    doctor_id: int,
+    date_from: datetime,
+    date_to: datetime,
+    duration_minutes: int,
+    step_minutes: Optional[int] = None,
+    patient_id: Optional[int] = None
+) -> List[Tuple[datetime, datetime]]:
+    """
+    Horarios libres de un médico de duración duration_minutes entre date_from y date_to.
+
+    Los candidatos empiezan en date_from cada step_minutes (por defecto, la
+    duración) y solo se ofrecen horarios futuros. Se usa la misma semántica de
+    cruce que check_appointment_conflicts; si se indica patient_id también se
+    excluyen los horarios en que el paciente ya tiene una cita. Las citas se
+    leen con una sola consulta sobre la ventana y se recorren una vez.
+    """
+    date_from = _as_utc(date_from).astimezone(timezone.utc)
+    date_to = _as_utc(date_to).astimezone(timezone.utc)
+    step_minutes = step_minutes or duration_minutes
     
-    # Query base para conflictos
-    base_query = db.query(Appointment)
-    if exclude_appointment_id:
-        base_query = base_query.filter(Appointment.id != exclude_appointment_id)
-    
-    # 1. Verificar conflictos del médico (no puede tener citas que se crucen)
-    doctor_conflicts = base_query.filter(
-        and_(
-            Appointment.doctor_id == doctor_id,
-            or_(
-                # Nueva cita empieza durante una cita existente
-                and_(
-                    Appointment.appointment_datetime <= appointment_datetime,
-                    Appointment.appointment_datetime + timedelta(minutes=Appointment.duration_minutes) > appointment_datetime
-                ),
-                # Nueva cita termina durante una cita existente
-                and_(
-                    Appointment.appointment_datetime < end_time,
-                    Appointment.appointment_datetime + timedelta(minutes=Appointment.duration_minutes) >= end_time
-                ),
-                # Nueva cita engloba una cita existente
-                and_(
-                    Appointment.appointment_datetime >= appointment_datetime,
-                    Appointment.appointment_datetime + timedelta(minutes=Appointment.duration_minutes) <= end_time
-                )
-            )
-        )
-    ).all()
-    
-    if doctor_conflicts:
-        errors.append(f"El médico ya tiene una cita programada en ese horario")
-    
-    # 2. Verificar conflictos del paciente (no puede tener citas que se crucen)
-    patient_conflicts = base_query.filter(
-        and_(
-            Appointment.patient_id == patient_id,
-            or_(
-                # Nueva cita empieza durante una cita existente
-                and_(
-                    Appointment.appointment_datetime <= appointment_datetime,
-                    Appointment.appointment_datetime + timedelta(minutes=Appointment.duration_minutes) > appointment_datetime
-                ),
-                # Nueva cita termina durante una cita existente
-                and_(
-                    Appointment.appointment_datetime < end_time,
-                    Appointment.appointment_datetime + timedelta(minutes=Appointment.duration_minutes) >= end_time
-                ),
-                # Nueva cita engloba una cita existente
-                and_(
-                    Appointment.appointment_datetime >= appointment_datetime,
-                    Appointment.appointment_datetime + timedelta(minutes=Appointment.duration_minutes) <= end_time
-                )
-            )
-        )
-    ).all()
+    if date_to <= date_from:
+        raise ValueError("El fin del rango debe ser posterior al inicio")
+    if date_to - date_from > timedelta(days=MAX_FREE_SLOT_RANGE_DAYS):
+        raise ValueError(f"El rango de búsqueda no puede superar {MAX_FREE_SLOT_RANGE_DAYS} días")
+    if duration_minutes <= 0 or duration_minutes > MAX_DURATION_MINUTES:
+        raise ValueError(f"La duración debe ser entre 1 y {MAX_DURATION_MINUTES} minutos")
+    if step_minutes <= 0:
+        raise ValueError("El intervalo entre horarios debe ser positivo")
     
-    if patient_conflicts:
-        errors.append(f"El paciente ya tiene una cita programada en ese horario")
+    duration = timedelta(minutes=duration_minutes)
+    step = timedelta(minutes=step_minutes)
     
-    return errors
+    # Misma ventana acotada que check_appointment_conflicts, ampliada a todo el rango
+    owner_filter = Appointment.doctor_id == doctor_id
+    if patient_id is not None:
+        owner_filter = or_(owner_filter, Appointment.patient_id == patient_id)
+    query = select(
+        Appointment.appointment_datetime,
+        Appointment.end_datetime
+    ).where(
+        owner_filter,
+        Appointment.appointment_datetime >= date_from - timedelta(minutes=MAX_DURATION_MINUTES),
+        Appointment.appointment_datetime <= date_to,
+        Appointment.end_datetime >= date_from
+    ).order_by(Appointment.appointment_datetime)
+    
+    busy = _merge_intervals([
+        (_as_utc(apt.appointment_datetime), _as_utc(apt.end_datetime))
+        for apt in await db.execute(query)
+    ])
+    
+    # Primer candidato alineado estrictamente en el futuro
+    first_start = date_from
+    now = datetime.now(timezone.utc)
+    if first_start <= now:
+        first_start += ((now - first_start) // step + 1) * step
+    
+    return _sweep_free_slots(busy, first_start, date_to, duration, step)
+
+async def lock_schedule(db: AsyncSession) -> None:
+    """
+    Serializar las reservas en bases de datos sin restricciones de exclusión.
 
-def create_appointment(db: Session, appointment: AppointmentCreate, patient_id: int) -> Appointment:
+    En PostgreSQL la restricción de exclusión garantiza que no haya citas
+    superpuestas, por lo que no se bloquea nada. En SQLite se ejecuta una
+    escritura vacía que toma el bloqueo RESERVED de la base de datos hasta el
+    commit: dos reservas concurrentes no pueden validar y escribir a la vez.
+    """
+    if db.get_bind().dialect.name == "sqlite":
+        await db.execute(text("UPDATE appointments SET id = id WHERE 0"))
+
+async def bump_schedule_versions(
+    db: AsyncSession,
+    patient_ids: Iterable[int] = (),
+    doctor_ids: Iterable[int] = ()
+) -> None:
+    """
+    Incrementar la versión de agenda de los pacientes y médicos afectados.
+
+    Debe llamarse dentro de la transacción que modifica las citas, antes del
+    commit, para que la versión y los datos se confirmen juntos. Las filas se
+    actualizan en orden fijo para no provocar deadlocks entre transacciones.
+    """
+    owners = sorted(
+        {("patient", patient_id) for patient_id in patient_ids}
+        | {("doctor", doctor_id) for doctor_id in doctor_ids}
+    )
+    if not owners:
+        return
+    insert_for_dialect = postgresql_insert if db.get_bind().dialect.name == "postgresql" else sqlite_insert
+    for owner_type, owner_id in owners:
+        statement = insert_for_dialect(ScheduleVersion).values(owner_type=owner_type, owner_id=owner_id, version=1)
+        await db.execute(statement.on_conflict_do_update(
+            index_elements=[ScheduleVersion.owner_type, ScheduleVersion.owner_id],
+            set_={"version": ScheduleVersion.version + 1}
+        ))
+
+async def record_outbox_events(
+    db: AsyncSession,
+    event_type: str,
+    appointments: Iterable[Appointment],
+    previous_doctor_ids: Optional[dict] = None
+) -> None:
+    """
+    Escribir en el outbox los cambios de citas, dentro de la transacción que
+    los produce (se confirman o descartan junto con ellos).
+
+    Debe ser la última escritura antes del commit. En PostgreSQL se toma un
+    advisory lock de transacción para que los ids del outbox sigan el orden de
+    confirmación: el relay avanza por id y no debe saltarse un evento que una
+    transacción más lenta confirme después. En SQLite las escrituras ya están
+    serializadas.
+    """
+    previous_doctor_ids = previous_doctor_ids or {}
+    rows = [
+        {
+            "event_type": event_type,
+            "appointment_id": appointment.id,
+            "patient_id": appointment.patient_id,
+            "doctor_id": appointment.doctor_id,
+            "previous_doctor_id": previous_doctor_ids.get(appointment.id),
+            "payload": appointments_to_json([appointment])[1:-1].decode("utf-8"),
+        }
+        for appointment in appointments
+    ]
+    if not rows:
+        return
+    if db.get_bind().dialect.name == "postgresql":
+        await db.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": OUTBOX_LOCK_KEY})
+    await db.execute(insert(OutboxEvent), rows)
+
+async def get_schedule_version(db: AsyncSession, owner_type: str, owner_id: int) -> int:
+    """Versión actual de la agenda de un paciente o médico (0 si nunca tuvo citas)"""
+    version = await db.scalar(
+        select(ScheduleVersion.version).where(
+            ScheduleVersion.owner_type == owner_type,
+            ScheduleVersion.owner_id == owner_id
+        )
+    )
+    return version or 0
+
+@asynccontextmanager
+async def translate_overlap_errors(db: AsyncSession):
+    """
+    Traducir las violaciones de las restricciones de exclusión a los mensajes
+    de conflicto habituales (ValueError). En PostgreSQL las restricciones no
+    son diferibles: saltan en el flush o el INSERT, no solo en el commit.
+    """
+    try:
+        yield
+    except IntegrityError as e:
+        await db.rollback()
+        message = str(e.orig)
+        errors = []
+        if DOCTOR_OVERLAP_CONSTRAINT in message:
+            errors.append(DOCTOR_CONFLICT_ERROR)
+        if PATIENT_OVERLAP_CONSTRAINT in message:
+            errors.append(PATIENT_CONFLICT_ERROR)
+        if not errors:
+            raise
+        raise ValueError("; ".join(errors)) from e
+
+async def commit_schedule_changes(db: AsyncSession) -> None:
+    """Confirmar la transacción traduciendo las violaciones de exclusión a ValueError"""
+    async with translate_overlap_errors(db):
+        await db.commit()
+
+async def create_appointment(db: AsyncSession, appointment: AppointmentCreate, patient_id: int) -> Appointment:
     """Crear nueva cita médica"""
+    await lock_schedule(db)
+    
     # Verificar conflictos
-    conflicts = check_appointment_conflicts(
+    conflicts = await check_appointment_conflicts(
         db, 
         appointment.doctor_id, 
         patient_id, 
@@ -191,30 +420,234 @@ def create_appointment(db: Session, appointment: AppointmentCreate, patient_id:
     )
     
     db.add(db_appointment)
-    db.commit()
-    db.refresh(db_appointment)
+    async with translate_overlap_errors(db):
+        await db.flush()
+    await db.refresh(db_appointment)  # id y created_at para el outbox
+    await bump_schedule_versions(db, [patient_id], [appointment.doctor_id])
+    await record_outbox_events(db, "created", [db_appointment])
+    await commit_schedule_changes(db)
+    await db.refresh(db_appointment)
+    event_hub.publish_appointment("created", db_appointment)
     return db_appointment
 
-def get_appointments_by_patient(db: Session, patient_id: int) -> List[Appointment]:
-    """Obtener todas las citas de un paciente"""
-    return db.query(Appointment).filter(Appointment.patient_id == patient_id).all()
+def _first_overlap(
+    blocks: List[Tuple[datetime, datetime]],
+    block_ends: List[datetime],
+    start: datetime,
+    end: datetime
+) -> bool:
+    """Verificar con búsqueda binaria si [start, end) se cruza con algún bloque disjunto"""
+    i = bisect_right(block_ends, start)
+    return i < len(blocks) and _overlaps(start, end, blocks[i][0], blocks[i][1])
+
+async def create_appointments_batch(
+    db: AsyncSession,
+    items: List[AppointmentCreate],
+    patient_id: int,
+    all_or_nothing: bool = True
+) -> List[Tuple[Optional[Appointment], Optional[str]]]:
+    """
+    Crear varias citas de un paciente en una sola transacción.
 
-def get_appointments_by_doctor(db: Session, doctor_id: int) -> List[Appointment]:
-    """Obtener todas las citas asignadas a un médico"""
-    return db.query(Appointment).filter(Appointment.doctor_id == doctor_id).all()
+    Las citas existentes de los médicos involucrados y del paciente se leen con
+    una consulta sobre la ventana que cubre todo el lote. Los ítems se recorren
+    ordenados por inicio: cada uno se compara con los bloques ocupados de la base
+    (búsqueda binaria) y con los ítems ya aceptados del mismo médico o del
+    paciente, con la semántica de check_appointment_conflicts. Las citas válidas
+    se insertan con un único INSERT múltiple.
 
-def get_appointment_by_id(db: Session, appointment_id: int) -> Optional[Appointment]:
+    Retorna, en el orden recibido, (cita creada, None) o (None, error) por ítem.
+    Con all_or_nothing, si algún ítem falla no se inserta ninguno.
+    """
+    await lock_schedule(db)
+    
+    intervals = [
+        (_as_utc(item.appointment_datetime), _as_utc(item.appointment_datetime) + timedelta(minutes=item.duration_minutes))
+        for item in items
+    ]
+    doctor_ids = {item.doctor_id for item in items}
+    window_start = min(start for start, _ in intervals) - timedelta(minutes=MAX_DURATION_MINUTES)
+    window_end = max(end for _, end in intervals)
+    
+    query = select(
+        Appointment.doctor_id,
+        Appointment.patient_id,
+        Appointment.appointment_datetime,
+        Appointment.end_datetime
+    ).where(
+        or_(Appointment.doctor_id.in_(doctor_ids), Appointment.patient_id == patient_id),
+        Appointment.appointment_datetime >= window_start.astimezone(timezone.utc),
+        Appointment.appointment_datetime <= window_end.astimezone(timezone.utc)
+    ).order_by(Appointment.appointment_datetime)
+    
+    doctor_busy = defaultdict(list)
+    patient_busy = []
+    for apt in await db.execute(query):
+        interval = (_as_utc(apt.appointment_datetime), _as_utc(apt.end_datetime))
+        if apt.doctor_id in doctor_ids:
+            doctor_busy[apt.doctor_id].append(interval)
+        if apt.patient_id == patient_id:
+            patient_busy.append(interval)
+    doctor_blocks = {doctor_id: _merge_intervals(busy) for doctor_id, busy in doctor_busy.items()}
+    doctor_ends = {doctor_id: [end for _, end in blocks] for doctor_id, blocks in doctor_blocks.items()}
+    patient_blocks = _merge_intervals(patient_busy)
+    patient_ends = [end for _, end in patient_blocks]
+    
+    # Al recorrer por inicio, un ítem se cruza con uno aceptado antes si empieza
+    # antes del mayor fin aceptado para el mismo médico o para el paciente
+    accepted_doctor_end = {}
+    accepted_patient_end = None
+    errors: List[Optional[str]] = [None] * len(items)
+    for index in sorted(range(len(items)), key=lambda i: intervals[i]):
+        start, end = intervals[index]
+        doctor_id = items[index].doctor_id
+        item_errors = []
+        if _first_overlap(doctor_blocks.get(doctor_id, []), doctor_ends.get(doctor_id, []), start, end) or (
+            doctor_id in accepted_doctor_end and start < accepted_doctor_end[doctor_id]
+        ):
+            item_errors.append(DOCTOR_CONFLICT_ERROR)
+        if _first_overlap(patient_blocks, patient_ends, start, end) or (
+            accepted_patient_end is not None and start < accepted_patient_end
+        ):
+            item_errors.append(PATIENT_CONFLICT_ERROR)
+        
+        if item_errors:
+            errors[index] = "; ".join(item_errors)
+            continue
+        accepted_doctor_end[doctor_id] = max(end, accepted_doctor_end.get(doctor_id, end))
+        accepted_patient_end = max(end, accepted_patient_end or end)
+    
+    valid = [index for index in range(len(items)) if errors[index] is None]
+    if all_or_nothing and len(valid) < len(items):
+        await db.rollback()
+        return [(None, error or BATCH_ABORTED_ERROR) for error in errors]
+    
+    created = {}
+    if valid:
+        rows = [
+            {
+                "patient_id": patient_id,
+                "doctor_id": items[index].doctor_id,
+                "title": items[index].title,
+                "description": items[index].description,
+                "appointment_datetime": items[index].appointment_datetime,
+                "duration_minutes": items[index].duration_minutes,
+                "end_datetime": items[index].appointment_datetime + timedelta(minutes=items[index].duration_minutes),
+            }
+            for index in valid
+        ]
+        # Una reserva concurrente superpuesta viola la restricción ya en el INSERT (PostgreSQL)
+        async with translate_overlap_errors(db):
+            result = await db.scalars(
+                insert(Appointment).returning(Appointment, sort_by_parameter_order=True), rows
+            )
+            created = dict(zip(valid, result.all()))
+        await bump_schedule_versions(db, [patient_id], {items[index].doctor_id for index in valid})
+        await record_outbox_events(db, "created", created.values())
+        await commit_schedule_changes(db)
+        for db_appointment in created.values():
+            event_hub.publish_appointment("created", db_appointment)
+    
+    return [(created.get(index), errors[index]) for index in range(len(items))]
+
+def encode_cursor(appointment) -> str:
+    """Cursor opaco con la clave (appointment_datetime, id) de la última cita de la página"""
+    key = f"{_as_utc(appointment.appointment_datetime).isoformat()}|{appointment.id}"
+    return base64.urlsafe_b64encode(key.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Recuperar (appointment_datetime, id) de un cursor; ValueError si no es válido"""
+    try:
+        key = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        appointment_datetime, appointment_id = key.split("|")
+        return _as_utc(datetime.fromisoformat(appointment_datetime)), int(appointment_id)
+    except ValueError as e:
+        raise ValueError(INVALID_CURSOR_ERROR) from e
+
+# Columnas de AppointmentResponse: los listados leen filas, sin construir objetos ORM
+LISTING_COLUMNS = [getattr(Appointment, field) for field in AppointmentResponse.model_fields]
+
+async def _get_appointments_page(
+    db: AsyncSession,
+    owner_filter,
+    date_from: Optional[datetime],
+    date_to: Optional[datetime],
+    cursor: Optional[str],
+    limit: int
+) -> Tuple[List[Row], Optional[str]]:
+    """
+    Página de citas ordenada por (appointment_datetime, id).
+
+    La página siguiente se busca a partir de la clave de la última cita (keyset),
+    por lo que el costo no depende de cuántas citas haya antes del cursor.
+    Se lee una fila extra para saber si existe otra página.
+    """
+    query = select(*LISTING_COLUMNS).where(owner_filter)
+    if date_from:
+        query = query.where(Appointment.appointment_datetime >= _as_utc(date_from).astimezone(timezone.utc))
+    if date_to:
+        query = query.where(Appointment.appointment_datetime < _as_utc(date_to).astimezone(timezone.utc))
+    if cursor:
+        after_datetime, after_id = decode_cursor(cursor)
+        after_datetime = after_datetime.astimezone(timezone.utc)
+        query = query.where(or_(
+            Appointment.appointment_datetime > after_datetime,
+            and_(Appointment.appointment_datetime == after_datetime, Appointment.id > after_id)
+        ))
+    query = query.order_by(Appointment.appointment_datetime, Appointment.id).limit(limit + 1)
+    
+    appointments = list(await db.execute(query))
+    if len(appointments) > limit:
+        appointments = appointments[:limit]
+        return appointments, encode_cursor(appointments[-1])
+    return appointments, None
+
+async def get_appointments_by_patient(
+    db: AsyncSession,
+    patient_id: int,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE
+) -> Tuple[List[Row], Optional[str]]:
+    """Obtener una página de citas de un paciente y el cursor de la siguiente"""
+    return await _get_appointments_page(
+        db, Appointment.patient_id == patient_id, date_from, date_to, cursor, limit
+    )
+
+async def get_appointments_by_doctor(
+    db: AsyncSession,
+    doctor_id: int,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE
+) -> Tuple[List[Row], Optional[str]]:
+    """Obtener una página de citas asignadas a un médico y el cursor de la siguiente"""
+    return await _get_appointments_page(
+        db, Appointment.doctor_id == doctor_id, date_from, date_to, cursor, limit
+    )
+
+async def get_appointment_by_id(db: AsyncSession, appointment_id: int) -> Optional[Appointment]:
     """Obtener cita por ID"""
-    return db.query(Appointment).filter(Appointment.id == appointment_id).first()
+    return await db.get(Appointment, appointment_id)
 
-def update_appointment(
-    db: Session, 
+async def update_appointment(
+    db: AsyncSession, 
     appointment_id: int, 
     appointment_update: AppointmentUpdate, 
-    patient_id: int
+    patient_id: int,
+    expected_versions: Optional[Collection[int]] = None
 ) -> Appointment:
-    """Actualizar cita médica"""
-    db_appointment = get_appointment_by_id(db, appointment_id)
+    """
+    Actualizar cita médica.
+
+    Control de concurrencia optimista, sin bloquear la fila mientras se valida:
+    con expected_versions (If-Match) la cita debe estar en una de esas
+    versiones, y el UPDATE solo se aplica si nadie la modificó desde que se
+    leyó. En ambos casos se lanza AppointmentVersionConflict.
+    """
+    db_appointment = await get_appointment_by_id(db, appointment_id)
     
     if not db_appointment:
         raise ValueError("Cita no encontrada")
@@ -222,16 +655,24 @@ def update_appointment(
     if db_appointment.patient_id != patient_id:
         raise ValueError("No tienes permisos para modificar esta cita")
     
+    if expected_versions is not None and db_appointment.version not in expected_versions:
+        raise AppointmentVersionConflict(db_appointment.version)
+    
     # Preparar datos actualizados
     update_data = appointment_update.dict(exclude_unset=True)
     
-    # Si se actualiza fecha/hora o duración, verificar conflictos
-    if 'appointment_datetime' in update_data or 'duration_minutes' in update_data:
+    # Si se actualiza fecha/hora, duración o médico, verificar conflictos
+    schedule_changed = any(
+        field in update_data for field in ('appointment_datetime', 'duration_minutes', 'doctor_id')
+    )
+    if schedule_changed:
+        await lock_schedule(db)
+        
         new_datetime = update_data.get('appointment_datetime', db_appointment.appointment_datetime)
         new_duration = update_data.get('duration_minutes', db_appointment.duration_minutes)
         new_doctor_id = update_data.get('doctor_id', db_appointment.doctor_id)
         
-        conflicts = check_appointment_conflicts(
+        conflicts = await check_appointment_conflicts(
             db, 
             new_doctor_id, 
             patient_id, 
@@ -243,17 +684,35 @@ def update_appointment(
         if conflicts:
             raise ValueError("; ".join(conflicts))
     
-    # Aplicar actualizaciones
+    # Aplicar actualizaciones (la cita puede cambiar de médico: se versionan ambos)
+    previous_doctor_id = db_appointment.doctor_id
+    affected_doctor_ids = {previous_doctor_id, update_data.get('doctor_id', previous_doctor_id)}
     for field, value in update_data.items():
         setattr(db_appointment, field, value)
     
-    db.commit()
-    db.refresh(db_appointment)
+    if schedule_changed:
+        db_appointment.end_datetime = db_appointment.appointment_datetime + timedelta(
+            minutes=db_appointment.duration_minutes
+        )
+    
+    await bump_schedule_versions(db, [patient_id], affected_doctor_ids)
+    try:
+        async with translate_overlap_errors(db):
+            await db.flush()  # UPDATE ... WHERE id = :id AND version = :version leída
+    except StaleDataError as e:
+        await db.rollback()
+        raise AppointmentVersionConflict() from e
+    await db.refresh(db_appointment)  # updated_at para el outbox
+    moved = {appointment_id: previous_doctor_id} if db_appointment.doctor_id != previous_doctor_id else None
+    await record_outbox_events(db, "updated", [db_appointment], moved)
+    await commit_schedule_changes(db)
+    await db.refresh(db_appointment)
+    event_hub.publish_appointment("updated", db_appointment, affected_doctor_ids)
     return db_appointment
 
-def delete_appointment(db: Session, appointment_id: int, patient_id: int) -> bool:
+async def delete_appointment(db: AsyncSession, appointment_id: int, patient_id: int) -> bool:
     """Eliminar cita médica"""
-    db_appointment = get_appointment_by_id(db, appointment_id)
+    db_appointment = await get_appointment_by_id(db, appointment_id)
     
     if not db_appointment:
         raise ValueError("Cita no encontrada")
@@ -261,6 +720,13 @@ def delete_appointment(db: Session, appointment_id: int, patient_id: int) -> boo
     if db_appointment.patient_id != patient_id:
         raise ValueError("No tienes permisos para eliminar esta cita")
     
-    db.delete(db_appointment)
-    db.commit()
+    await db.delete(db_appointment)
+    await bump_schedule_versions(db, [patient_id], [db_appointment.doctor_id])
+    await record_outbox_events(db, "deleted", [db_appointment])
+    try:
+        await db.commit()  # DELETE ... WHERE id = :id AND version = :version leída
+    except StaleDataError as e:
+        await db.rollback()
+        raise AppointmentVersionConflict() from e
+    event_hub.publish_appointment("deleted", db_appointment)
     return True
@@ -1,14 +1,120 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Text, ForeignKey
+import time
+from datetime import timedelta
+from uuid import uuid4
+from sqlalchemy import create_engine, text, Column, Integer, String, DateTime, Text, LargeBinary, ForeignKey, Index, DDL, event, exc
+from sqlalchemy.dialects.postgresql import ExcludeConstraint
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.orm import relationship
+from sqlalchemy.pool import QueuePool
 from sqlalchemy.sql import func
 from config import settings
 
+def get_async_database_url(url: str) -> str:
+    """Derivar la URL del driver asíncrono (asyncpg / aiosqlite) a partir de DATABASE_URL"""
+    if url.startswith(("postgresql://", "postgresql+psycopg2://")):
+        return "postgresql+asyncpg://" + url.split("://", 1)[1]
+    if url.startswith("sqlite://"):
+        return "sqlite+aiosqlite://" + url.split("://", 1)[1]
+    return url
+
+class PoolWaitStats:
+    """Tiempo de espera por una conexión del pool y cantidad de timeouts"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.timeouts = 0
+
+    def observe(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def as_dict(self) -> dict:
+        return {
+            "checkouts": self.count,
+            "avg_wait_ms": round(self.total / self.count * 1000, 3) if self.count else 0.0,
+            "max_wait_ms": round(self.max * 1000, 3),
+            "timeouts": self.timeouts,
+        }
+
+def timed_pool_class(base: type, stats: PoolWaitStats) -> type:
+    """Subclase del pool que registra en stats la espera de cada checkout"""
+
+    def _do_get(self):
+        started_at = time.monotonic()
+        try:
+            return base._do_get(self)
+        except exc.TimeoutError:
+            stats.timeouts += 1
+            raise
+        finally:
+            stats.observe(time.monotonic() - started_at)
+
+    return type("Timed" + base.__name__, (base,), {"_do_get": _do_get})
+
+def engine_options(url: str, stats: PoolWaitStats) -> dict:
+    """Opciones de create_engine a partir de Settings (tamaño, overflow, timeout, recycle, pre-ping)"""
+    options = {"pool_pre_ping": settings.DB_POOL_PRE_PING, "pool_recycle": settings.DB_POOL_RECYCLE}
+    url = make_url(url)
+    pool_class = url.get_dialect().get_pool_class(url)
+    # SQLite en memoria usa pools de una sola conexión que no admiten dimensionamiento
+    if issubclass(pool_class, QueuePool):
+        options.update(
+            poolclass=timed_pool_class(pool_class, stats),
+            pool_size=settings.DB_POOL_SIZE,
+            max_overflow=settings.DB_MAX_OVERFLOW,
+            pool_timeout=settings.DB_POOL_TIMEOUT,
+        )
+    if settings.DB_TRANSACTION_POOLING and url.get_driver_name() == "asyncpg":
+        # Un proxy en modo transacción puede cambiar de conexión de servidor entre
+        # sentencias: sin caché de sentencias preparadas y con nombres únicos
+        options["connect_args"] = {
+            "statement_cache_size": 0,
+            "prepared_statement_cache_size": 0,
+            "prepared_statement_name_func": lambda: f"__asyncpg_{uuid4()}__",
+        }
+    return options
+
+def pool_status(engine, stats: PoolWaitStats) -> dict:
+    """Estado del pool: conexiones en uso, libres, overflow y espera por checkout"""
+    pool = engine.pool
+    status = {"pool": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        status.update(
+            size=pool.size(),
+            checked_in=pool.checkedin(),
+            checked_out=pool.checkedout(),
+            overflow=max(pool.overflow(), 0),
+            max_overflow=settings.DB_MAX_OVERFLOW,
+        )
+    status.update(stats.as_dict())
+    return status
+
 # Configuración de SQLAlchemy
-engine = create_engine(settings.DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# - engine (síncrono): creación de tablas y migraciones (migrate.py)
+# - async_engine: acceso a datos desde los endpoints sin bloquear el event loop
+ASYNC_DATABASE_URL = settings.ASYNC_DATABASE_URL or get_async_database_url(settings.DATABASE_URL)
+pool_wait_stats = PoolWaitStats()
+async_pool_wait_stats = PoolWaitStats()
+engine = create_engine(settings.DATABASE_URL, **engine_options(settings.DATABASE_URL, pool_wait_stats))
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **engine_options(ASYNC_DATABASE_URL, async_pool_wait_stats))
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
+# Nombres de las restricciones de exclusión (PostgreSQL) que impiden citas superpuestas
+DOCTOR_OVERLAP_CONSTRAINT = "ex_appointments_doctor_overlap"
+PATIENT_OVERLAP_CONSTRAINT = "ex_appointments_patient_overlap"
+
+def _default_end_datetime(context):
+    """Calcular el fin de la cita a partir del inicio y la duración al insertar"""
+    params = context.get_current_parameters()
+    return params["appointment_datetime"] + timedelta(minutes=params["duration_minutes"])
+
 # Modelo de Cita Médica
 class Appointment(Base):
     __tablename__ = "appointments"
@@ -22,19 +128,106 @@ class Appointment(Base):
     description = Column(Text, nullable=True)
     appointment_datetime = Column(DateTime(timezone=True), nullable=False, index=True)
     duration_minutes = Column(Integer, nullable=False, default=30)  # Duración en minutos
+    end_datetime = Column(DateTime(timezone=True), nullable=False, default=_default_end_datetime)  # Inicio + duración
     
     # Metadatos
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+    # Control de concurrencia optimista: cada UPDATE lleva "WHERE version = <leída>"
+    # y la incrementa; si otra transacción la cambió antes se lanza StaleDataError
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    
+    __mapper_args__ = {"version_id_col": version}
+    
+    # Índices compuestos para la detección de conflictos por rango horario y,
+    # en PostgreSQL, restricciones de exclusión que impiden citas superpuestas
+    # aun cuando dos transacciones concurrentes pasen la validación previa
+    __table_args__ = (
+        Index("ix_appointments_doctor_range", "doctor_id", "appointment_datetime", "end_datetime"),
+        Index("ix_appointments_patient_range", "patient_id", "appointment_datetime", "end_datetime"),
+        # Paginación por cursor (appointment_datetime, id) de los listados por médico y paciente
+        Index("ix_appointments_doctor_listing", "doctor_id", "appointment_datetime", "id"),
+        Index("ix_appointments_patient_listing", "patient_id", "appointment_datetime", "id"),
+        ExcludeConstraint(
+            (doctor_id, "="),
+            (func.tstzrange(appointment_datetime, end_datetime), "&&"),
+            name=DOCTOR_OVERLAP_CONSTRAINT,
+            using="gist",
+        ).ddl_if(dialect="postgresql"),
+        ExcludeConstraint(
+            (patient_id, "="),
+            (func.tstzrange(appointment_datetime, end_datetime), "&&"),
+            name=PATIENT_OVERLAP_CONSTRAINT,
+            using="gist",
+        ).ddl_if(dialect="postgresql"),
+    )
+
+# btree_gist es necesario para combinar "=" sobre enteros con "&&" sobre rangos
+event.listen(
+    Appointment.__table__,
+    "before_create",
+    DDL("CREATE EXTENSION IF NOT EXISTS btree_gist").execute_if(dialect="postgresql"),
+)
+
+# Versión de la agenda de cada paciente y médico: se incrementa en la misma
+# transacción que cualquier alta, modificación o baja de sus citas y permite
+# responder GET condicionales (ETag) sin leer las citas
+class ScheduleVersion(Base):
+    __tablename__ = "schedule_versions"
+    
+    owner_type = Column(String, primary_key=True)  # "patient" o "doctor"
+    owner_id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, default=1)
+
+# Outbox de cambios de citas: cada alta, modificación o baja escribe una fila en
+# la misma transacción; el relay (outbox.py) la entrega luego a los consumidores
+class OutboxEvent(Base):
+    __tablename__ = "appointment_outbox"
+    
+    id = Column(Integer, primary_key=True)  # orden de confirmación de los cambios
+    event_type = Column(String, nullable=False)  # created, updated o deleted
+    appointment_id = Column(Integer, nullable=False)
+    patient_id = Column(Integer, nullable=False)
+    doctor_id = Column(Integer, nullable=False)
+    previous_doctor_id = Column(Integer, nullable=True)  # si la cita cambió de médico
+    payload = Column(Text, nullable=False)  # la cita en JSON, como en los listados
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    
+    # Sin AUTOINCREMENT, SQLite reutiliza los ids más altos tras prune(): un evento
+    # nuevo quedaría por debajo de la posición de los consumidores y no se entregaría
+    __table_args__ = {"sqlite_autoincrement": True}
+
+# Posición persistente de cada consumidor del outbox (último evento procesado)
+class OutboxOffset(Base):
+    __tablename__ = "appointment_outbox_offsets"
+    
+    consumer = Column(String, primary_key=True)
+    last_event_id = Column(Integer, nullable=False, default=0)
 
-# Función para obtener sesión de base de datos
-def get_db():
-    db = SessionLocal()
-    try:
+# Idempotency-Key de las peticiones que modifican citas (idempotency.py): la
+# primera petición reclama la clave (status_code NULL) y al terminar guarda su
+# respuesta, que se repite a los reintentos hasta expires_at
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+    
+    user_id = Column(Integer, primary_key=True, autoincrement=False)  # las claves son de cada usuario
+    key = Column(String(255), primary_key=True)
+    request_hash = Column(String(32), nullable=False)  # método, ruta y cuerpo de la petición
+    status_code = Column(Integer, nullable=True)  # NULL mientras la primera petición está en curso
+    response_headers = Column(Text, nullable=True)  # JSON [[nombre, valor], ...]
+    response_body = Column(LargeBinary, nullable=True)
+    expires_at = Column(DateTime(timezone=True), nullable=False, index=True)
+
+# Función para obtener sesión asíncrona de base de datos
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
-# Crear tablas
+# Crear tablas (solo desde migrate.py, nunca al importar la aplicación)
 def create_tables():
     Base.metadata.create_all(bind=engine)
+
+async def warm_up():
+    """Abrir la primera conexión del pool asíncrono para que no la pague la primera petición"""
+    async with async_engine.connect() as conn:
+        await conn.execute(text("SELECT 1"))
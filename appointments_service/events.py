@@ -0,0 +1,118 @@
+"""
+Difusión en tiempo real de cambios de citas (Server-Sent Events).
+
+Cada conexión de /events se suscribe a la agenda de su usuario (paciente o
+médico) y recibe una cola acotada. Las operaciones de escritura publican el
+evento ya codificado una sola vez y el hub lo reparte sin bloquear: si la cola
+de una conexión lenta se llena, la conexión se marca como desbordada, recibe un
+evento "resync" y se cierra para que el cliente vuelva a cargar su agenda en
+lugar de perder cambios en silencio. El hub es por proceso: con varios workers
+cada uno notifica a sus propias conexiones.
+"""
+import asyncio
+from collections import defaultdict
+from typing import AsyncIterator, Dict, Iterable, Set, Tuple
+
+from config import settings
+from serialization import appointment_event_json
+
+Owner = Tuple[str, int]
+
+RESYNC_EVENT = b"event: resync\ndata: {}\n\n"
+HEARTBEAT = b": ping\n\n"
+
+class EventHubFull(Exception):
+    """Se alcanzó el máximo de conexiones de eventos del proceso"""
+
+class Subscription:
+    """Conexión suscrita a la agenda de un paciente o médico"""
+
+    __slots__ = ("owner", "queue", "overflowed")
+
+    def __init__(self, owner: Owner, queue_size: int):
+        self.owner = owner
+        self.queue: "asyncio.Queue[bytes]" = asyncio.Queue(maxsize=queue_size)
+        self.overflowed = False
+
+class EventHub:
+    """Reparto en proceso de eventos a las conexiones suscritas"""
+
+    def __init__(self, queue_size: int, max_connections: int, heartbeat: float):
+        self.queue_size = queue_size
+        self.max_connections = max_connections
+        self.heartbeat = heartbeat
+        self._subscriptions: Dict[Owner, Set[Subscription]] = defaultdict(set)
+        self.connections = 0
+        self.published = 0
+        self.delivered = 0
+        self.overflows = 0
+
+    def subscribe(self, owner: Owner) -> Subscription:
+        if self.connections >= self.max_connections:
+            raise EventHubFull()
+        subscription = Subscription(owner, self.queue_size)
+        self._subscriptions[owner].add(subscription)
+        self.connections += 1
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        subscribers = self._subscriptions.get(subscription.owner)
+        if subscribers and subscription in subscribers:
+            subscribers.discard(subscription)
+            self.connections -= 1
+            if not subscribers:
+                del self._subscriptions[subscription.owner]
+
+    def publish(self, message: bytes, owners: Iterable[Owner]) -> None:
+        """Encolar un mensaje SSE para todas las conexiones de los dueños indicados"""
+        self.published += 1
+        for owner in set(owners):
+            for subscription in self._subscriptions.get(owner, ()):
+                if subscription.overflowed:
+                    continue
+                try:
+                    subscription.queue.put_nowait(message)
+                    self.delivered += 1
+                except asyncio.QueueFull:
+                    subscription.overflowed = True
+                    self.overflows += 1
+
+    def publish_appointment(self, event_type: str, appointment, doctor_ids: Iterable[int] = ()) -> None:
+        """Publicar un cambio de cita a su paciente y a sus médicos (actual y anteriores)"""
+        message = appointment_event_json(event_type, appointment)
+        owners = [("patient", appointment.patient_id), ("doctor", appointment.doctor_id)]
+        owners.extend(("doctor", doctor_id) for doctor_id in doctor_ids)
+        self.publish(message, owners)
+
+    async def stream(self, subscription: Subscription) -> AsyncIterator[bytes]:
+        """Generar el flujo SSE de una suscripción (con latidos para conexiones inactivas)"""
+        try:
+            yield b"retry: 3000\n\n"
+            while True:
+                try:
+                    message = await asyncio.wait_for(subscription.queue.get(), timeout=self.heartbeat)
+                except asyncio.TimeoutError:
+                    message = HEARTBEAT
+                if subscription.overflowed and subscription.queue.empty():
+                    yield message
+                    yield RESYNC_EVENT
+                    return
+                yield message
+        finally:
+            self.unsubscribe(subscription)
+
+    def stats(self) -> dict:
+        return {
+            "connections": self.connections,
+            "subscribed_owners": len(self._subscriptions),
+            "published": self.published,
+            "delivered": self.delivered,
+            "overflows": self.overflows,
+            "queue_size": self.queue_size,
+        }
+
+event_hub = EventHub(
+    queue_size=settings.EVENTS_QUEUE_SIZE,
+    max_connections=settings.EVENTS_MAX_CONNECTIONS,
+    heartbeat=settings.EVENTS_HEARTBEAT_SECONDS,
+)
@@ -0,0 +1,312 @@
+"""
+Idempotency-Key en las peticiones que modifican citas.
+
+Un cliente que reintenta POST/PUT/DELETE de /appointments con la misma
+cabecera Idempotency-Key recibe la respuesta de la primera ejecución en lugar
+de volver a ejecutarla (sin chequeo de conflictos ni el 400 "ya tiene una
+cita" cuando el primer intento sí se confirmó):
+
+- la primera petición reclama la clave insertando su fila en idempotency_keys
+  (la clave primaria (usuario, clave) garantiza un solo ganador entre workers
+  y réplicas), ejecuta el endpoint y guarda su respuesta hasta
+  IDEMPOTENCY_TTL_SECONDS,
+- un duplicado concurrente espera a que la primera termine (aviso en proceso,
+  sondeo de la fila entre workers) y devuelve la misma respuesta; si sigue en
+  curso tras IDEMPOTENCY_WAIT_SECONDS responde 409 con Retry-After,
+- la misma clave con otra petición (método, ruta o cuerpo) responde 422,
+- las respuestas 5xx no se guardan: la clave se libera y el reintento vuelve
+  a ejecutarse. Un reclamo cuyo worker murió antes de guardar la respuesta
+  vence a los IDEMPOTENCY_LOCK_SECONDS.
+
+Las claves vencidas se eliminan cada IDEMPOTENCY_PRUNE_SECONDS desde las
+propias peticiones. Sin la cabecera, o sin un token válido (el endpoint
+responde 401), la petición pasa sin cambios.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import delete, exc, select, update
+from starlette.responses import JSONResponse
+
+from appointments import verify_token
+from config import settings
+from database import AsyncSessionLocal, IdempotencyKey
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotency-Replayed"
+MAX_KEY_LENGTH = 255
+IDEMPOTENT_METHODS = ("POST", "PUT", "DELETE")
+IDEMPOTENT_PATH_PREFIX = "/appointments"
+# Sondeo de una clave en curso en otro worker
+POLL_SECONDS = 0.05
+
+REQUESTS = registry.counter(
+    "idempotency_requests_total", "Peticiones con Idempotency-Key por resultado", ("outcome",)
+)
+
+Key = Tuple[int, str]
+
+def request_fingerprint(method: str, path: str, query_string: bytes, body: bytes) -> str:
+    """Huella de la petición: la misma clave solo puede repetir la misma petición"""
+    digest = hashlib.sha256()
+    for part in (method.encode(), path.encode(), query_string, body):
+        digest.update(len(part).to_bytes(8, "big"))
+        digest.update(part)
+    return digest.hexdigest()[:32]
+
+class IdempotencyStore:
+    """Claves de idempotencia en la base, con aviso en proceso al completarse"""
+
+    def __init__(self, session_factory, ttl_seconds: int, lock_seconds: float, prune_seconds: float):
+        self.session_factory = session_factory
+        self.ttl = timedelta(seconds=ttl_seconds)
+        self.lock = timedelta(seconds=lock_seconds)
+        self.prune_seconds = prune_seconds
+        self._pending: Dict[Key, asyncio.Event] = {}
+        self._last_prune = time.monotonic()
+        self.pruned = 0
+
+    async def claim(self, key: Key, request_hash: str) -> Optional[IdempotencyKey]:
+        """
+        Reclamar la clave para ejecutar la petición. Devuelve None si se
+        reclamó o la fila vigente de la petición que la tiene.
+        """
+        user_id, idempotency_key = key
+        async with self.session_factory() as db:
+            while True:
+                now = datetime.now(timezone.utc)
+                db.add(IdempotencyKey(user_id=user_id, key=idempotency_key, request_hash=request_hash,
+                                      expires_at=now + self.lock))
+                try:
+                    await db.commit()
+                except exc.IntegrityError:
+                    await db.rollback()
+                else:
+                    self._pending[key] = asyncio.Event()
+                    return None
+                existing = await self._get(db, key, now)
+                if existing is not None:
+                    return existing
+                # La fila existente venció: se elimina y se vuelve a intentar
+                await db.execute(delete(IdempotencyKey).where(
+                    IdempotencyKey.user_id == user_id, IdempotencyKey.key == idempotency_key,
+                    IdempotencyKey.expires_at <= now,
+                ))
+                await db.commit()
+
+    async def get(self, key: Key) -> Optional[IdempotencyKey]:
+        """Fila vigente de la clave (None si no existe o venció)"""
+        async with self.session_factory() as db:
+            return await self._get(db, key, datetime.now(timezone.utc))
+
+    @staticmethod
+    async def _get(db, key: Key, now: datetime) -> Optional[IdempotencyKey]:
+        return await db.scalar(select(IdempotencyKey).where(
+            IdempotencyKey.user_id == key[0], IdempotencyKey.key == key[1], IdempotencyKey.expires_at > now
+        ))
+
+    async def complete(self, key: Key, status_code: int, headers: list, body: bytes) -> None:
+        """Guardar la respuesta de la petición que reclamó la clave"""
+        try:
+            async with self.session_factory() as db:
+                await db.execute(
+                    update(IdempotencyKey)
+                    .where(IdempotencyKey.user_id == key[0], IdempotencyKey.key == key[1])
+                    .values(status_code=status_code, response_headers=json.dumps(headers), response_body=body,
+                            expires_at=datetime.now(timezone.utc) + self.ttl)
+                )
+                await db.commit()
+        finally:
+            self._notify(key)
+
+    async def release(self, key: Key) -> None:
+        """Liberar la clave sin respuesta guardada (5xx o error): el reintento vuelve a ejecutarse"""
+        try:
+            async with self.session_factory() as db:
+                await db.execute(delete(IdempotencyKey).where(
+                    IdempotencyKey.user_id == key[0], IdempotencyKey.key == key[1]
+                ))
+                await db.commit()
+        finally:
+            self._notify(key)
+
+    def _notify(self, key: Key) -> None:
+        event = self._pending.pop(key, None)
+        if event is not None:
+            event.set()
+
+    async def wait(self, key: Key, timeout: float) -> None:
+        """Esperar a que cambie una clave en curso: aviso si está en este worker, sondeo si no"""
+        event = self._pending.get(key)
+        if event is None:
+            await asyncio.sleep(min(POLL_SECONDS, timeout))
+            return
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def maybe_prune(self) -> int:
+        """Eliminar las claves vencidas, como mucho una vez cada prune_seconds"""
+        if time.monotonic() - self._last_prune < self.prune_seconds:
+            return 0
+        self._last_prune = time.monotonic()
+        async with self.session_factory() as db:
+            result = await db.execute(
+                delete(IdempotencyKey).where(IdempotencyKey.expires_at <= datetime.now(timezone.utc))
+            )
+            await db.commit()
+        self.pruned += result.rowcount
+        return result.rowcount
+
+    def stats(self) -> dict:
+        return {"in_progress": len(self._pending), "pruned": self.pruned}
+
+def _user_id(scope) -> Optional[int]:
+    for name, value in scope["headers"]:
+        if name == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            if scheme.lower() != "bearer":
+                return None
+            payload = verify_token(token.strip())
+            return payload.get("user_id") if payload else None
+    return None
+
+def _header(scope, name: bytes) -> Optional[str]:
+    for header_name, value in scope["headers"]:
+        if header_name == name:
+            return value.decode("latin-1")
+    return None
+
+class IdempotencyMiddleware:
+    """Middleware ASGI que reclama, espera o repite las peticiones con Idempotency-Key"""
+
+    def __init__(self, app, store: Optional[IdempotencyStore] = None):
+        self.app = app
+        self.store = store
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or not settings.IDEMPOTENCY_ENABLED
+            or scope["method"] not in IDEMPOTENT_METHODS
+            or not scope["path"].startswith(IDEMPOTENT_PATH_PREFIX)
+        ):
+            return await self.app(scope, receive, send)
+        idempotency_key = _header(scope, IDEMPOTENCY_HEADER.lower().encode())
+        user_id = _user_id(scope) if idempotency_key is not None else None
+        if user_id is None:
+            return await self.app(scope, receive, send)
+        if not 0 < len(idempotency_key) <= MAX_KEY_LENGTH:
+            response = JSONResponse(
+                {"detail": f"{IDEMPOTENCY_HEADER} debe tener entre 1 y {MAX_KEY_LENGTH} caracteres"}, 400
+            )
+            return await response(scope, receive, send)
+
+        # El cuerpo se lee una vez para la huella y se vuelve a entregar al endpoint
+        messages, more_body = [], True
+        while more_body:
+            message = await receive()
+            if message["type"] != "http.request":
+                return await self.app(scope, _replay(messages + [message], receive), send)
+            messages.append(message)
+            more_body = message.get("more_body", False)
+        body = b"".join(message.get("body", b"") for message in messages)
+        request_hash = request_fingerprint(scope["method"], scope["path"], scope.get("query_string", b""), body)
+
+        store = self.store or idempotency_store
+        key = (user_id, idempotency_key)
+        deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT_SECONDS
+        existing = await store.claim(key, request_hash)
+        coalesced = False
+        while existing is not None:
+            if existing.request_hash != request_hash:
+                REQUESTS.labels("mismatch").inc()
+                response = JSONResponse(
+                    {"detail": f"La {IDEMPOTENCY_HEADER} ya se usó con una petición distinta"}, 422
+                )
+                return await response(scope, receive, send)
+            if existing.status_code is not None:
+                REQUESTS.labels("coalesced" if coalesced else "replayed").inc()
+                return await _send_stored(existing, send)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                REQUESTS.labels("in_progress").inc()
+                response = JSONResponse(
+                    {"detail": f"Una petición con la misma {IDEMPOTENCY_HEADER} sigue en curso"}, 409,
+                    headers={"Retry-After": "1"},
+                )
+                return await response(scope, receive, send)
+            coalesced = True
+            await store.wait(key, remaining)
+            existing = await store.get(key)
+            if existing is None:
+                # La primera petición falló y liberó la clave: esta la reclama
+                existing = await store.claim(key, request_hash)
+
+        REQUESTS.labels("executed").inc()
+        await self._execute(scope, _replay(messages, receive), send, store, key)
+        try:
+            await store.maybe_prune()
+        except Exception:
+            logger.warning("No se pudieron eliminar las claves de idempotencia vencidas", exc_info=True)
+
+    async def _execute(self, scope, receive, send, store: IdempotencyStore, key: Key) -> None:
+        """Ejecutar la petición que reclamó la clave y guardar su respuesta"""
+        response = {"status": 500, "headers": [], "body": []}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                response["headers"] = [
+                    [name.decode("latin-1"), value.decode("latin-1")] for name, value in message.get("headers", [])
+                ]
+            elif message["type"] == "http.response.body":
+                response["body"].append(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except BaseException:
+            await asyncio.shield(store.release(key))
+            raise
+        try:
+            if response["status"] >= 500:
+                await store.release(key)
+            else:
+                await store.complete(key, response["status"], response["headers"], b"".join(response["body"]))
+        except Exception:
+            # La respuesta ya se envió; el reclamo vence a los IDEMPOTENCY_LOCK_SECONDS
+            logger.warning("No se pudo guardar la respuesta de la %s %s", IDEMPOTENCY_HEADER, key[1], exc_info=True)
+
+def _replay(messages, receive):
+    """receive() que entrega primero los mensajes ya leídos"""
+    pending = list(messages)
+
+    async def replay():
+        if pending:
+            return pending.pop(0)
+        return await receive()
+
+    return replay
+
+async def _send_stored(row: IdempotencyKey, send) -> None:
+    headers = [(name.encode("latin-1"), value.encode("latin-1")) for name, value in json.loads(row.response_headers)]
+    headers.append((REPLAYED_HEADER.lower().encode("latin-1"), b"true"))
+    await send({"type": "http.response.start", "status": row.status_code, "headers": headers})
+    await send({"type": "http.response.body", "body": row.response_body or b""})
+
+idempotency_store = IdempotencyStore(
+    AsyncSessionLocal,
+    ttl_seconds=settings.IDEMPOTENCY_TTL_SECONDS,
+    lock_seconds=settings.IDEMPOTENCY_LOCK_SECONDS,
+    prune_seconds=settings.IDEMPOTENCY_PRUNE_SECONDS,
+)
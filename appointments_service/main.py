@@ -1,60 +1,106 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import APIRouter, FastAPI, Depends, HTTPException, Query, Request, Response, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
-from typing import List, Optional
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+import hashlib
+import logging
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import List, Optional, Set
 
 from config import settings
-from database import get_db, create_tables, Appointment
+from token_cache import token_cache
+from events import event_hub, EventHubFull
+from database import (
+    get_db,
+    warm_up as warm_up_database,
+    Appointment,
+    engine,
+    async_engine,
+    pool_status,
+    pool_wait_stats,
+    async_pool_wait_stats
+)
 from schemas import (
     AppointmentCreate, 
     AppointmentUpdate, 
     AppointmentResponse,
     AppointmentDetailResponse,
-    UserInfo
+    AppointmentBatchCreate,
+    AppointmentBatchItemResult,
+    AppointmentBatchResponse,
+    UserInfo,
+    FreeSlot,
+    DEFAULT_PAGE_SIZE,
+    MAX_PAGE_SIZE
 )
 from appointments import (
     verify_token,
     create_appointment,
+    create_appointments_batch,
     get_appointments_by_patient,
     get_appointments_by_doctor,
     get_appointment_by_id,
     update_appointment,
     delete_appointment,
-    get_user_info
+    AppointmentVersionConflict,
+    find_free_slots,
+    enrich_appointments,
+    get_schedule_version
 )
+from users_client import users_client
+from outbox import outbox_relay
+from idempotency import IdempotencyMiddleware, idempotency_store, REPLAYED_HEADER
+from serialization import AppointmentListResponse
+from query_stats import QueryStatsMiddleware, instrument_engine
+from tracing import TracingMiddleware, trace_engine
+from metrics import registry, MetricsMiddleware, pool_status_metrics, CONTENT_TYPE as METRICS_CONTENT_TYPE
 
-# Crear tablas al iniciar
-create_tables()
+# Cabecera con el cursor de la siguiente página en los listados de citas
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
 
-# Inicializar FastAPI
-app = FastAPI(
-    title=settings.PROJECT_NAME,
-    version=settings.VERSION,
-    description=settings.DESCRIPTION,
-    docs_url="/docs",
-    redoc_url="/redoc"
-)
+# Las respuestas con ETag se pueden guardar, pero el cliente debe revalidarlas
+CONDITIONAL_CACHE_CONTROL = "private, no-cache"
 
-# Configurar CORS
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=[
-        "http://localhost:8100",
-        "http://localhost:8101", 
-        "http://localhost:8102",
-        "http://localhost:8103",
-        "http://localhost:8104",
-        "http://localhost:4200",
-        "*"
-    ],
-    allow_credentials=True,
-    allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-    allow_headers=["*"],
-)
+logger = logging.getLogger(__name__)
+
+# El esquema se crea y actualiza con el paso explícito `python migrate.py`:
+# importar este módulo o levantar un worker no se conecta a la base de datos.
+
+# Consultas SQL por petición y trazas (solo registra eventos en los engines)
+instrument_engine(engine)
+instrument_engine(async_engine)
+trace_engine(engine)
+trace_engine(async_engine)
+
+def collect_service_metrics():
+    """Métricas que ya llevan los pools de conexiones, el cliente de auth_service, las cachés y /events"""
+    yield from pool_status_metrics({
+        "async": pool_status(async_engine, async_pool_wait_stats),
+        "sync": pool_status(engine, pool_wait_stats),
+    })
+    users = users_client.stats()
+    yield "auth_service_requests_total", "counter", "Peticiones a auth_service", [({}, users["requests"])]
+    yield "auth_service_errors_total", "counter", "Peticiones a auth_service fallidas", [({}, users["errors"])]
+    for cache_name, stats in (("users", users["cache"]), ("tokens", token_cache.stats())):
+        yield f"{cache_name}_cache_size", "gauge", "Entradas en caché", [({}, stats["size"])]
+        yield f"{cache_name}_cache_hits_total", "counter", "Aciertos de la caché", [({}, stats["hits"])]
+        yield f"{cache_name}_cache_misses_total", "counter", "Fallos de la caché", [({}, stats["misses"])]
+    events = event_hub.stats()
+    yield "event_stream_connections", "gauge", "Conexiones abiertas en /events", [({}, events["connections"])]
+    yield "event_stream_published_total", "counter", "Cambios publicados en /events", [({}, events["published"])]
+    yield "event_stream_overflows_total", "counter", "Conexiones de /events desbordadas", [({}, events["overflows"])]
+
+registry.add_collector(collect_service_metrics)
+
+router = APIRouter()
+# Estado interno del worker; solo se publica con STATS_ENABLED
+stats_router = APIRouter(prefix="/stats")
 
 # Configuración de seguridad
 security = HTTPBearer()
+optional_security = HTTPBearer(auto_error=False)
 
 async def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security)
@@ -72,7 +118,7 @@ async def get_current_user(
     
     return payload
 
-@app.get("/")
+@router.get("/")
 async def root():
     """Endpoint raíz - información del servicio"""
     return {
@@ -81,10 +127,10 @@ async def root():
         "status": "running"
     }
 
-@app.post("/appointments", response_model=AppointmentResponse, status_code=status.HTTP_201_CREATED)
+@router.post("/appointments", response_model=AppointmentResponse, status_code=status.HTTP_201_CREATED)
 async def create_new_appointment(
     appointment: AppointmentCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: dict = Depends(get_current_user)
 ):
     """Crear nueva cita médica (solo pacientes)"""
@@ -96,7 +142,7 @@ async def create_new_appointment(
         )
     
     try:
-        new_appointment = create_appointment(db, appointment, current_user["user_id"])
+        new_appointment = await create_appointment(db, appointment, current_user["user_id"])
         return AppointmentResponse.from_orm(new_appointment)
     except ValueError as e:
         raise HTTPException(
@@ -109,39 +155,216 @@ async def create_new_appointment(
             detail="Error al crear la cita"
         )
 
-@app.get("/appointments", response_model=List[AppointmentResponse])
+@router.post("/appointments/batch", response_model=AppointmentBatchResponse, status_code=status.HTTP_201_CREATED)
+async def create_appointment_batch(
+    batch: AppointmentBatchCreate,
+    response: Response,
+    db: AsyncSession = Depends(get_db),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Crear varias citas en una sola petición (solo pacientes).
+
+    Responde con el resultado de cada ítem en el orden recibido; si no se
+    pudo crear ninguna cita el código de estado es 409.
+    """
+    if current_user.get("role") != "paciente":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Solo los pacientes pueden crear citas"
+        )
+    
+    try:
+        results = await create_appointments_batch(
+            db, batch.items, current_user["user_id"], all_or_nothing=batch.mode == "all_or_nothing"
+        )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=str(e)
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Error al crear las citas"
+        )
+    
+    items = [
+        AppointmentBatchItemResult(
+            index=index,
+            created=appointment is not None,
+            appointment=AppointmentResponse.from_orm(appointment) if appointment is not None else None,
+            error=error
+        )
+        for index, (appointment, error) in enumerate(results)
+    ]
+    created = sum(item.created for item in items)
+    if not created:
+        response.status_code = status.HTTP_409_CONFLICT
+    return AppointmentBatchResponse(
+        mode=batch.mode, created=created, failed=len(items) - created, results=items
+    )
+
+async def get_appointments_page(fetch_page, response: Response, *args):
+    """Ejecutar la consulta paginada y publicar el cursor siguiente en la cabecera"""
+    try:
+        appointments, next_cursor = await fetch_page(*args)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return appointments
+
+def make_etag(*parts) -> str:
+    """ETag fuerte a partir de los valores que determinan el contenido de la respuesta"""
+    digest = hashlib.sha256("|".join(str(part) for part in parts).encode()).hexdigest()[:32]
+    return f'"{digest}"'
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Verificar si If-None-Match contiene el ETag (o "*")"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tags = [tag.strip() for tag in header.split(",")]
+    return "*" in tags or any(tag.removeprefix("W/") == etag for tag in tags)
+
+def not_modified_response(etag: str) -> Response:
+    """Respuesta 304 sin cuerpo para un ETag que el cliente ya tiene"""
+    return Response(
+        status_code=status.HTTP_304_NOT_MODIFIED,
+        headers={"ETag": etag, "Cache-Control": CONDITIONAL_CACHE_CONTROL}
+    )
+
+def appointment_etag(appointment_id: int, version: int) -> str:
+    """ETag de una cita: cambia con cada modificación (columna version)"""
+    return f'"{appointment_id}-v{version}"'
+
+def if_match_versions(request: Request, appointment_id: int) -> Optional[Set[int]]:
+    """
+    Versiones de la cita aceptadas por If-Match; None si no hay condición o es
+    "*". Comparación fuerte: los ETags débiles o de otra cita no coinciden.
+    """
+    header = request.headers.get("if-match")
+    if not header:
+        return None
+    tags = [tag.strip() for tag in header.split(",")]
+    if "*" in tags:
+        return None
+    prefix = f'"{appointment_id}-v'
+    return {
+        int(tag[len(prefix):-1]) for tag in tags
+        if tag.startswith(prefix) and tag.endswith('"') and tag[len(prefix):-1].isdigit()
+    }
+
+def version_conflict_exception(appointment_id: int, error: AppointmentVersionConflict) -> HTTPException:
+    """412 para una modificación sobre una versión desactualizada, con el ETag actual si se conoce"""
+    headers = None
+    if error.current_version is not None:
+        headers = {"ETag": appointment_etag(appointment_id, error.current_version)}
+    return HTTPException(
+        status_code=status.HTTP_412_PRECONDITION_FAILED,
+        detail="La cita fue modificada por otra petición; vuelve a obtenerla y reintenta",
+        headers=headers
+    )
+
+async def conditional_listing(
+    request: Request,
+    response: Response,
+    db: AsyncSession,
+    owner_type: str,
+    owner_id: int
+) -> Optional[Response]:
+    """
+    Calcular el ETag de un listado a partir de la versión de agenda del dueño y
+    de los parámetros de la consulta. Si el cliente ya lo tiene se devuelve un
+    304 sin leer ni serializar citas; si no, se agrega el ETag a la respuesta.
+    """
+    version = await get_schedule_version(db, owner_type, owner_id)
+    etag = make_etag(owner_type, owner_id, version, sorted(request.query_params.multi_items()))
+    if etag_matches(request, etag):
+        return not_modified_response(etag)
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = CONDITIONAL_CACHE_CONTROL
+    return None
+
+async def serialize_appointments(appointments, include_users: bool, token: str, response: Response):
+    """
+    Serializar un listado de citas. Sin información de usuarios se codifica
+    directamente a JSON (AppointmentListResponse), sin validar cada fila.
+    """
+    if include_users:
+        return await enrich_appointments(appointments, token)
+    return AppointmentListResponse(appointments, headers=dict(response.headers))
+
+@router.get(
+    "/appointments",
+    response_model=List[AppointmentDetailResponse],
+    response_model_exclude_unset=True
+)
 async def get_appointments(
-    db: Session = Depends(get_db),
+    request: Request,
+    response: Response,
+    date_from: Optional[datetime] = Query(None, alias="from"),
+    date_to: Optional[datetime] = Query(None, alias="to"),
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    include_users: bool = False,
+    db: AsyncSession = Depends(get_db),
+    credentials: HTTPAuthorizationCredentials = Depends(security),
     current_user: dict = Depends(get_current_user)
 ):
     """
     Obtener citas del usuario actual:
     - Pacientes: sus propias citas
     - Médicos: citas asignadas a ellos
+
+    Ordenadas por fecha; `from`/`to` acotan la ventana y, si hay más
+    resultados, la cabecera X-Next-Cursor trae el `cursor` de la siguiente página.
+    Con `include_users` se agrega patient_info/doctor_info (una consulta en lote).
+    Sin `include_users` la respuesta lleva ETag y admite If-None-Match (304).
     """
     user_role = current_user.get("role")
     user_id = current_user["user_id"]
     
     if user_role == "paciente":
-        appointments = get_appointments_by_patient(db, user_id)
+        fetch_page, owner_type = get_appointments_by_patient, "patient"
     elif user_role == "médico":
-        appointments = get_appointments_by_doctor(db, user_id)
+        fetch_page, owner_type = get_appointments_by_doctor, "doctor"
     else:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Rol de usuario no válido"
         )
     
-    return [AppointmentResponse.from_orm(appointment) for appointment in appointments]
+    if not include_users:
+        not_modified = await conditional_listing(request, response, db, owner_type, user_id)
+        if not_modified:
+            return not_modified
+    
+    appointments = await get_appointments_page(
+        fetch_page, response, db, user_id, date_from, date_to, cursor, limit
+    )
+    return await serialize_appointments(appointments, include_users, credentials.credentials, response)
 
-@app.get("/appointments/{appointment_id}", response_model=AppointmentResponse)
+@router.get(
+    "/appointments/{appointment_id}",
+    response_model=AppointmentDetailResponse,
+    response_model_exclude_unset=True
+)
 async def get_appointment(
     appointment_id: int,
-    db: Session = Depends(get_db),
+    request: Request,
+    response: Response,
+    include_users: bool = False,
+    db: AsyncSession = Depends(get_db),
+    credentials: HTTPAuthorizationCredentials = Depends(security),
     current_user: dict = Depends(get_current_user)
 ):
     """Obtener cita específica por ID"""
-    appointment = get_appointment_by_id(db, appointment_id)
+    appointment = await get_appointment_by_id(db, appointment_id)
     
     if not appointment:
         raise HTTPException(
@@ -164,16 +387,33 @@ async def get_appointment(
             detail="No tienes permisos para ver esta cita"
         )
     
+    if include_users:
+        return (await enrich_appointments([appointment], credentials.credentials))[0]
+    
+    # Toda modificación de la cita incrementa su versión: el ETag no necesita otra consulta
+    etag = appointment_etag(appointment.id, appointment.version)
+    if etag_matches(request, etag):
+        return not_modified_response(etag)
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = CONDITIONAL_CACHE_CONTROL
     return AppointmentResponse.from_orm(appointment)
 
-@app.put("/appointments/{appointment_id}", response_model=AppointmentResponse)
+@router.put("/appointments/{appointment_id}", response_model=AppointmentResponse)
 async def update_existing_appointment(
     appointment_id: int,
     appointment_update: AppointmentUpdate,
-    db: Session = Depends(get_db),
+    request: Request,
+    response: Response,
+    db: AsyncSession = Depends(get_db),
     current_user: dict = Depends(get_current_user)
 ):
-    """Actualizar cita médica (solo el paciente propietario)"""
+    """
+    Actualizar cita médica (solo el paciente propietario).
+
+    Con If-Match (ETag de GET /appointments/{id} o de un PUT anterior) la
+    modificación solo se aplica sobre esa versión; si la cita cambió entre
+    medio se responde 412 con el ETag actual, sin pisar el otro cambio.
+    """
     if current_user.get("role") != "paciente":
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
@@ -181,10 +421,14 @@ async def update_existing_appointment(
         )
     
     try:
-        updated_appointment = update_appointment(
-            db, appointment_id, appointment_update, current_user["user_id"]
+        updated_appointment = await update_appointment(
+            db, appointment_id, appointment_update, current_user["user_id"],
+            expected_versions=if_match_versions(request, appointment_id)
         )
+        response.headers["ETag"] = appointment_etag(updated_appointment.id, updated_appointment.version)
         return AppointmentResponse.from_orm(updated_appointment)
+    except AppointmentVersionConflict as e:
+        raise version_conflict_exception(appointment_id, e)
     except ValueError as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -196,10 +440,10 @@ async def update_existing_appointment(
             detail="Error al actualizar la cita"
         )
 
-@app.delete("/appointments/{appointment_id}", status_code=status.HTTP_204_NO_CONTENT)
+@router.delete("/appointments/{appointment_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_existing_appointment(
     appointment_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: dict = Depends(get_current_user)
 ):
     """Eliminar cita médica (solo el paciente propietario)"""
@@ -210,7 +454,9 @@ async def delete_existing_appointment(
         )
     
     try:
-        delete_appointment(db, appointment_id, current_user["user_id"])
+        await delete_appointment(db, appointment_id, current_user["user_id"])
+    except AppointmentVersionConflict as e:
+        raise version_conflict_exception(appointment_id, e)
     except ValueError as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -222,10 +468,22 @@ async def delete_existing_appointment(
             detail="Error al eliminar la cita"
         )
 
-@app.get("/appointments/doctor/{doctor_id}", response_model=List[AppointmentResponse])
+@router.get(
+    "/appointments/doctor/{doctor_id}",
+    response_model=List[AppointmentDetailResponse],
+    response_model_exclude_unset=True
+)
 async def get_doctor_appointments(
     doctor_id: int,
-    db: Session = Depends(get_db),
+    request: Request,
+    response: Response,
+    date_from: Optional[datetime] = Query(None, alias="from"),
+    date_to: Optional[datetime] = Query(None, alias="to"),
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    include_users: bool = False,
+    db: AsyncSession = Depends(get_db),
+    credentials: HTTPAuthorizationCredentials = Depends(security),
     current_user: dict = Depends(get_current_user)
 ):
     """Obtener citas de un médico específico (solo el propio médico)"""
@@ -241,14 +499,192 @@ async def get_doctor_appointments(
             detail="Solo puedes ver tus propias citas"
         )
     
-    appointments = get_appointments_by_doctor(db, doctor_id)
-    return [AppointmentResponse.from_orm(appointment) for appointment in appointments]
+    if not include_users:
+        not_modified = await conditional_listing(request, response, db, "doctor", doctor_id)
+        if not_modified:
+            return not_modified
+    
+    appointments = await get_appointments_page(
+        get_appointments_by_doctor, response, db, doctor_id, date_from, date_to, cursor, limit
+    )
+    return await serialize_appointments(appointments, include_users, credentials.credentials, response)
 
-@app.get("/health")
+@router.get("/appointments/doctor/{doctor_id}/free-slots", response_model=List[FreeSlot])
+async def get_doctor_free_slots(
+    doctor_id: int,
+    date_from: datetime = Query(..., alias="from"),
+    date_to: datetime = Query(..., alias="to"),
+    duration_minutes: int = 30,
+    step_minutes: Optional[int] = None,
+    db: AsyncSession = Depends(get_db),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Obtener los horarios libres de un médico entre `from` y `to`.
+
+    Para pacientes también se descartan los horarios en que ya tienen una cita,
+    de modo que cualquier horario devuelto puede reservarse sin conflicto.
+    """
+    patient_id = current_user["user_id"] if current_user.get("role") == "paciente" else None
+    
+    try:
+        slots = await find_free_slots(
+            db, doctor_id, date_from, date_to, duration_minutes, step_minutes, patient_id
+        )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    
+    return [FreeSlot(start=start, end=end) for start, end in slots]
+
+@router.get("/events")
+async def stream_events(
+    access_token: Optional[str] = Query(None, description="Token JWT (EventSource no permite cabeceras)"),
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)
+):
+    """
+    Flujo Server-Sent Events con los cambios de la agenda del usuario actual:
+    appointment.created, appointment.updated y appointment.deleted. Si el
+    cliente no consume a tiempo recibe "resync" y debe recargar su agenda.
+    """
+    token = credentials.credentials if credentials else access_token
+    payload = verify_token(token) if token else None
+    if payload is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Token inválido",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    
+    owner_type = "doctor" if payload.get("role") == "médico" else "patient"
+    try:
+        subscription = event_hub.subscribe((owner_type, payload["user_id"]))
+    except EventHubFull:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Demasiadas conexiones de eventos, reintenta más tarde",
+            headers={"Retry-After": str(int(settings.EVENTS_HEARTBEAT_SECONDS))},
+        )
+    
+    return StreamingResponse(
+        event_hub.stream(subscription),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@router.get("/health")
 async def health_check():
     """Endpoint de verificación de salud del servicio"""
     return {"status": "healthy", "service": "appointments_service"}
 
+@router.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Métricas en formato de exposición de Prometheus"""
+    return Response(registry.render(), media_type=METRICS_CONTENT_TYPE)
+
+@stats_router.get("/users")
+async def users_client_stats():
+    """Métricas del cliente de auth_service: peticiones, errores y aciertos de caché"""
+    return users_client.stats()
+
+@stats_router.get("/tokens")
+async def token_cache_stats():
+    """Métricas de la caché de tokens verificados: tamaño y tasa de aciertos"""
+    return token_cache.stats()
+
+@stats_router.get("/events")
+async def event_hub_stats():
+    """Métricas del flujo de eventos: conexiones abiertas, eventos publicados y desbordes"""
+    return event_hub.stats()
+
+@stats_router.get("/outbox")
+async def outbox_stats():
+    """Métricas del relay del outbox: último evento y retraso de cada consumidor"""
+    return await outbox_relay.stats()
+
+@stats_router.get("/idempotency")
+async def idempotency_stats():
+    """Claves de idempotencia en curso en este worker y claves vencidas eliminadas"""
+    return idempotency_store.stats()
+
+@stats_router.get("/db")
+async def db_pool_stats():
+    """Métricas de los pools de conexiones: conexiones en uso, overflow y espera por checkout"""
+    return {
+        "async": pool_status(async_engine, async_pool_wait_stats),
+        "sync": pool_status(engine, pool_wait_stats),
+    }
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Preparar el worker antes de aceptar peticiones y liberar recursos al terminar"""
+    if settings.STARTUP_WARMUP:
+        try:
+            await warm_up_database()
+        except Exception:
+            logger.warning("No se pudo abrir la conexión inicial a la base de datos", exc_info=True)
+    if settings.OUTBOX_RELAY_ENABLED:
+        outbox_relay.start()
+    try:
+        yield
+    finally:
+        await outbox_relay.stop()
+        await users_client.close()
+
+def create_app() -> FastAPI:
+    """
+    Construir la aplicación sin efectos secundarios: no crea tablas ni abre
+    conexiones. El relay del outbox y la conexión inicial se preparan en el
+    lifespan (uvicorn main:app o uvicorn --factory main:create_app).
+    """
+    app = FastAPI(
+        title=settings.PROJECT_NAME,
+        version=settings.VERSION,
+        description=settings.DESCRIPTION,
+        docs_url="/docs",
+        redoc_url="/redoc",
+        lifespan=lifespan
+    )
+
+    # Idempotency-Key en POST/PUT/DELETE: los reintentos repiten la respuesta guardada
+    app.add_middleware(IdempotencyMiddleware)
+
+    # Peticiones por ruta, latencia y peticiones en curso (/metrics)
+    app.add_middleware(MetricsMiddleware, registry=registry)
+    # Consultas SQL por petición: cantidad, tiempo, log de lentas y posibles N+1
+    app.add_middleware(QueryStatsMiddleware)
+    # Trazas distribuidas: span por petición, por consulta SQL y traceparent entrante
+    app.add_middleware(TracingMiddleware)
+
+    # Configurar CORS (se agrega al final para ser la capa más externa: también las
+    # respuestas que arman los middlewares, como las de IdempotencyMiddleware, llevan
+    # las cabeceras CORS)
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=[
+            "http://localhost:8100",
+            "http://localhost:8101", 
+            "http://localhost:8102",
+            "http://localhost:8103",
+            "http://localhost:8104",
+            "http://localhost:4200",
+            "*"
+        ],
+        allow_credentials=True,
+        allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
+        allow_headers=["*"],
+        expose_headers=[NEXT_CURSOR_HEADER, "ETag", REPLAYED_HEADER],
+    )
+
+    app.include_router(router)
+    if settings.STATS_ENABLED:
+        app.include_router(stats_router)
+    return app
+
+app = create_app()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,34 @@
+"""
+Paso explícito de migración del esquema.
+
+La aplicación ya no crea tablas al importarse: el esquema se prepara una vez
+por despliegue con este script (un job previo o el comando del contenedor),
+y los workers y réplicas arrancan sin DDL ni conexiones a la base de datos.
+
+Primero se crean las tablas que falten con el modelo actual y luego se aplican
+las migraciones de Alembic hasta head; las migraciones revisan el esquema
+existente, así que el script se puede ejecutar en cada despliegue.
+
+Uso:
+    python migrate.py
+"""
+import os
+import time
+
+from database import create_tables
+
+SERVICE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def migrate() -> None:
+    from alembic import command
+    from alembic.config import Config
+
+    create_tables()
+    config = Config(os.path.join(SERVICE_DIR, "alembic.ini"))
+    config.set_main_option("script_location", os.path.join(SERVICE_DIR, "alembic"))
+    command.upgrade(config, "head")
+
+if __name__ == "__main__":
+    started_at = time.perf_counter()
+    migrate()
+    print(f"✅ Esquema actualizado en {time.perf_counter() - started_at:.2f} s")
@@ -0,0 +1,155 @@
+"""
+Relay del outbox de cambios de citas.
+
+Las operaciones de appointments.py escriben cada cambio en appointment_outbox
+dentro de su propia transacción. El relay lee el outbox por lotes en orden de
+id y entrega los eventos a los consumidores registrados (funciones async en
+proceso: invalidación de cachés, notificaciones, analítica...). Cada
+consumidor tiene su posición persistente en appointment_outbox_offsets, que
+solo avanza cuando procesó el lote sin errores: la entrega es "al menos una
+vez" y los consumidores deben tolerar eventos repetidos tras un reinicio o un
+fallo.
+
+La posición se guarda por nombre de consumidor, no por proceso: el relay debe
+correr en un único proceso del despliegue, por eso está desactivado por
+defecto y se activa con OUTBOX_RELAY_ENABLED=true solo en ese worker o
+réplica. Si varios workers lo corrieran, uno avanzaría la posición compartida
+y los demás se saltarían esos eventos. Los consumidores
+registrados deben actuar sobre estado compartido (cachés externas,
+notificaciones), no sobre la memoria de un worker.
+
+Sin consumidores registrados el relay solo elimina los eventos más viejos que
+la retención, para que el outbox no crezca sin límite.
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from sqlalchemy import delete, func, select
+
+from config import settings
+from database import AsyncSessionLocal, OutboxEvent, OutboxOffset
+
+logger = logging.getLogger(__name__)
+
+OutboxConsumer = Callable[[List[OutboxEvent]], Awaitable[None]]
+
+class OutboxRelay:
+    """Entrega por lotes de los eventos del outbox a consumidores en proceso"""
+
+    def __init__(self, session_factory, batch_size: int, poll_seconds: float, retention_hours: int):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.poll_seconds = poll_seconds
+        self.retention = timedelta(hours=retention_hours)
+        self._consumers: Dict[str, OutboxConsumer] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.delivered = 0
+        self.failures = 0
+
+    def register(self, name: str, consumer: OutboxConsumer) -> None:
+        """Registrar un consumidor; su posición se guarda con este nombre"""
+        self._consumers[name] = consumer
+
+    async def _dispatch(self, name: str, consumer: OutboxConsumer) -> int:
+        """Entregar el siguiente lote a un consumidor y avanzar su posición"""
+        async with self.session_factory() as db:
+            offset = await db.get(OutboxOffset, name)
+            if offset is None:
+                offset = OutboxOffset(consumer=name, last_event_id=0)
+                db.add(offset)
+            events = (await db.scalars(
+                select(OutboxEvent)
+                .where(OutboxEvent.id > offset.last_event_id)
+                .order_by(OutboxEvent.id)
+                .limit(self.batch_size)
+            )).all()
+            if not events:
+                return 0
+            try:
+                await consumer(events)
+            except Exception:
+                self.failures += 1
+                logger.exception("El consumidor del outbox %s falló; se reintentará el lote", name)
+                return 0
+            offset.last_event_id = events[-1].id
+            await db.commit()
+            self.delivered += len(events)
+            return len(events)
+
+    async def run_once(self) -> int:
+        """Entregar un lote a cada consumidor; devuelve la cantidad de eventos entregados"""
+        delivered = 0
+        for name, consumer in list(self._consumers.items()):
+            delivered += await self._dispatch(name, consumer)
+        return delivered
+
+    async def prune(self) -> int:
+        """
+        Eliminar los eventos más viejos que la retención y, si hay consumidores,
+        ya entregados a todos ellos
+        """
+        async with self.session_factory() as db:
+            conditions = [OutboxEvent.created_at < datetime.now(timezone.utc) - self.retention]
+            if self._consumers:
+                positions = (await db.scalars(
+                    select(OutboxOffset.last_event_id).where(OutboxOffset.consumer.in_(list(self._consumers)))
+                )).all()
+                if len(positions) < len(self._consumers):
+                    return 0
+                conditions.append(OutboxEvent.id <= min(positions))
+            result = await db.execute(delete(OutboxEvent).where(*conditions))
+            await db.commit()
+            return result.rowcount
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                # Mientras haya lotes completos no se espera al siguiente sondeo
+                while await self.run_once() >= self.batch_size:
+                    pass
+                await self.prune()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Error en el relay del outbox")
+            await asyncio.sleep(self.poll_seconds)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def stats(self) -> dict:
+        """Posición y retraso (eventos pendientes) de cada consumidor"""
+        async with self.session_factory() as db:
+            last_event_id = await db.scalar(select(func.max(OutboxEvent.id))) or 0
+            offsets = dict((await db.execute(
+                select(OutboxOffset.consumer, OutboxOffset.last_event_id)
+            )).all())
+        return {
+            "running": self._task is not None,
+            "last_event_id": last_event_id,
+            "delivered": self.delivered,
+            "failures": self.failures,
+            "consumers": {
+                name: {"last_event_id": offsets.get(name, 0), "lag": last_event_id - offsets.get(name, 0)}
+                for name in self._consumers
+            },
+        }
+
+outbox_relay = OutboxRelay(
+    AsyncSessionLocal,
+    batch_size=settings.OUTBOX_BATCH_SIZE,
+    poll_seconds=settings.OUTBOX_POLL_SECONDS,
+    retention_hours=settings.OUTBOX_RETENTION_HOURS,
+)
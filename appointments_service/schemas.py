@@ -1,7 +1,20 @@
 from pydantic import BaseModel, validator
-from typing import Optional, List
+from typing import Optional, List, Literal
 from datetime import datetime, timezone
 
+# Duración máxima permitida para una cita (8 horas)
+MAX_DURATION_MINUTES = 480
+
+# Tamaño de página de los listados de citas
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+# Rango máximo de la búsqueda de horarios libres (un mes)
+MAX_FREE_SLOT_RANGE_DAYS = 31
+
+# Cantidad máxima de citas por lote
+MAX_BATCH_SIZE = 200
+
 # Esquemas para crear citas
 class AppointmentCreate(BaseModel):
     doctor_id: int
@@ -26,7 +39,7 @@ class AppointmentCreate(BaseModel):
     
     @validator('duration_minutes')
     def validate_duration(cls, v):
-        if v <= 0 or v > 480:  # Máximo 8 horas
+        if v <= 0 or v > MAX_DURATION_MINUTES:
             raise ValueError('La duración debe ser entre 1 y 480 minutos')
         return v
 
@@ -54,7 +67,7 @@ class AppointmentUpdate(BaseModel):
     
     @validator('duration_minutes')
     def validate_duration(cls, v):
-        if v and (v <= 0 or v > 480):
+        if v and (v <= 0 or v > MAX_DURATION_MINUTES):
             raise ValueError('La duración debe ser entre 1 y 480 minutos')
         return v
 
@@ -73,6 +86,36 @@ class AppointmentResponse(BaseModel):
     class Config:
         from_attributes = True
 
+# Creación de citas en lote
+class AppointmentBatchCreate(BaseModel):
+    items: List[AppointmentCreate]
+    # all_or_nothing: si alguna cita falla no se crea ninguna
+    # best_effort: se crean las citas válidas y se informan las rechazadas
+    mode: Literal["all_or_nothing", "best_effort"] = "all_or_nothing"
+    
+    @validator('items')
+    def validate_items(cls, v):
+        if not v or len(v) > MAX_BATCH_SIZE:
+            raise ValueError(f'El lote debe tener entre 1 y {MAX_BATCH_SIZE} citas')
+        return v
+
+class AppointmentBatchItemResult(BaseModel):
+    index: int
+    created: bool
+    appointment: Optional[AppointmentResponse] = None
+    error: Optional[str] = None
+
+class AppointmentBatchResponse(BaseModel):
+    mode: str
+    created: int
+    failed: int
+    results: List[AppointmentBatchItemResult]
+
+# Horario libre de un médico
+class FreeSlot(BaseModel):
+    start: datetime
+    end: datetime
+
 # Esquema para información de usuario (desde auth_service)
 class UserInfo(BaseModel):
     id: int
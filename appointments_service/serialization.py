@@ -0,0 +1,57 @@
+"""
+Serialización rápida de listados de citas.
+
+Los listados construían un AppointmentResponse por fila y FastAPI los volvía a
+validar y codificar a través de response_model. Aquí las filas se codifican a
+JSON en una sola pasada (orjson si está instalado, json en su defecto) y se
+devuelven como bytes, con exactamente la misma salida que producía el modelo:
+mismas claves y orden, datetimes en formato ISO 8601 con "Z" para UTC y JSON
+compacto en UTF-8.
+"""
+import json
+from datetime import datetime
+from typing import Iterable
+
+from fastapi.responses import Response
+
+from schemas import AppointmentResponse
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson es opcional
+    orjson = None
+
+# Campos en el orden en que AppointmentResponse los serializa
+APPOINTMENT_FIELDS = tuple(AppointmentResponse.model_fields)
+
+def _json_default(value):
+    """Codificar datetimes como lo hace pydantic (UTC con sufijo "Z")"""
+    if isinstance(value, datetime):
+        text = value.isoformat()
+        return text[:-6] + "Z" if text.endswith("+00:00") else text
+    raise TypeError(f"Tipo no serializable: {type(value).__name__}")
+
+def appointments_to_json(appointments: Iterable) -> bytes:
+    """Codificar citas (filas u objetos con los campos de AppointmentResponse) a JSON"""
+    content = [
+        {field: getattr(appointment, field) for field in APPOINTMENT_FIELDS}
+        for appointment in appointments
+    ]
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_UTC_Z)
+    return json.dumps(
+        content, default=_json_default, ensure_ascii=False, allow_nan=False, separators=(",", ":")
+    ).encode("utf-8")
+
+def appointment_event_json(event_type: str, appointment) -> bytes:
+    """Mensaje SSE con el tipo de evento y la cita serializada como en los listados"""
+    data = appointments_to_json([appointment])[1:-1]
+    return b"event: appointment." + event_type.encode() + b"\ndata: " + data + b"\n\n"
+
+class AppointmentListResponse(Response):
+    """Respuesta JSON con el listado ya codificado (sin pasar por response_model)"""
+
+    media_type = "application/json"
+
+    def __init__(self, appointments: Iterable, **kwargs):
+        super().__init__(content=appointments_to_json(appointments), **kwargs)
@@ -0,0 +1,70 @@
+"""
+Caché de payloads JWT ya verificados.
+
+La app móvil envía el mismo token en cada petición durante toda su vigencia;
+repetir jwt.decode (firma y claims) en cada una es trabajo redundante. Los
+payloads verificados se guardan en una caché LRU acotada, indexada por el
+SHA-256 del token, y cada entrada vence a más tardar en el "exp" del token.
+Un fallo de caché siempre recurre a la verificación completa y los tokens
+inválidos nunca se guardan.
+"""
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+from config import settings
+
+class TokenCache:
+    """Caché LRU de payloads verificados con vencimiento por token"""
+
+    def __init__(self, max_size: int, max_ttl: float):
+        self.max_size = max_size
+        self.max_ttl = max_ttl
+        self._entries: "OrderedDict[bytes, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token: str) -> Optional[Any]:
+        key = self._key(token)
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= time.time():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, token: str, value: Any, exp: Optional[float]) -> None:
+        """Guardar value hasta exp (epoch) o como máximo max_ttl segundos"""
+        if self.max_size <= 0:
+            return
+        expires_at = time.time() + self.max_ttl
+        if isinstance(exp, (int, float)):
+            expires_at = min(expires_at, exp)
+        key = self._key(token)
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+token_cache = TokenCache(settings.JWT_CACHE_MAX_SIZE, settings.JWT_CACHE_MAX_TTL_SECONDS)
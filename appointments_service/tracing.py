@@ -0,0 +1,342 @@
+"""
+Trazas distribuidas con contexto W3C (traceparent), sin dependencias.
+
+TracingMiddleware abre un span por petición, continuando la traza si llega una
+cabecera traceparent; los spans hijos (consultas SQL, bcrypt, verificación de
+conflictos, llamadas HTTP) cuelgan del span actual guardado en una ContextVar,
+y las llamadas salientes propagan traceparent para que el otro servicio
+continúe la misma traza.
+
+El muestreo se decide al inicio de la traza (TRACE_SAMPLE_RATIO) y se respeta
+la decisión del servicio que llama. Las peticiones no muestreadas no crean
+spans: solo se propaga el contexto. Al terminar cada petición muestreada sus
+spans se escriben como una línea OTLP/JSON (resourceSpans) en
+TRACE_EXPORT_PATH, el formato que lee el receptor "otlpjson" del collector de
+OpenTelemetry, para analizar la latencia entre servicios sin un collector
+activo. La escritura corre en un hilo aparte: la petición solo encola sus
+spans y el archivo no bloquea el event loop.
+"""
+import atexit
+import functools
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from contextvars import ContextVar
+from typing import List, Optional
+
+from sqlalchemy import event
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+TRACEPARENT_HEADER = "traceparent"
+
+# Trazas pendientes de escribir; con la cola llena (disco lento) se descartan
+EXPORT_QUEUE_SIZE = 10000
+
+# Tipos de span de OTLP
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+SPAN_KIND_CLIENT = 3
+
+STATUS_UNSET = 0
+STATUS_ERROR = 2
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+class Span:
+    """Operación con tiempo de inicio y fin dentro de una traza"""
+
+    __slots__ = ("name", "kind", "trace_id", "span_id", "parent_id", "sampled",
+                 "start_ns", "end_ns", "attributes", "status", "_trace_spans")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], sampled: bool,
+                 kind: int = SPAN_KIND_INTERNAL, trace_spans: Optional[List["Span"]] = None):
+        self.name = name
+        self.kind = kind
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+        self.attributes = {}
+        self.status = STATUS_UNSET
+        # Spans de esta petición en este proceso (compartida con los hijos)
+        self._trace_spans = trace_spans if trace_spans is not None else []
+        if sampled:
+            self._trace_spans.append(self)
+
+    def set_attribute(self, key: str, value) -> None:
+        if self.sampled:
+            self.attributes[key] = value
+
+    def set_error(self, exc: BaseException) -> None:
+        if self.sampled:
+            self.status = STATUS_ERROR
+            self.attributes["exception.type"] = type(exc).__name__
+
+    def end(self) -> None:
+        self.end_ns = time.time_ns()
+
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def to_otlp(self) -> dict:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns or time.time_ns()),
+            "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in self.attributes.items()],
+            "status": {"code": self.status},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+def parse_traceparent(value: Optional[str]):
+    """(trace_id, parent_id, sampled) de una cabecera traceparent válida, o None"""
+    if not value:
+        return None
+    parts = value.strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        int(parts[1], 16), int(parts[2], 16)
+        flags = int(parts[3], 16)
+    except ValueError:
+        return None
+    if parts[1] == "0" * 32 or parts[2] == "0" * 16:
+        return None
+    return parts[1], parts[2], bool(flags & 1)
+
+class SpanExporter:
+    """
+    Escribe los spans de cada petición como una línea OTLP/JSON desde un hilo
+    propio. export() solo encola; el hilo escribe por lotes lo acumulado y al
+    terminar el proceso se escribe lo pendiente.
+    """
+
+    def __init__(self, service_name: str, path: str, max_queue: int = EXPORT_QUEUE_SIZE):
+        self.service_name = service_name
+        self.path = path
+        self.exported = 0
+        self.dropped = 0
+        self._queue = queue.Queue(max_queue)
+        self._writer: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def export(self, spans: List[Span]) -> None:
+        if not spans or not self.path:
+            return
+        self._start_writer()
+        try:
+            self._queue.put_nowait(spans)
+        except queue.Full:
+            self.dropped += len(spans)
+
+    def flush(self) -> None:
+        """Esperar a que se escriban las trazas encoladas"""
+        if self._writer is not None:
+            self._queue.join()
+
+    def _start_writer(self) -> None:
+        if self._writer is None:
+            with self._lock:
+                if self._writer is None:
+                    self._writer = threading.Thread(target=self._write_loop, name="span-exporter", daemon=True)
+                    self._writer.start()
+                    atexit.register(self.flush)
+
+    def _write_loop(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write_batch(batch)
+                self.exported += sum(len(spans) for spans in batch)
+            except Exception:
+                self.dropped += sum(len(spans) for spans in batch)
+                logger.warning("No se pudieron escribir las trazas en %s", self.path, exc_info=True)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write_batch(self, batch: List[List[Span]]) -> None:
+        resource = {"attributes": [{"key": "service.name", "value": {"stringValue": self.service_name}}]}
+        lines = [json.dumps({"resourceSpans": [{
+            "resource": resource,
+            "scopeSpans": [{"scope": {"name": "tracing"}, "spans": [span.to_otlp() for span in spans]}],
+        }]}, ensure_ascii=False) + "\n" for spans in batch]
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.writelines(lines)
+
+class Tracer:
+    """Creación de spans con muestreo por traza"""
+
+    def __init__(self, sample_ratio: float, exporter: SpanExporter):
+        self.sample_ratio = sample_ratio
+        self.exporter = exporter
+
+    def start_trace(self, name: str, traceparent: Optional[str] = None, kind: int = SPAN_KIND_SERVER) -> Span:
+        """Span raíz de la petición: continúa la traza entrante o empieza una nueva"""
+        parent = parse_traceparent(traceparent)
+        if parent:
+            trace_id, parent_id, sampled = parent
+        else:
+            trace_id, parent_id = os.urandom(16).hex(), None
+            sampled = self.sample_ratio > 0 and random.random() < self.sample_ratio
+        return Span(name, trace_id, parent_id, sampled, kind)
+
+    def start_span(self, name: str, kind: int = SPAN_KIND_INTERNAL) -> Optional[Span]:
+        """Span hijo del actual; None si no hay traza o no se muestrea"""
+        parent = current_span.get()
+        if parent is None or not parent.sampled:
+            return None
+        return Span(name, parent.trace_id, parent.span_id, True, kind, parent._trace_spans)
+
+    def finish_trace(self, span: Span) -> None:
+        span.end()
+        if span.sampled:
+            self.exporter.export(span._trace_spans)
+
+    def span(self, name: str, kind: int = SPAN_KIND_INTERNAL, **attributes):
+        return _SpanScope(self, name, kind, attributes)
+
+    def traced(self, name: str):
+        """Decorador: ejecutar la función async dentro de un span"""
+        def decorator(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return await func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def inject(self, headers: dict) -> dict:
+        """Agregar traceparent a las cabeceras de una llamada saliente"""
+        span = current_span.get()
+        if span is not None:
+            headers[TRACEPARENT_HEADER] = span.traceparent()
+        return headers
+
+class _SpanScope:
+    """Context manager de un span hijo (no hace nada si la traza no se muestrea)"""
+
+    __slots__ = ("tracer", "name", "kind", "attributes", "span", "token")
+
+    def __init__(self, tracer: Tracer, name: str, kind: int, attributes: dict):
+        self.tracer = tracer
+        self.name = name
+        self.kind = kind
+        self.attributes = attributes
+        self.span = None
+        self.token = None
+
+    def __enter__(self) -> Optional[Span]:
+        self.span = self.tracer.start_span(self.name, self.kind)
+        if self.span is not None:
+            self.span.attributes.update(self.attributes)
+            self.token = current_span.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.span is not None:
+            if exc is not None:
+                self.span.set_error(exc)
+            self.span.end()
+            current_span.reset(self.token)
+        return False
+
+def trace_engine(engine) -> None:
+    """Span por sentencia SQL (db.statement) en un engine o el sync_engine de uno asíncrono"""
+    engine = getattr(engine, "sync_engine", engine)
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        span = tracer.start_span("db.query", SPAN_KIND_CLIENT)
+        if span is not None:
+            span.attributes["db.system"] = conn.dialect.name
+            span.attributes["db.statement"] = " ".join(statement.split())[:500]
+        conn.info.setdefault("trace_spans", []).append(span)
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        spans = conn.info.get("trace_spans")
+        span = spans.pop() if spans else None
+        if span is not None:
+            span.end()
+
+    def handle_error(exception_context):
+        connection = exception_context.connection
+        spans = connection.info.get("trace_spans") if connection is not None else None
+        span = spans.pop() if spans else None
+        if span is not None:
+            span.set_error(exception_context.original_exception)
+            span.end()
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", after_cursor_execute)
+    event.listen(engine, "handle_error", handle_error)
+
+class TracingMiddleware:
+    """Middleware ASGI: span de servidor por petición con el contexto entrante"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        traceparent = None
+        for name, value in scope.get("headers", ()):
+            if name == b"traceparent":
+                traceparent = value.decode("latin-1")
+                break
+        span = tracer.start_trace(f"{scope['method']} {scope['path']}", traceparent)
+        token = current_span.set(span)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                span.set_attribute("http.status_code", message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception as exc:
+            span.set_error(exc)
+            raise
+        finally:
+            current_span.reset(token)
+            if span.sampled:
+                route = scope.get("route")
+                if route is not None:
+                    span.name = f"{scope['method']} {route.path}"
+                span.attributes["http.method"] = scope["method"]
+                span.attributes["http.target"] = scope["path"]
+            tracer.finish_trace(span)
+
+tracer = Tracer(
+    sample_ratio=settings.TRACE_SAMPLE_RATIO,
+    exporter=SpanExporter(settings.TRACE_SERVICE_NAME, settings.TRACE_EXPORT_PATH),
+)
@@ -0,0 +1,139 @@
+"""
+Cliente del servicio de autenticación para obtener información de usuarios.
+
+Se reutiliza un único httpx.AsyncClient con keep-alive y timeouts explícitos,
+los UserInfo se guardan en una caché TTL + LRU y las consultas de varios
+usuarios se resuelven en lote con POST /users/batch (una petición por cada
+USERS_BATCH_SIZE IDs, en paralelo). Los fallos de red se registran y se tratan
+como usuarios no disponibles (None), sin ocultar errores de programación.
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
+
+import httpx
+
+from config import settings
+from schemas import UserInfo
+from tracing import tracer, SPAN_KIND_CLIENT
+
+logger = logging.getLogger(__name__)
+
+# IDs por petición a /users/batch (auth_service rechaza más de MAX_USER_BATCH_SIZE = 500)
+USERS_BATCH_SIZE = 500
+
+class TTLCache:
+    """Caché LRU acotada cuyas entradas expiran tras ttl segundos"""
+
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries: "OrderedDict[object, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key, value) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+class UsersClient:
+    """Acceso a /users del servicio de autenticación con conexión compartida y caché"""
+
+    def __init__(self, base_url: str, timeout: float, max_connections: int, cache: TTLCache):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.cache = cache
+        self.requests = 0
+        self.errors = 0
+        self._client: Optional[httpx.AsyncClient] = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=httpx.Timeout(self.timeout),
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                ),
+            )
+        return self._client
+
+    async def get_users(self, user_ids: Iterable[int], token: str) -> Dict[int, UserInfo]:
+        """Resolver varios IDs: los cacheados sin red y el resto en lotes de USERS_BATCH_SIZE"""
+        found: Dict[int, UserInfo] = {}
+        missing = []
+        for user_id in dict.fromkeys(user_ids):
+            user = self.cache.get(user_id)
+            if user is None:
+                missing.append(user_id)
+            else:
+                found[user_id] = user
+        if not missing:
+            return found
+
+        batches = [missing[i:i + USERS_BATCH_SIZE] for i in range(0, len(missing), USERS_BATCH_SIZE)]
+        for users in await asyncio.gather(*(self._fetch_batch(batch, token) for batch in batches)):
+            for user_data in users:
+                user = UserInfo(**user_data)
+                self.cache.set(user.id, user)
+                found[user.id] = user
+        return found
+
+    async def _fetch_batch(self, user_ids: List[int], token: str) -> list:
+        """Una petición a /users/batch; ante un fallo de red, ningún usuario del lote"""
+        self.requests += 1
+        try:
+            with tracer.span("auth_service POST /users/batch", SPAN_KIND_CLIENT, **{"users.count": len(user_ids)}):
+                response = await self._get_client().post(
+                    "/users/batch",
+                    json={"ids": user_ids},
+                    headers=tracer.inject({"Authorization": f"Bearer {token}"}),
+                )
+                response.raise_for_status()
+        except httpx.HTTPError as e:
+            self.errors += 1
+            logger.warning("No se pudo consultar usuarios en auth_service: %s", e)
+            return []
+        return response.json()
+
+    async def get_user(self, user_id: int, token: str) -> Optional[UserInfo]:
+        """Resolver un único usuario (usa la caché y la misma ruta en lote)"""
+        return (await self.get_users([user_id], token)).get(user_id)
+
+    def stats(self) -> dict:
+        return {"requests": self.requests, "errors": self.errors, "cache": self.cache.stats()}
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+users_client = UsersClient(
+    base_url=settings.AUTH_SERVICE_URL,
+    timeout=settings.AUTH_SERVICE_TIMEOUT_SECONDS,
+    max_connections=settings.AUTH_SERVICE_MAX_CONNECTIONS,
+    cache=TTLCache(settings.USER_CACHE_TTL_SECONDS, settings.USER_CACHE_MAX_SIZE),
+)
@@ -1,34 +1,166 @@
-from datetime import datetime, timedelta
-from typing import Optional
+from datetime import datetime, timedelta, timezone
+from typing import Optional, List, Tuple
+import logging
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from sqlalchemy.orm import Session
+import anyio
 from database import User
-from schemas import TokenData
+from schemas import TokenData, UserResponse
 from config import settings
+from hashing import hashing_pool, password_context
+from metrics import registry
+from token_cache import token_cache
+from user_cache import user_cache
+from tracing import tracer
 
-# Configuración de encriptación
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+logger = logging.getLogger(__name__)
+
+# Configuración de encriptación (esquema y costo desde Settings)
+pwd_context = password_context()
+
+PASSWORD_REHASHES = registry.counter(
+    "password_rehash_total", "Hashes actualizados al iniciar sesión", ("outcome",)
+)
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verificar contraseña plana contra hash"""
     return pwd_context.verify(plain_password, hashed_password)
 
+def verify_and_update_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """
+    Verificar contraseña y, si el hash usa otro esquema o costo que el
+    configurado, devolver también el hash nuevo (reutiliza la contraseña plana
+    que ya tenemos en el login)
+    """
+    if not settings.PASSWORD_REHASH_ON_LOGIN:
+        return pwd_context.verify(plain_password, hashed_password), None
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
 def get_password_hash(password: str) -> str:
     """Obtener hash de contraseña"""
     return pwd_context.hash(password)
 
+async def warm_up_hashing() -> None:
+    """
+    Crear el pool de hashing y cargar bcrypt en él antes del primer login. El
+    hash de prueba también da la primera medida de latencia con la que el pool
+    estima la espera en cola desde la primera ráfaga.
+    """
+    await hashing_pool.run(get_password_hash, "warm-up")
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """Verificar contraseña en el pool de hashing (no bloquea el event loop)"""
+    return await hashing_pool.run(verify_password, plain_password, hashed_password)
+
+async def verify_and_update_password_async(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """Verificar y, si corresponde, recalcular el hash en el pool de hashing"""
+    return await hashing_pool.run(verify_and_update_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password: str) -> str:
+    """Obtener hash de contraseña en el pool de hashing (no bloquea el event loop)"""
+    return await hashing_pool.run(get_password_hash, password)
+
 def get_user_by_email(db: Session, email: str) -> Optional[User]:
     """Obtener usuario por email"""
     return db.query(User).filter(User.email == email).first()
 
-def authenticate_user(db: Session, email: str, password: str) -> Optional[User]:
-    """Autenticar usuario con email y contraseña"""
+def get_user_by_id(db: Session, user_id: int) -> Optional[User]:
+    """Obtener usuario por ID"""
+    return db.get(User, user_id)
+
+def get_users_by_ids(db: Session, user_ids: List[int]) -> List[User]:
+    """Obtener varios usuarios por ID en una sola consulta (se omiten los inexistentes)"""
+    if not user_ids:
+        return []
+    return db.query(User).filter(User.id.in_(set(user_ids))).all()
+
+def get_cached_user(db: Session, email: str) -> Optional[UserResponse]:
+    """Obtener usuario por email pasando por la caché de usuarios autenticados"""
+    user = user_cache.get(email)
+    if user is None:
+        db_user = get_user_by_email(db, email)
+        if db_user is None:
+            return None
+        user = UserResponse.from_orm(db_user)
+        user_cache.set(user)
+    return user
+
+def user_from_token_claims(token_data: TokenData, max_age_seconds: int) -> Optional[UserResponse]:
+    """Construir el usuario desde los claims si el token es reciente y los trae completos"""
+    if max_age_seconds <= 0 or token_data.issued_at is None:
+        return None
+    if datetime.now(timezone.utc) - token_data.issued_at > timedelta(seconds=max_age_seconds):
+        return None
+    if None in (token_data.user_id, token_data.role, token_data.first_name,
+                token_data.last_name, token_data.created_at):
+        return None
+    return UserResponse(
+        id=token_data.user_id,
+        email=token_data.email,
+        first_name=token_data.first_name,
+        last_name=token_data.last_name,
+        role=token_data.role,
+        created_at=token_data.created_at
+    )
+
+# Hilos para las consultas de /login y /register: una ráfaga de credenciales no
+# ocupa todo el threadpool que comparten /me y /users (se crea dentro del event loop)
+_credential_limiter: Optional[anyio.CapacityLimiter] = None
+
+async def run_credential_query(func, *args):
+    """Ejecutar una consulta de /login o /register en su propio grupo acotado de hilos"""
+    global _credential_limiter
+    if _credential_limiter is None:
+        _credential_limiter = anyio.CapacityLimiter(settings.CREDENTIAL_DB_THREADS)
+    return await anyio.to_thread.run_sync(lambda: func(*args), limiter=_credential_limiter)
+
+def find_user_and_release(db: Session, email: str) -> Optional[User]:
+    """Buscar un usuario por email y devolver la conexión al pool (el User queda desacoplado)"""
     user = get_user_by_email(db, email)
+    db.close()
+    return user
+
+def store_rehash(db: Session, user_id: int, old_hash: str, new_hash: str) -> bool:
+    """
+    Guardar el hash recalculado solo si el usuario conserva el hash verificado:
+    un cambio de contraseña concurrente no se pisa con el hash de la anterior
+    """
+    try:
+        updated = (
+            db.query(User)
+            .filter(User.id == user_id, User.hashed_password == old_hash)
+            .update({User.hashed_password: new_hash}, synchronize_session=False)
+        )
+        db.commit()
+        return bool(updated)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+async def authenticate_user(db: Session, email: str, password: str) -> Optional[User]:
+    """Autenticar usuario con email y contraseña"""
+    # La consulta corre fuera del event loop y la conexión se libera antes de esperar
+    # a bcrypt: una ráfaga de logins no agota el pool ni bloquea el event loop
+    user = await run_credential_query(find_user_and_release, db, email)
     if not user:
         return None
-    if not verify_password(password, user.hashed_password):
+    valid, new_hash = await verify_and_update_password_async(password, user.hashed_password)
+    if not valid:
         return None
+    if new_hash:
+        # Hash con otro esquema o costo: se migra ahora; si falla, el login sigue
+        # siendo válido y se reintenta en el próximo inicio de sesión
+        try:
+            stored = await run_credential_query(store_rehash, db, user.id, user.hashed_password, new_hash)
+        except Exception:
+            PASSWORD_REHASHES.labels("error").inc()
+            logger.warning("No se pudo guardar el hash actualizado del usuario %s", user.id, exc_info=True)
+        else:
+            PASSWORD_REHASHES.labels("updated" if stored else "skipped").inc()
+            if stored:
+                user.hashed_password = new_hash
     return user
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
@@ -38,25 +170,43 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
         expire = datetime.utcnow() + expires_delta
     else:
         expire = datetime.utcnow() + timedelta(minutes=15)
-    to_encode.update({"exp": expire})
+    to_encode.update({"exp": expire, "iat": datetime.utcnow()})
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
     return encoded_jwt
 
-def verify_token(token: str) -> Optional[TokenData]:
-    """Verificar y decodificar token JWT"""
+def decode_token(token: str) -> Optional[TokenData]:
+    """Verificar y decodificar token JWT (sin caché)"""
     try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+        with tracer.span("jwt.decode"):
+            payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
         email: str = payload.get("sub")
         if email is None:
             return None
-        token_data = TokenData(email=email)
+        iat = payload.get("iat")
+        token_data = TokenData(
+            email=email,
+            user_id=payload.get("user_id"),
+            role=payload.get("role"),
+            first_name=payload.get("first_name"),
+            last_name=payload.get("last_name"),
+            created_at=payload.get("created_at"),
+            issued_at=datetime.fromtimestamp(iat, timezone.utc) if isinstance(iat, (int, float)) else None
+        )
+        token_cache.set(token, token_data, payload.get("exp"))
         return token_data
     except JWTError:
         return None
 
-def create_user(db: Session, user_data: dict) -> User:
+def verify_token(token: str) -> Optional[TokenData]:
+    """Verificar token JWT usando la caché de payloads verificados"""
+    token_data = token_cache.get(token)
+    if token_data is not None:
+        return token_data
+    return decode_token(token)
+
+async def create_user(db: Session, user_data: dict) -> User:
     """Crear nuevo usuario en la base de datos"""
-    hashed_password = get_password_hash(user_data["password"])
+    hashed_password = await get_password_hash_async(user_data["password"])
     db_user = User(
         email=user_data["email"],
         hashed_password=hashed_password,
@@ -64,6 +214,9 @@ def create_user(db: Session, user_data: dict) -> User:
         last_name=user_data["last_name"],
         role=user_data["role"]
     )
+    return await run_credential_query(_insert_user, db, db_user)
+
+def _insert_user(db: Session, db_user: User) -> User:
     db.add(db_user)
     db.commit()
     db.refresh(db_user)
@@ -0,0 +1,102 @@
+"""
+Calibrar el costo del hash de contraseñas en el hardware actual.
+
+Mide la mediana de verificación para costos crecientes (rondas de bcrypt o
+time_cost de argon2 con la memoria configurada) y elige el mayor costo cuya
+verificación no supera --target-ms. Imprime las variables de entorno a
+configurar y los logins por segundo que sostiene el pool de hashing con ese
+costo (HASHING_WORKERS / latencia). Los hashes existentes se migran solos al
+iniciar sesión (PASSWORD_REHASH_ON_LOGIN).
+
+Uso:
+    python calibrate_hashing.py --target-ms 250
+    python calibrate_hashing.py --scheme argon2 --target-ms 100 --json calibration.json
+"""
+import argparse
+import json
+import statistics
+import time
+
+from passlib.exc import MissingBackendError
+
+from config import settings
+from hashing import password_context
+
+BCRYPT_ROUNDS = range(4, 17)
+ARGON2_TIME_COSTS = range(1, 11)
+
+def verify_ms(context, repeat: int) -> float:
+    """Mediana en milisegundos de verificar una contraseña con el contexto dado"""
+    hashed = context.hash("calibration-password")
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        context.verify("calibration-password", hashed)
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+def candidates(scheme: str, memory_kib: int):
+    """(costo, contexto) en orden creciente de costo"""
+    if scheme == "bcrypt":
+        for rounds in BCRYPT_ROUNDS:
+            yield rounds, password_context("bcrypt", bcrypt_rounds=rounds)
+    else:
+        for time_cost in ARGON2_TIME_COSTS:
+            yield time_cost, password_context("argon2", argon2_memory_kib=memory_kib, argon2_time_cost=time_cost)
+
+def calibrate(scheme: str, target_ms: float, repeat: int, memory_kib: int) -> dict:
+    measurements = []
+    chosen = None
+    for cost, context in candidates(scheme, memory_kib):
+        latency = verify_ms(context, repeat)
+        measurements.append({"cost": cost, "verify_ms": round(latency, 2)})
+        print(f"  costo {cost:>2}: {latency:8.1f} ms")
+        if latency > target_ms:
+            break  # cada costo siguiente es más lento
+        chosen = measurements[-1]
+    if chosen is None:
+        chosen = measurements[0]
+        print(f"⚠️  Ni el costo mínimo cumple {target_ms} ms; se usa {chosen['cost']}")
+
+    if scheme == "bcrypt":
+        env = {"PASSWORD_HASH_SCHEME": "bcrypt", "BCRYPT_ROUNDS": chosen["cost"]}
+    else:
+        env = {"PASSWORD_HASH_SCHEME": "argon2", "ARGON2_MEMORY_COST_KIB": memory_kib,
+               "ARGON2_TIME_COST": chosen["cost"]}
+    return {
+        "scheme": scheme,
+        "target_ms": target_ms,
+        "cost": chosen["cost"],
+        "verify_ms": chosen["verify_ms"],
+        "logins_per_second": round(settings.HASHING_WORKERS * 1000 / chosen["verify_ms"], 1),
+        "env": env,
+        "measurements": measurements,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scheme", choices=("bcrypt", "argon2"), default=settings.PASSWORD_HASH_SCHEME)
+    parser.add_argument("--target-ms", type=float, default=250.0, help="latencia máxima de una verificación")
+    parser.add_argument("--repeat", type=int, default=5, help="verificaciones por costo")
+    parser.add_argument("--memory-kib", type=int, default=settings.ARGON2_MEMORY_COST_KIB,
+                        help="memoria de argon2 (fija durante la calibración)")
+    parser.add_argument("--json", help="guardar el resultado en este archivo")
+    args = parser.parse_args()
+
+    print(f"🔐 Calibrando {args.scheme} para verificar en ≤ {args.target_ms} ms (mediana de {args.repeat})")
+    try:
+        result = calibrate(args.scheme, args.target_ms, args.repeat, args.memory_kib)
+    except MissingBackendError:
+        raise SystemExit(f"❌ {args.scheme} no está disponible: instalar argon2-cffi para usar argon2")
+    print(f"✅ Costo elegido: {result['cost']} ({result['verify_ms']} ms por verificación, "
+          f"~{result['logins_per_second']} logins/s con {settings.HASHING_WORKERS} workers de hashing)")
+    for name, value in result["env"].items():
+        print(f"  {name}={value}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+        print(f"✅ Resultado guardado en {args.json}")
+
+if __name__ == "__main__":
+    main()
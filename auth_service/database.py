@@ -1,12 +1,84 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Enum
+from sqlalchemy import create_engine, text, Column, Integer, String, DateTime, Enum, exc
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
 from sqlalchemy.sql import func
 import enum
+import time
 from config import settings
 
+class PoolWaitStats:
+    """Tiempo de espera por una conexión del pool y cantidad de timeouts"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.timeouts = 0
+
+    def observe(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def as_dict(self) -> dict:
+        return {
+            "checkouts": self.count,
+            "avg_wait_ms": round(self.total / self.count * 1000, 3) if self.count else 0.0,
+            "max_wait_ms": round(self.max * 1000, 3),
+            "timeouts": self.timeouts,
+        }
+
+def timed_pool_class(base: type, stats: PoolWaitStats) -> type:
+    """Subclase del pool que registra en stats la espera de cada checkout"""
+
+    def _do_get(self):
+        started_at = time.monotonic()
+        try:
+            return base._do_get(self)
+        except exc.TimeoutError:
+            stats.timeouts += 1
+            raise
+        finally:
+            stats.observe(time.monotonic() - started_at)
+
+    return type("Timed" + base.__name__, (base,), {"_do_get": _do_get})
+
+def engine_options(url: str, stats: PoolWaitStats) -> dict:
+    """Opciones de create_engine a partir de Settings (tamaño, overflow, timeout, recycle, pre-ping)"""
+    options = {"pool_pre_ping": settings.DB_POOL_PRE_PING, "pool_recycle": settings.DB_POOL_RECYCLE}
+    url = make_url(url)
+    pool_class = url.get_dialect().get_pool_class(url)
+    # SQLite en memoria usa pools de una sola conexión que no admiten dimensionamiento
+    if issubclass(pool_class, QueuePool):
+        options.update(
+            poolclass=timed_pool_class(pool_class, stats),
+            pool_size=settings.DB_POOL_SIZE,
+            max_overflow=settings.DB_MAX_OVERFLOW,
+            pool_timeout=settings.DB_POOL_TIMEOUT,
+        )
+    return options
+
+def pool_status(engine, stats: PoolWaitStats) -> dict:
+    """Estado del pool: conexiones en uso, libres, overflow y espera por checkout"""
+    pool = engine.pool
+    status = {"pool": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        status.update(
+            size=pool.size(),
+            checked_in=pool.checkedin(),
+            checked_out=pool.checkedout(),
+            overflow=max(pool.overflow(), 0),
+            max_overflow=settings.DB_MAX_OVERFLOW,
+        )
+    status.update(stats.as_dict())
+    return status
+
 # Configuración de SQLAlchemy
-engine = create_engine(settings.DATABASE_URL)
+pool_wait_stats = PoolWaitStats()
+engine = create_engine(settings.DATABASE_URL, **engine_options(settings.DATABASE_URL, pool_wait_stats))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
@@ -36,6 +108,11 @@ def get_db():
     finally:
         db.close()
 
-# Crear tablas
+# Crear tablas (solo desde migrate.py, nunca al importar la aplicación)
 def create_tables():
     Base.metadata.create_all(bind=engine)
+
+def warm_up():
+    """Abrir la primera conexión del pool para que no la pague la primera petición"""
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
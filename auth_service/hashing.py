@@ -0,0 +1,201 @@
+"""
+Pool acotado para el hash y la verificación de contraseñas.
+
+bcrypt consume decenas de milisegundos de CPU por operación; ejecutarlo dentro
+de los endpoints async bloquea el event loop (y con él /me y /health). Las
+operaciones se envían a un pool de hilos o procesos con un límite de cola: si
+el pool está saturado se rechaza de inmediato con HashingPoolSaturated para que
+la API responda 503 con Retry-After en lugar de acumular peticiones.
+
+Además de la cola llena, se rechaza cuando la espera estimada (operaciones por
+delante por la latencia reciente de bcrypt, repartidas entre los workers)
+supera HASHING_MAX_QUEUE_WAIT_SECONDS: si bcrypt se vuelve más lento porque la
+CPU está saturada la cola admitida se acorta sola.
+"""
+import asyncio
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Callable, Optional
+
+from passlib.context import CryptContext
+from passlib.exc import MissingBackendError
+from passlib.registry import get_crypt_handler
+
+from config import settings
+from metrics import registry
+from tracing import tracer
+
+# bcrypt tarda decenas o cientos de milisegundos según el costo configurado
+HASH_BUCKETS = (0.025, 0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 2.0, 5.0)
+
+PASSWORD_SCHEMES = ("bcrypt", "argon2")
+# Paquete que provee el backend de cada esquema
+SCHEME_PACKAGES = {"bcrypt": "bcrypt", "argon2": "argon2-cffi"}
+
+def password_context(
+    scheme: str = settings.PASSWORD_HASH_SCHEME,
+    bcrypt_rounds: int = settings.BCRYPT_ROUNDS,
+    argon2_memory_kib: int = settings.ARGON2_MEMORY_COST_KIB,
+    argon2_time_cost: int = settings.ARGON2_TIME_COST,
+    argon2_parallelism: int = settings.ARGON2_PARALLELISM,
+) -> CryptContext:
+    """
+    CryptContext que genera hashes con el esquema y costo indicados y sigue
+    verificando los del otro esquema. needs_update() marca los hashes de otro
+    esquema o con otro costo (mayor o menor), que se vuelven a calcular al
+    iniciar sesión. Sin el backend del esquema configurado falla aquí, al
+    arrancar, y no en el primer registro o login.
+    """
+    if scheme not in PASSWORD_SCHEMES:
+        raise ValueError(f"Esquema de hash no soportado: {scheme} (usar {', '.join(PASSWORD_SCHEMES)})")
+    try:
+        get_crypt_handler(scheme).get_backend()
+    except MissingBackendError:
+        raise MissingBackendError(
+            f"El esquema de hash {scheme} no está disponible: instalar {SCHEME_PACKAGES[scheme]}"
+        ) from None
+    return CryptContext(
+        schemes=[scheme] + [other for other in PASSWORD_SCHEMES if other != scheme],
+        deprecated="auto",
+        bcrypt__rounds=bcrypt_rounds,
+        bcrypt__min_desired_rounds=bcrypt_rounds,
+        bcrypt__max_desired_rounds=bcrypt_rounds,
+        argon2__memory_cost=argon2_memory_kib,
+        argon2__rounds=argon2_time_cost,
+        argon2__min_desired_rounds=argon2_time_cost,
+        argon2__max_desired_rounds=argon2_time_cost,
+        argon2__parallelism=argon2_parallelism,
+    )
+
+class HashingPoolSaturated(Exception):
+    """La cola del pool de hashing está llena"""
+
+    def __init__(self, retry_after: int):
+        super().__init__("Pool de hashing saturado")
+        self.retry_after = retry_after
+
+class _TimingStats:
+    """Acumulador simple de latencias (cantidad, total y máximo en segundos)"""
+
+    __slots__ = ("count", "total", "max")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def as_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "avg_ms": round(self.total / self.count * 1000, 3) if self.count else 0.0,
+            "max_ms": round(self.max * 1000, 3),
+        }
+
+def _timed_call(func: Callable, submitted_at: float, *args):
+    """Ejecutar func en el worker midiendo espera en cola y duración"""
+    started_at = time.monotonic()
+    result = func(*args)
+    return result, started_at - submitted_at, time.monotonic() - started_at
+
+class HashingPool:
+    """Ejecutor acotado para operaciones de hashing con métricas de latencia"""
+
+    def __init__(self, executor: str, workers: int, max_queue: int, retry_after: int, max_queue_wait: float = 0):
+        self.executor_kind = executor
+        self.workers = workers
+        self.max_queue = max_queue
+        self.max_queue_wait = max_queue_wait
+        self.retry_after = retry_after
+        self.recent_latency = 0.0  # media móvil exponencial de la duración de bcrypt
+        self.in_flight = 0  # en cola + en ejecución (solo se modifica desde el event loop)
+        self.rejected = 0
+        self.hash_latency = _TimingStats()
+        self.queue_wait = _TimingStats()
+        self.hash_histogram = registry.histogram(
+            "password_hash_duration_seconds", "Duración de bcrypt (hash o verificación)", buckets=HASH_BUCKETS
+        ).labels()
+        self.wait_histogram = registry.histogram(
+            "password_hash_queue_wait_seconds", "Espera en la cola del pool de hashing"
+        ).labels()
+        self._executor = None
+
+    def _get_executor(self):
+        if self._executor is None:
+            if self.executor_kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="hashing")
+        return self._executor
+
+    def check_admission(self) -> None:
+        """Lanzar HashingPoolSaturated si una operación nueva no sería admitida"""
+        if self.in_flight >= self.workers + self.max_queue:
+            self.rejected += 1
+            raise HashingPoolSaturated(self.retry_after)
+        expected_wait = self.expected_wait()
+        if self.max_queue_wait and expected_wait > self.max_queue_wait:
+            self.rejected += 1
+            raise HashingPoolSaturated(max(self.retry_after, math.ceil(expected_wait)))
+
+    async def run(self, func: Callable, *args):
+        """Ejecutar func(*args) en el pool o lanzar HashingPoolSaturated si está saturado"""
+        self.check_admission()
+
+        self.in_flight += 1
+        try:
+            with tracer.span("bcrypt", **{"bcrypt.operation": func.__name__}) as span:
+                loop = asyncio.get_running_loop()
+                result, waited, duration = await loop.run_in_executor(
+                    self._get_executor(), _timed_call, func, time.monotonic(), *args
+                )
+                if span is not None:
+                    span.set_attribute("bcrypt.queue_wait_ms", round(waited * 1000, 3))
+        finally:
+            self.in_flight -= 1
+
+        self.queue_wait.observe(waited)
+        self.hash_latency.observe(duration)
+        self.recent_latency = duration if not self.recent_latency else 0.8 * self.recent_latency + 0.2 * duration
+        self.wait_histogram.observe(waited)
+        self.hash_histogram.observe(duration)
+        return result
+
+    def expected_wait(self) -> float:
+        """Segundos que esperaría en cola una operación nueva, según la latencia reciente"""
+        ahead = self.in_flight - self.workers + 1
+        if ahead <= 0:
+            return 0.0
+        return ahead / self.workers * self.recent_latency
+
+    def stats(self) -> dict:
+        return {
+            "executor": self.executor_kind,
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "max_queue_wait_seconds": self.max_queue_wait,
+            "expected_wait_ms": round(self.expected_wait() * 1000, 3),
+            "in_flight": self.in_flight,
+            "rejected": self.rejected,
+            "hash_latency": self.hash_latency.as_dict(),
+            "queue_wait": self.queue_wait.as_dict(),
+        }
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+hashing_pool = HashingPool(
+    executor=settings.HASHING_EXECUTOR,
+    workers=settings.HASHING_WORKERS,
+    max_queue=settings.HASHING_MAX_QUEUE,
+    retry_after=settings.HASHING_RETRY_AFTER_SECONDS,
+    max_queue_wait=settings.HASHING_MAX_QUEUE_WAIT_SECONDS,
+)
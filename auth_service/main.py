@@ -1,60 +1,88 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import APIRouter, FastAPI, Depends, HTTPException, Request, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
+import logging
+from contextlib import asynccontextmanager
 from datetime import timedelta
-from typing import Optional
+from typing import List, Optional
 
 from config import settings
-from database import get_db, create_tables, User
-from schemas import UserCreate, UserLogin, UserResponse, Token
+from token_cache import token_cache
+from user_cache import user_cache
+from database import get_db, warm_up as warm_up_database, User, engine, pool_status, pool_wait_stats
+from schemas import UserCreate, UserLogin, UserResponse, UserBatchRequest, Token, TokenData, MAX_USER_BATCH_SIZE
+from hashing import hashing_pool, HashingPoolSaturated
+from rate_limit import rate_limiter, credentials_in_flight, RateLimitExceeded, CredentialsBusy, client_ip
+from query_stats import QueryStatsMiddleware, instrument_engine
+from tracing import TracingMiddleware, trace_engine
+from metrics import registry, MetricsMiddleware, pool_status_metrics, CONTENT_TYPE as METRICS_CONTENT_TYPE
 from auth import (
     authenticate_user, 
     create_access_token, 
     create_user, 
-    get_user_by_email,
-    verify_token
+    find_user_and_release,
+    run_credential_query,
+    get_cached_user,
+    user_from_token_claims,
+    get_user_by_id,
+    get_users_by_ids,
+    verify_token,
+    warm_up_hashing
 )
 
-# Crear tablas al iniciar
-create_tables()
+logger = logging.getLogger(__name__)
 
-# Inicializar FastAPI
-app = FastAPI(
-    title=settings.PROJECT_NAME,
-    version=settings.VERSION,
-    description=settings.DESCRIPTION,
-    docs_url="/docs",
-    redoc_url="/redoc"
-)
+# El esquema se crea y actualiza con el paso explícito `python migrate.py`:
+# importar este módulo o levantar un worker no se conecta a la base de datos.
 
-# Configurar CORS
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=[
-        "http://localhost:8100",
-        "http://localhost:8101", 
-        "http://localhost:8102",
-        "http://localhost:8103",
-        "http://localhost:8104",
-        "http://localhost:4200",
-        "*"
-    ],
-    allow_credentials=True,
-    allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-    allow_headers=["*"],
-)
+# Consultas SQL por petición y trazas (solo registra eventos en el engine)
+instrument_engine(engine)
+trace_engine(engine)
+
+def collect_service_metrics():
+    """Métricas que ya llevan el pool de conexiones, el pool de hashing y las cachés"""
+    yield from pool_status_metrics({"sync": pool_status(engine, pool_wait_stats)})
+    hashing = hashing_pool.stats()
+    yield "password_hash_in_flight", "gauge", "Operaciones de bcrypt en cola o en ejecución", [({}, hashing["in_flight"])]
+    yield "password_hash_rejected_total", "counter", "Operaciones rechazadas por pool saturado", [({}, hashing["rejected"])]
+    for cache_name, stats in (("tokens", token_cache.stats()), ("users", user_cache.stats())):
+        yield f"{cache_name}_cache_size", "gauge", "Entradas en caché", [({}, stats["size"])]
+        yield f"{cache_name}_cache_hits_total", "counter", "Aciertos de la caché", [({}, stats["hits"])]
+        yield f"{cache_name}_cache_misses_total", "counter", "Fallos de la caché", [({}, stats["misses"])]
+
+registry.add_collector(collect_service_metrics)
+
+# Pool de hashing saturado o demasiados logins en curso: responder rápido en lugar de encolar sin límite
+async def hashing_pool_saturated_handler(request: Request, exc: HashingPoolSaturated):
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "Servicio ocupado, intente nuevamente en unos segundos"},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+# Cliente o email con demasiados intentos: rechazar antes de tocar la base o bcrypt
+async def rate_limit_exceeded_handler(request: Request, exc: RateLimitExceeded):
+    return JSONResponse(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        content={"detail": "Demasiados intentos, intente nuevamente más tarde"},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+router = APIRouter()
+# Estado interno del worker; solo se publica con STATS_ENABLED
+stats_router = APIRouter(prefix="/stats")
 
 # Configuración de seguridad
 security = HTTPBearer()
 
-async def get_current_user(
-    credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: Session = Depends(get_db)
-) -> User:
-    """Obtener usuario actual desde el token JWT"""
-    token = credentials.credentials
-    token_data = verify_token(token)
+def get_token_data(
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+) -> TokenData:
+    """Verificar el token JWT de la petición"""
+    token_data = verify_token(credentials.credentials)
     
     if token_data is None:
         raise HTTPException(
@@ -62,8 +90,14 @@ async def get_current_user(
             detail="Token inválido",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    
-    user = get_user_by_email(db, email=token_data.email)
+    return token_data
+
+async def get_current_user(
+    token_data: TokenData = Depends(get_token_data),
+    db: Session = Depends(get_db)
+) -> UserResponse:
+    """Obtener usuario actual desde el token JWT (con caché de usuarios)"""
+    user = get_cached_user(db, email=token_data.email)
     if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -73,7 +107,7 @@ async def get_current_user(
     
     return user
 
-@app.get("/")
+@router.get("/")
 async def root():
     """Endpoint raíz - información del servicio"""
     return {
@@ -82,11 +116,25 @@ async def root():
         "status": "running"
     }
 
-@app.post("/register", response_model=UserResponse, status_code=status.HTTP_201_CREATED)
-async def register_user(user: UserCreate, db: Session = Depends(get_db)):
+async def credentials_slot():
+    """Ocupar un lugar entre las peticiones de credenciales en curso (503 si no hay)"""
+    with credentials_in_flight:
+        yield
+
+@router.post(
+    "/register",
+    response_model=UserResponse,
+    status_code=status.HTTP_201_CREATED,
+    dependencies=[Depends(credentials_slot)]
+)
+async def register_user(user: UserCreate, request: Request, db: Session = Depends(get_db)):
     """Registrar nuevo usuario"""
+    await rate_limiter.check_register(client_ip(request))
+    # Sin lugar en el pool de hashing se rechaza antes de consultar la base
+    hashing_pool.check_admission()
+    
     # Verificar si el usuario ya existe
-    existing_user = get_user_by_email(db, email=user.email)
+    existing_user = await run_credential_query(find_user_and_release, db, user.email)
     if existing_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -95,18 +143,23 @@ async def register_user(user: UserCreate, db: Session = Depends(get_db)):
     
     # Crear usuario
     try:
-        new_user = create_user(db, user.dict())
+        new_user = await create_user(db, user.dict())
         return UserResponse.from_orm(new_user)
+    except HashingPoolSaturated:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Error al crear usuario"
         )
 
-@app.post("/login", response_model=Token)
-async def login_user(user_credentials: UserLogin, db: Session = Depends(get_db)):
+@router.post("/login", response_model=Token, dependencies=[Depends(credentials_slot)])
+async def login_user(user_credentials: UserLogin, request: Request, db: Session = Depends(get_db)):
     """Autenticar usuario y devolver JWT"""
-    user = authenticate_user(db, user_credentials.email, user_credentials.password)
+    await rate_limiter.check_login(client_ip(request), user_credentials.email)
+    hashing_pool.check_admission()
+    
+    user = await authenticate_user(db, user_credentials.email, user_credentials.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -117,7 +170,15 @@ async def login_user(user_credentials: UserLogin, db: Session = Depends(get_db))
     # Crear token de acceso
     access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": user.email, "user_id": user.id, "role": user.role.value},
+        data={
+            "sub": user.email,
+            "user_id": user.id,
+            "role": user.role.value,
+            # Perfil para que /me pueda responder sin consultar la base
+            "first_name": user.first_name,
+            "last_name": user.last_name,
+            "created_at": user.created_at.isoformat() if user.created_at else None,
+        },
         expires_delta=access_token_expires
     )
     
@@ -127,16 +188,144 @@ async def login_user(user_credentials: UserLogin, db: Session = Depends(get_db))
         user=UserResponse.from_orm(user)
     )
 
-@app.get("/me", response_model=UserResponse)
-async def get_current_user_info(current_user: User = Depends(get_current_user)):
-    """Obtener información del usuario autenticado"""
-    return UserResponse.from_orm(current_user)
+@router.get("/me", response_model=UserResponse)
+async def get_current_user_info(
+    token_data: TokenData = Depends(get_token_data),
+    db: Session = Depends(get_db)
+):
+    """Obtener información del usuario autenticado (desde el token si es reciente)"""
+    user = user_from_token_claims(token_data, settings.ME_FROM_TOKEN_MAX_AGE_SECONDS)
+    if user is None:
+        user = await get_current_user(token_data, db)
+    return user
 
-@app.get("/health")
+@router.get("/users/{user_id}", response_model=UserResponse)
+async def get_user(
+    user_id: int,
+    db: Session = Depends(get_db),
+    current_user: UserResponse = Depends(get_current_user)
+):
+    """Obtener un usuario por ID"""
+    user = get_user_by_id(db, user_id)
+    if user is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Usuario no encontrado"
+        )
+    return UserResponse.from_orm(user)
+
+@router.post("/users/batch", response_model=List[UserResponse])
+async def get_users_batch(
+    request: UserBatchRequest,
+    db: Session = Depends(get_db),
+    current_user: UserResponse = Depends(get_current_user)
+):
+    """Obtener varios usuarios por ID en una sola petición (los inexistentes se omiten)"""
+    if len(request.ids) > MAX_USER_BATCH_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Se pueden consultar como máximo {MAX_USER_BATCH_SIZE} usuarios"
+        )
+    return [UserResponse.from_orm(user) for user in get_users_by_ids(db, request.ids)]
+
+@router.get("/health")
 async def health_check():
     """Endpoint de verificación de salud del servicio"""
     return {"status": "healthy", "service": "auth_service"}
 
+@router.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Métricas en formato de exposición de Prometheus"""
+    return Response(registry.render(), media_type=METRICS_CONTENT_TYPE)
+
+@stats_router.get("/hashing")
+async def hashing_stats():
+    """Métricas del pool de hashing: latencia de bcrypt, espera en cola y rechazos"""
+    return hashing_pool.stats()
+
+@stats_router.get("/rate-limit")
+async def rate_limit_stats():
+    """Métricas del límite de tasa: intentos rechazados por endpoint y alcance, y estado del store"""
+    return {**rate_limiter.stats(), "credentials": credentials_in_flight.stats()}
+
+@stats_router.get("/tokens")
+async def token_cache_stats():
+    """Métricas de la caché de tokens verificados: tamaño y tasa de aciertos"""
+    return token_cache.stats()
+
+@stats_router.get("/users")
+async def user_cache_stats():
+    """Métricas de la caché de usuarios autenticados: aciertos, fallos e invalidaciones"""
+    return user_cache.stats()
+
+@stats_router.get("/db")
+async def db_pool_stats():
+    """Métricas del pool de conexiones: conexiones en uso, overflow y espera por checkout"""
+    return pool_status(engine, pool_wait_stats)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Preparar el worker antes de aceptar peticiones y liberar recursos al terminar"""
+    if settings.STARTUP_WARMUP:
+        try:
+            await warm_up_hashing()
+            await run_in_threadpool(warm_up_database)
+        except Exception:
+            logger.warning("No se pudo completar el calentamiento del servicio", exc_info=True)
+    try:
+        yield
+    finally:
+        hashing_pool.shutdown()
+
+def create_app() -> FastAPI:
+    """
+    Construir la aplicación sin efectos secundarios: no crea tablas ni abre
+    conexiones. El pool de hashing y la conexión inicial se preparan en el
+    lifespan (uvicorn main:app o uvicorn --factory main:create_app).
+    """
+    app = FastAPI(
+        title=settings.PROJECT_NAME,
+        version=settings.VERSION,
+        description=settings.DESCRIPTION,
+        docs_url="/docs",
+        redoc_url="/redoc",
+        lifespan=lifespan
+    )
+
+    # Configurar CORS
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=[
+            "http://localhost:8100",
+            "http://localhost:8101", 
+            "http://localhost:8102",
+            "http://localhost:8103",
+            "http://localhost:8104",
+            "http://localhost:4200",
+            "*"
+        ],
+        allow_credentials=True,
+        allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
+        allow_headers=["*"],
+    )
+
+    # Peticiones por ruta, latencia y peticiones en curso (/metrics)
+    app.add_middleware(MetricsMiddleware, registry=registry)
+    # Consultas SQL por petición: cantidad, tiempo, log de lentas y posibles N+1
+    app.add_middleware(QueryStatsMiddleware)
+    # Trazas distribuidas: span por petición, por consulta SQL y traceparent entrante
+    app.add_middleware(TracingMiddleware)
+
+    app.add_exception_handler(HashingPoolSaturated, hashing_pool_saturated_handler)
+    app.add_exception_handler(CredentialsBusy, hashing_pool_saturated_handler)
+    app.add_exception_handler(RateLimitExceeded, rate_limit_exceeded_handler)
+    app.include_router(router)
+    if settings.STATS_ENABLED:
+        app.include_router(stats_router)
+    return app
+
+app = create_app()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,255 @@
+"""
+Métricas en formato de exposición de Prometheus (texto 0.0.4), sin dependencias.
+
+Contadores, gauges e histogramas con etiquetas. Cada combinación de etiquetas
+se crea una sola vez y luego se reutiliza, y un histograma guarda un contador
+por bucket que se acumula recién al exportar. Registrar una observación es una
+búsqueda binaria y un par de sumas bajo el lock de la serie: además del event
+loop, se registran valores desde hilos (eventos de cursor de SQLAlchemy en el
+threadpool y en los hilos de credenciales de auth_service), y un `+=` sin lock
+puede perder incrementos. Las métricas que ya llevan otros módulos (pools,
+cachés) se exportan con colectores que se leen solo al consultar /metrics.
+"""
+import math
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Buckets de latencia en segundos (los de prometheus_client)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+
+Sample = Tuple[str, Tuple[Tuple[str, str], ...], float]
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(labels: Iterable[Tuple[str, str]]) -> str:
+    labels = tuple(labels)
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        """Serie para esta combinación de etiquetas (se crea la primera vez)"""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} espera las etiquetas {self.labelnames}")
+            with self._lock:
+                # Dos hilos pueden crear la misma serie a la vez: gana la primera
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def samples(self) -> Iterable[Sample]:
+        for values, child in list(self._children.items()):
+            yield from child.samples(self.name, tuple(zip(self.labelnames, values)))
+
+class _CounterChild:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value += amount
+
+    def samples(self, name, labels):
+        yield name, labels, self.value
+
+class _GaugeChild(_CounterChild):
+    __slots__ = ()
+
+    def dec(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+class _HistogramChild:
+    __slots__ = ("upper_bounds", "counts", "sum", "_lock")
+
+    def __init__(self, upper_bounds: Tuple[float, ...]):
+        self.upper_bounds = upper_bounds
+        self.counts = [0] * (len(upper_bounds) + 1)  # el último es +Inf
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index = bisect_left(self.upper_bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def samples(self, name, labels):
+        with self._lock:
+            counts, total = list(self.counts), self.sum
+        cumulative = 0
+        for upper_bound, count in zip(self.upper_bounds + (math.inf,), counts):
+            cumulative += count
+            yield name + "_bucket", labels + (("le", _format_value(float(upper_bound))),), cumulative
+        yield name + "_sum", labels, total
+        yield name + "_count", labels, cumulative
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.upper_bounds = tuple(sorted(float(bucket) for bucket in buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.upper_bounds)
+
+# Un colector devuelve (nombre, tipo, ayuda, [(etiquetas, valor), ...]) por métrica
+Collector = Callable[[], Iterable[Tuple[str, str, str, List[Tuple[dict, float]]]]]
+
+class MetricsRegistry:
+    """Métricas del proceso y colectores que se exportan en /metrics"""
+
+    def __init__(self, prefix: str = ""):
+        self.prefix = prefix
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Collector] = []
+
+    def _register(self, cls, name: str, *args) -> _Metric:
+        # Registrar dos veces el mismo nombre devuelve la métrica existente
+        name = self.prefix + name
+        if name not in self._metrics:
+            self._metrics[name] = cls(name, *args)
+        return self._metrics[name]
+
+    def counter(self, name: str, documentation: str, labelnames=()) -> Counter:
+        return self._register(Counter, name, documentation, labelnames)
+
+    def gauge(self, name: str, documentation: str, labelnames=()) -> Gauge:
+        return self._register(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram, name, documentation, labelnames, buckets)
+
+    def add_collector(self, collector: Collector) -> None:
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        for collector in self._collectors:
+            for name, kind, documentation, samples in collector():
+                name = self.prefix + name
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(labels.items())} {_format_value(value)}")
+        lines.append("")
+        return "\n".join(lines)
+
+def pool_status_metrics(statuses: Dict[str, dict]):
+    """Métricas de pool_status() por pool (etiqueta pool) para un colector"""
+    gauges = (
+        ("db_pool_size", "size", "Conexiones permanentes del pool"),
+        ("db_pool_checked_out", "checked_out", "Conexiones del pool en uso"),
+        ("db_pool_overflow", "overflow", "Conexiones de overflow abiertas"),
+    )
+    for name, key, documentation in gauges:
+        yield name, "gauge", documentation, [
+            ({"pool": pool}, status[key]) for pool, status in statuses.items() if key in status
+        ]
+    yield "db_pool_checkouts_total", "counter", "Conexiones entregadas por el pool", [
+        ({"pool": pool}, status["checkouts"]) for pool, status in statuses.items()
+    ]
+    yield "db_pool_checkout_timeouts_total", "counter", "Esperas por una conexión que agotaron el timeout", [
+        ({"pool": pool}, status["timeouts"]) for pool, status in statuses.items()
+    ]
+    yield "db_pool_checkout_wait_max_seconds", "gauge", "Espera máxima por una conexión", [
+        ({"pool": pool}, status["max_wait_ms"] / 1000) for pool, status in statuses.items()
+    ]
+
+class MetricsMiddleware:
+    """
+    Middleware ASGI con peticiones por ruta, latencia y peticiones en curso.
+
+    La ruta es la plantilla de FastAPI (/users/{user_id}), no la URL, para que
+    la cantidad de series no crezca con los ids. La latencia se mide hasta el
+    inicio de la respuesta, lo que también sirve para respuestas en streaming.
+    """
+
+    def __init__(self, app, registry: MetricsRegistry):
+        self.app = app
+        self.requests = registry.counter(
+            "http_requests_total", "Peticiones HTTP por método, ruta y estado", ("method", "route", "status")
+        )
+        self.latency = registry.histogram(
+            "http_request_duration_seconds", "Latencia hasta el inicio de la respuesta", ("method", "route")
+        )
+        self.in_flight = registry.gauge("http_requests_in_flight", "Peticiones HTTP en curso").labels()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        started_at = time.perf_counter()
+        status = {"code": 500, "latency": None}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                status["latency"] = time.perf_counter() - started_at
+            await send(message)
+
+        self.in_flight.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            self.in_flight.dec()
+            route = scope.get("route")
+            route = getattr(route, "path", "unmatched")
+            method = scope["method"]
+            latency = status["latency"] if status["latency"] is not None else time.perf_counter() - started_at
+            self.requests.labels(method, route, str(status["code"])).inc()
+            self.latency.labels(method, route).observe(latency)
+
+registry = MetricsRegistry()
@@ -0,0 +1,153 @@
+"""
+Instrumentación de SQL por petición.
+
+Los eventos before/after_cursor_execute del engine miden cada sentencia y la
+atribuyen a la petición en curso (una ContextVar que fija el middleware y que
+se propaga a las sesiones asíncronas y al threadpool de los endpoints
+síncronos). Por petición se acumulan la cantidad de consultas, el tiempo total
+en la base y la sentencia más lenta:
+
+- las sentencias que superan SQL_SLOW_QUERY_MS se registran en el log con la
+  forma de sus parámetros (tipos, nunca valores),
+- una misma sentencia ejecutada SQL_REPEATED_STATEMENT_THRESHOLD veces o más
+  en una petición se marca como posible N+1,
+- con SQL_DEBUG_HEADERS las cifras se devuelven en cabeceras X-DB-*.
+"""
+import logging
+import time
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+from sqlalchemy import event
+
+from config import settings
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+QUERIES_PER_REQUEST = registry.histogram(
+    "db_queries_per_request", "Consultas SQL por petición", buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+).labels()
+DB_TIME_PER_REQUEST = registry.histogram(
+    "db_time_per_request_seconds", "Tiempo en la base de datos por petición"
+).labels()
+SLOW_QUERIES = registry.counter("db_slow_queries_total", "Sentencias SQL más lentas que el umbral").labels()
+REPEATED_STATEMENTS = registry.counter(
+    "db_repeated_statement_requests_total", "Peticiones con una sentencia repetida (posible N+1)"
+).labels()
+
+class RequestQueryStats:
+    """Consultas SQL emitidas durante una petición"""
+
+    __slots__ = ("count", "total", "slowest", "slowest_statement", "statements")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.slowest = 0.0
+        self.slowest_statement: Optional[str] = None
+        self.statements: Dict[str, int] = {}
+
+    def record(self, statement: str, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        self.statements[statement] = self.statements.get(statement, 0) + 1
+        if seconds > self.slowest:
+            self.slowest = seconds
+            self.slowest_statement = statement
+
+    def repeated(self, threshold: int) -> Dict[str, int]:
+        """Sentencias ejecutadas threshold veces o más"""
+        return {statement: count for statement, count in self.statements.items() if count >= threshold}
+
+    def headers(self) -> Dict[str, str]:
+        return {
+            "X-DB-Query-Count": str(self.count),
+            "X-DB-Time-Ms": f"{self.total * 1000:.2f}",
+            "X-DB-Slowest-Ms": f"{self.slowest * 1000:.2f}",
+            "X-DB-Repeated-Statements": str(len(self.repeated(settings.SQL_REPEATED_STATEMENT_THRESHOLD))),
+        }
+
+current_query_stats: ContextVar[Optional[RequestQueryStats]] = ContextVar("current_query_stats", default=None)
+
+def _type_name(value) -> str:
+    return "None" if value is None else type(value).__name__
+
+def parameter_shape(parameters, executemany: bool = False) -> str:
+    """Forma de los parámetros de una sentencia: tipos y cantidad, sin valores"""
+    if executemany:
+        rows = list(parameters or ())
+        return f"{len(rows)} x {parameter_shape(rows[0]) if rows else '()'}"
+    if isinstance(parameters, dict):
+        return "{" + ", ".join(f"{key}: {_type_name(value)}" for key, value in parameters.items()) + "}"
+    if isinstance(parameters, (list, tuple)):
+        return "(" + ", ".join(_type_name(value) for value in parameters) + ")"
+    return _type_name(parameters)
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started_at", []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get("query_started_at")
+    if not started:
+        return
+    seconds = time.perf_counter() - started.pop()
+    stats = current_query_stats.get()
+    if stats is not None:
+        stats.record(statement, seconds)
+    if seconds * 1000 >= settings.SQL_SLOW_QUERY_MS:
+        SLOW_QUERIES.inc()
+        logger.warning(
+            "Consulta lenta (%.1f ms): %s | parámetros %s",
+            seconds * 1000, " ".join(statement.split()), parameter_shape(parameters, executemany),
+        )
+
+def _handle_error(exception_context):
+    # Descartar la marca de inicio de una sentencia que falló
+    started = exception_context.connection.info.get("query_started_at") if exception_context.connection else None
+    if started:
+        started.pop()
+
+def instrument_engine(engine) -> None:
+    """Registrar los eventos de medición en un engine (o en el sync_engine de uno asíncrono)"""
+    engine = getattr(engine, "sync_engine", engine)
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+
+class QueryStatsMiddleware:
+    """Middleware ASGI que abre las estadísticas SQL de cada petición y las informa al terminar"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        stats = RequestQueryStats()
+        token = current_query_stats.set(stats)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and settings.SQL_DEBUG_HEADERS:
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [
+                    (name.lower().encode("latin-1"), value.encode("latin-1"))
+                    for name, value in stats.headers().items()
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current_query_stats.reset(token)
+            QUERIES_PER_REQUEST.observe(stats.count)
+            DB_TIME_PER_REQUEST.observe(stats.total)
+            repeated = stats.repeated(settings.SQL_REPEATED_STATEMENT_THRESHOLD)
+            if repeated:
+                REPEATED_STATEMENTS.inc()
+                for statement, count in repeated.items():
+                    logger.warning(
+                        "Posible N+1 en %s %s: sentencia ejecutada %d veces: %s",
+                        scope["method"], scope["path"], count, " ".join(statement.split()),
+                    )
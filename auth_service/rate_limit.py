@@ -0,0 +1,219 @@
+"""
+Limitación de tasa de /login y /register (token bucket).
+
+Cada intento consume una ficha del bucket de la IP del cliente y, en /login,
+también del bucket del email; los buckets se recargan a una tasa constante
+hasta su capacidad (ráfaga). Un intento sin fichas se rechaza con 429 y
+Retry-After antes de consultar la base o ejecutar bcrypt, de modo que un
+cliente o una tormenta de reintentos no puede acaparar el pool de hashing.
+
+El estado vive en un BucketStore intercambiable:
+
+- MemoryBucketStore: en proceso, LRU acotado (un límite por worker),
+- RedisBucketStore: compartido entre workers y réplicas; el bucket se
+  actualiza de forma atómica con un script Lua en cualquier servidor con el
+  protocolo de Redis. Recibe el cliente ya construido, así que en pruebas se
+  puede reemplazar por un sustituto local con el mismo eval().
+
+Aparte de los buckets, InFlightLimit acota las peticiones de credenciales en
+curso en el worker (503 inmediato por encima del tope), para ráfagas
+distribuidas entre muchas IPs y emails.
+
+Si el store compartido no responde se admite el intento (fail-open) y se
+registra en el log: el límite global del pool de hashing sigue protegiendo la
+CPU y un fallo del limitador no debe dejar a todos sin poder iniciar sesión.
+"""
+import hashlib
+import logging
+import math
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from config import settings
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+REJECTIONS = registry.counter(
+    "rate_limit_rejections_total", "Intentos rechazados por límite de tasa", ("endpoint", "scope")
+)
+STORE_ERRORS = registry.counter("rate_limit_store_errors_total", "Fallos del store compartido (fail-open)").labels()
+
+class RateLimitExceeded(Exception):
+    """El cliente agotó las fichas de uno de sus buckets"""
+
+    def __init__(self, scope: str, retry_after: float):
+        super().__init__(f"Límite de tasa excedido ({scope})")
+        self.scope = scope
+        self.retry_after = max(1, math.ceil(retry_after))
+
+class CredentialsBusy(Exception):
+    """Demasiadas peticiones de /login y /register en curso en este worker"""
+
+    def __init__(self, retry_after: int):
+        super().__init__("Demasiadas peticiones de credenciales en curso")
+        self.retry_after = retry_after
+
+class InFlightLimit:
+    """
+    Tope de peticiones de credenciales en curso por worker. Cubre también los
+    intentos que no llegan a bcrypt (emails inexistentes): por encima del tope
+    se rechaza de inmediato y el event loop sigue libre para /me y /users.
+    """
+
+    def __init__(self, max_in_flight: int, retry_after: int):
+        self.max_in_flight = max_in_flight
+        self.retry_after = retry_after
+        self.in_flight = 0
+        self.rejected = 0
+
+    def __enter__(self):
+        if self.max_in_flight and self.in_flight >= self.max_in_flight:
+            self.rejected += 1
+            REJECTIONS.labels("credentials", "in_flight").inc()
+            raise CredentialsBusy(self.retry_after)
+        self.in_flight += 1
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.in_flight -= 1
+        return False
+
+    def stats(self) -> dict:
+        return {"in_flight": self.in_flight, "max_in_flight": self.max_in_flight, "rejected": self.rejected}
+
+class MemoryBucketStore:
+    """Buckets en memoria del proceso, con una cantidad máxima de claves (LRU)"""
+
+    def __init__(self, max_keys: int):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, list]" = OrderedDict()
+
+    async def take(self, key: str, capacity: float, refill_per_second: float, now: Optional[float] = None) -> float:
+        """Consumir una ficha; devuelve 0 si se admitió o los segundos hasta la próxima ficha"""
+        now = time.monotonic() if now is None else now
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [capacity, now]
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(capacity, bucket[0] + (now - bucket[1]) * refill_per_second)
+            bucket[1] = now
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return 0.0
+        return (1 - bucket[0]) / refill_per_second
+
+    def stats(self) -> dict:
+        return {"backend": "memory", "keys": len(self._buckets), "max_keys": self.max_keys}
+
+# KEYS[1] = bucket; ARGV = capacidad, fichas por segundo, ahora (segundos), ttl
+# Devuelve 0 si se admitió o los milisegundos hasta la próxima ficha
+TOKEN_BUCKET_SCRIPT = """
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local tokens = tonumber(bucket[1]) or capacity
+local updated_at = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated_at) * rate)
+local wait_ms = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait_ms = math.ceil((1 - tokens) / rate * 1000)
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated_at', tostring(now))
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+return wait_ms
+"""
+
+class RedisBucketStore:
+    """Buckets compartidos en un servidor con el protocolo de Redis"""
+
+    def __init__(self, client, prefix: str = "rate_limit:"):
+        self.client = client
+        self.prefix = prefix
+        self.errors = 0
+
+    @classmethod
+    def from_url(cls, url: str) -> "RedisBucketStore":
+        import redis.asyncio  # dependencia opcional, solo con RATE_LIMIT_BACKEND=redis
+
+        return cls(redis.asyncio.from_url(url))
+
+    async def take(self, key: str, capacity: float, refill_per_second: float, now: Optional[float] = None) -> float:
+        # El reloj del worker (tiempo real, no monotónico) es común a todas las réplicas
+        now = time.time() if now is None else now
+        ttl = math.ceil(capacity / refill_per_second) + 1  # un bucket lleno no necesita estado
+        try:
+            wait_ms = await self.client.eval(
+                TOKEN_BUCKET_SCRIPT, 1, self.prefix + key, capacity, refill_per_second, now, ttl
+            )
+        except Exception:
+            self.errors += 1
+            STORE_ERRORS.inc()
+            logger.warning("Store de límite de tasa no disponible, se admite el intento", exc_info=True)
+            return 0.0
+        return int(wait_ms) / 1000
+
+    def stats(self) -> dict:
+        return {"backend": "redis", "errors": self.errors}
+
+class RateLimiter:
+    """Reglas de /login y /register sobre un BucketStore"""
+
+    def __init__(self, store, enabled: bool = True):
+        self.store = store
+        self.enabled = enabled
+        self.rejected = {}
+
+    async def _take(self, endpoint: str, scope: str, key: str, burst: int, per_minute: float) -> None:
+        wait = await self.store.take(f"{endpoint}:{scope}:{key}", burst, per_minute / 60)
+        if wait > 0:
+            self.rejected[f"{endpoint}:{scope}"] = self.rejected.get(f"{endpoint}:{scope}", 0) + 1
+            REJECTIONS.labels(endpoint, scope).inc()
+            raise RateLimitExceeded(scope, wait)
+
+    async def check_login(self, client_ip: str, email: str) -> None:
+        """Admitir un intento de login o lanzar RateLimitExceeded"""
+        if not self.enabled:
+            return
+        # Primero la IP: un cliente ya limitado no consume las fichas del email de otro
+        await self._take("login", "ip", client_ip, settings.RATE_LIMIT_LOGIN_IP_BURST,
+                         settings.RATE_LIMIT_LOGIN_IP_PER_MINUTE)
+        await self._take("login", "email", email_key(email), settings.RATE_LIMIT_LOGIN_EMAIL_BURST,
+                         settings.RATE_LIMIT_LOGIN_EMAIL_PER_MINUTE)
+
+    async def check_register(self, client_ip: str) -> None:
+        """Admitir un registro o lanzar RateLimitExceeded"""
+        if not self.enabled:
+            return
+        await self._take("register", "ip", client_ip, settings.RATE_LIMIT_REGISTER_IP_BURST,
+                         settings.RATE_LIMIT_REGISTER_IP_PER_MINUTE)
+
+    def stats(self) -> dict:
+        return {"enabled": self.enabled, "rejected": dict(self.rejected), **self.store.stats()}
+
+def email_key(email: str) -> str:
+    """Clave del bucket de un email: hash, para no guardar direcciones en el store"""
+    return hashlib.sha256(email.strip().lower().encode()).hexdigest()[:32]
+
+def client_ip(request) -> str:
+    """IP del cliente; X-Forwarded-For solo si el servicio está detrás de un proxy de confianza"""
+    if settings.RATE_LIMIT_TRUST_FORWARDED_FOR:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+def create_store():
+    if settings.RATE_LIMIT_BACKEND == "redis":
+        return RedisBucketStore.from_url(settings.RATE_LIMIT_REDIS_URL)
+    return MemoryBucketStore(settings.RATE_LIMIT_MAX_KEYS)
+
+rate_limiter = RateLimiter(create_store(), enabled=settings.RATE_LIMIT_ENABLED)
+credentials_in_flight = InFlightLimit(settings.CREDENTIALS_MAX_IN_FLIGHT, settings.HASHING_RETRY_AFTER_SECONDS)
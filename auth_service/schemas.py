@@ -1,5 +1,5 @@
 from pydantic import BaseModel, EmailStr
-from typing import Optional
+from typing import Optional, List
 from database import UserRole
 from datetime import datetime
 
@@ -27,6 +27,12 @@ class UserResponse(BaseModel):
     class Config:
         from_attributes = True
 
+# Consulta de varios usuarios por ID (desde appointments_service)
+MAX_USER_BATCH_SIZE = 500
+
+class UserBatchRequest(BaseModel):
+    ids: List[int]
+
 class Token(BaseModel):
     access_token: str
     token_type: str
@@ -34,3 +40,10 @@ class Token(BaseModel):
 
 class TokenData(BaseModel):
     email: Optional[str] = None
+    # Claims de perfil incluidos al iniciar sesión (tokens anteriores no los traen)
+    user_id: Optional[int] = None
+    role: Optional[UserRole] = None
+    first_name: Optional[str] = None
+    last_name: Optional[str] = None
+    created_at: Optional[datetime] = None
+    issued_at: Optional[datetime] = None
@@ -0,0 +1,450 @@
+"""
+Pruebas del servicio de autenticación sobre SQLite.
+
+Ejecutar desde el directorio auth_service:
+    python -m pytest -q
+"""
+import os
+import sys
+import math
+import asyncio
+import tempfile
+import threading
+
+# SQLite en archivo (las consultas de credenciales corren en otros hilos) y
+# bcrypt con costo bajo para que las pruebas no dependan del hardware
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="auth_tests_"), "auth.db")
+os.environ.setdefault("BCRYPT_ROUNDS", "5")
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import pytest
+from fastapi.testclient import TestClient
+from passlib.exc import MissingBackendError
+
+from config import settings
+from database import SessionLocal, User, UserRole, create_tables
+from hashing import HashingPool, HashingPoolSaturated, hashing_pool, password_context
+from auth import PASSWORD_REHASHES, get_cached_user, store_rehash
+from schemas import UserResponse
+from user_cache import UserCache, user_cache
+import user_cache as user_cache_module
+import calibrate_hashing
+from rate_limit import (
+    TOKEN_BUCKET_SCRIPT,
+    CredentialsBusy,
+    InFlightLimit,
+    MemoryBucketStore,
+    RateLimitExceeded,
+    RateLimiter,
+    RedisBucketStore,
+    credentials_in_flight,
+    email_key,
+    rate_limiter,
+)
+import main
+
+create_tables()
+client = TestClient(main.app)
+
+def run(coro):
+    return asyncio.run(coro)
+
+def register_payload(email, password="secreta123"):
+    return {"email": email, "password": password, "first_name": "Ana", "last_name": "Pérez",
+            "role": "paciente"}
+
+def add_user(email, password, bcrypt_rounds=settings.BCRYPT_ROUNDS):
+    """Crear un usuario con el hash calculado al costo indicado"""
+    hashed = password_context("bcrypt", bcrypt_rounds=bcrypt_rounds).hash(password)
+    with SessionLocal() as db:
+        user = User(email=email, hashed_password=hashed, first_name="Ana", last_name="Pérez",
+                    role=UserRole.PACIENTE)
+        db.add(user)
+        db.commit()
+        return user.id, hashed
+
+def stored_hash(user_id):
+    with SessionLocal() as db:
+        return db.get(User, user_id).hashed_password
+
+@pytest.fixture(autouse=True)
+def fresh_rate_limiter(monkeypatch):
+    """Cada prueba arranca con buckets vacíos y sin peticiones de credenciales en curso"""
+    monkeypatch.setattr(rate_limiter, "store", MemoryBucketStore(1000))
+    monkeypatch.setattr(rate_limiter, "enabled", True)
+    monkeypatch.setattr(credentials_in_flight, "in_flight", 0)
+
+class FakeRedis:
+    """
+    Sustituto local de redis.asyncio con el mismo eval(). Ejecuta
+    TOKEN_BUCKET_SCRIPT con lupa si está instalado; si no, con una
+    transcripción línea a línea del script sobre los mismos comandos.
+    """
+
+    def __init__(self):
+        self.hashes = {}
+        self.ttls = {}
+        self.calls = []
+
+    def call(self, command, key, *args):
+        if command == "HMGET":
+            bucket = self.hashes.get(key, {})
+            return [bucket.get(field) for field in args]
+        if command == "HSET":
+            self.hashes.setdefault(key, {}).update(zip(args[::2], args[1::2]))
+            return len(args) // 2
+        if command == "EXPIRE":
+            self.ttls[key] = int(args[0])
+            return 1
+        raise ValueError(f"Comando no soportado: {command}")
+
+    async def eval(self, script, numkeys, *keys_and_args):
+        keys, argv = keys_and_args[:numkeys], [str(arg) for arg in keys_and_args[numkeys:]]
+        self.calls.append((keys, argv))
+        try:
+            import lupa
+        except ImportError:
+            assert script == TOKEN_BUCKET_SCRIPT
+            return self._token_bucket(keys, argv)
+        return self._run_lua(lupa, script, keys, argv)
+
+    def _run_lua(self, lupa, script, keys, argv):
+        lua = lupa.LuaRuntime()
+        fake = self
+
+        def call(command, key, *args):
+            result = fake.call(command, key, *args)
+            return lua.table(*result) if isinstance(result, list) else result
+
+        lua.globals().redis = lua.table_from({"call": call})
+        lua.globals().KEYS = lua.table(*keys)
+        lua.globals().ARGV = lua.table(*argv)
+        return lua.execute(script)
+
+    def _token_bucket(self, keys, argv):
+        tokens, updated_at = self.call("HMGET", keys[0], "tokens", "updated_at")
+        capacity, rate, now = float(argv[0]), float(argv[1]), float(argv[2])
+        tokens = float(tokens) if tokens is not None else capacity
+        updated_at = float(updated_at) if updated_at is not None else now
+        tokens = min(capacity, tokens + max(0, now - updated_at) * rate)
+        wait_ms = 0
+        if tokens >= 1:
+            tokens = tokens - 1
+        else:
+            wait_ms = math.ceil((1 - tokens) / rate * 1000)
+        self.call("HSET", keys[0], "tokens", str(tokens), "updated_at", str(now))
+        self.call("EXPIRE", keys[0], argv[3])
+        return wait_ms
+
+class BrokenRedis:
+    async def eval(self, *args):
+        raise ConnectionError("redis no disponible")
+
+def test_memory_bucket_allows_burst_then_refills():
+    store = MemoryBucketStore(max_keys=10)
+
+    async def scenario():
+        # Capacidad 3, una ficha cada 2 segundos
+        admitted = [await store.take("k", 3, 0.5, now=100.0) for _ in range(3)]
+        assert admitted == [0.0, 0.0, 0.0]
+        assert await store.take("k", 3, 0.5, now=100.0) == pytest.approx(2.0)
+        # Medio intervalo después falta la otra mitad de la ficha
+        assert await store.take("k", 3, 0.5, now=101.0) == pytest.approx(1.0)
+        assert await store.take("k", 3, 0.5, now=102.0) == 0.0
+        # La recarga nunca supera la capacidad
+        assert [await store.take("k", 3, 0.5, now=1000.0) for _ in range(4)][-1] > 0
+        # Otra clave tiene su propio bucket
+        assert await store.take("otra", 3, 0.5, now=100.0) == 0.0
+
+    run(scenario())
+
+def test_memory_bucket_store_evicts_least_recently_used_keys():
+    store = MemoryBucketStore(max_keys=2)
+
+    async def scenario():
+        await store.take("a", 1, 1, now=0.0)
+        await store.take("b", 1, 1, now=0.0)
+        await store.take("a", 1, 1, now=0.0)  # "a" pasa a ser la más reciente
+        await store.take("c", 1, 1, now=0.0)
+        assert store.stats()["keys"] == 2
+        # "a" sigue agotado; "b" se descartó y vuelve con el bucket lleno
+        assert await store.take("a", 1, 1, now=0.0) > 0
+        assert await store.take("b", 1, 1, now=0.0) == 0.0
+
+    run(scenario())
+
+def test_redis_bucket_store_runs_token_bucket_script():
+    redis = FakeRedis()
+    store = RedisBucketStore(redis, prefix="test:")
+
+    async def scenario():
+        assert [await store.take("k", 2, 0.5, now=100.0) for _ in range(2)] == [0.0, 0.0]
+        assert await store.take("k", 2, 0.5, now=100.0) == 2.0
+        assert await store.take("k", 2, 0.5, now=101.5) == 0.5
+        assert await store.take("k", 2, 0.5, now=102.0) == 0.0
+
+    run(scenario())
+    keys, argv = redis.calls[0]
+    assert keys == ("test:k",)
+    assert argv == ["2", "0.5", "100.0", "5"]  # ttl: tiempo de recargar el bucket completo + 1
+    assert redis.ttls["test:k"] == 5
+    assert store.stats() == {"backend": "redis", "errors": 0}
+
+def test_redis_bucket_store_fails_open():
+    store = RedisBucketStore(BrokenRedis())
+    assert run(store.take("k", 1, 1)) == 0.0
+    assert run(store.take("k", 1, 1)) == 0.0
+    assert store.errors == 2
+
+def test_rate_limiter_checks_ip_before_email(monkeypatch):
+    monkeypatch.setattr(settings, "RATE_LIMIT_LOGIN_IP_BURST", 2)
+    monkeypatch.setattr(settings, "RATE_LIMIT_LOGIN_EMAIL_BURST", 3)
+    limiter = RateLimiter(MemoryBucketStore(100))
+
+    async def scenario():
+        await limiter.check_login("10.0.0.1", "ana@example.com")
+        await limiter.check_login("10.0.0.1", "ana@example.com")
+        with pytest.raises(RateLimitExceeded) as exc_info:
+            await limiter.check_login("10.0.0.1", "ana@example.com")
+        assert exc_info.value.scope == "ip"
+        assert exc_info.value.retry_after >= 1
+        # La IP limitada no consumió la tercera ficha del email
+        await limiter.check_login("10.0.0.2", " Ana@Example.com ")
+        with pytest.raises(RateLimitExceeded) as exc_info:
+            await limiter.check_login("10.0.0.3", "ana@example.com")
+        assert exc_info.value.scope == "email"
+
+    run(scenario())
+    assert limiter.rejected == {"login:ip": 1, "login:email": 1}
+    assert email_key("ana@example.com") == email_key(" ANA@example.com")
+
+def test_rate_limiter_register_and_disabled(monkeypatch):
+    monkeypatch.setattr(settings, "RATE_LIMIT_REGISTER_IP_BURST", 1)
+    limiter = RateLimiter(MemoryBucketStore(100))
+    run(limiter.check_register("10.0.0.1"))
+    with pytest.raises(RateLimitExceeded):
+        run(limiter.check_register("10.0.0.1"))
+
+    disabled = RateLimiter(MemoryBucketStore(100), enabled=False)
+    for _ in range(5):
+        run(disabled.check_register("10.0.0.1"))
+        run(disabled.check_login("10.0.0.1", "ana@example.com"))
+
+def test_in_flight_limit_rejects_above_max():
+    limit = InFlightLimit(max_in_flight=2, retry_after=3)
+    with limit, limit:
+        with pytest.raises(CredentialsBusy) as exc_info:
+            with limit:
+                pass
+        assert exc_info.value.retry_after == 3
+    # Al salir se liberan los lugares, también si la petición falló
+    with pytest.raises(RuntimeError):
+        with limit:
+            raise RuntimeError
+    assert limit.stats() == {"in_flight": 0, "max_in_flight": 2, "rejected": 1}
+    # 0 desactiva el tope
+    with InFlightLimit(0, 1), InFlightLimit(0, 1):
+        pass
+
+def test_login_and_register_return_429_with_retry_after(monkeypatch):
+    monkeypatch.setattr(settings, "RATE_LIMIT_LOGIN_EMAIL_BURST", 2)
+    monkeypatch.setattr(settings, "RATE_LIMIT_REGISTER_IP_BURST", 1)
+    credentials = {"email": "limitado@example.com", "password": "incorrecta"}
+
+    assert [client.post("/login", json=credentials).status_code for _ in range(2)] == [401, 401]
+    response = client.post("/login", json=credentials)
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+
+    assert client.post("/register", json=register_payload("nuevo1@example.com")).status_code == 201
+    response = client.post("/register", json=register_payload("nuevo2@example.com"))
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+
+def test_credentials_in_flight_limit_returns_503(monkeypatch):
+    monkeypatch.setattr(credentials_in_flight, "in_flight", credentials_in_flight.max_in_flight)
+    for path, payload in (("/login", {"email": "ana@example.com", "password": "x"}),
+                          ("/register", register_payload("ocupado@example.com"))):
+        response = client.post(path, json=payload)
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == str(settings.HASHING_RETRY_AFTER_SECONDS)
+
+def test_login_upgrades_hash_with_outdated_cost():
+    user_id, old_hash = add_user("rehash@example.com", "secreta123", bcrypt_rounds=4)
+    assert old_hash.startswith("$2b$04$")
+    updated = PASSWORD_REHASHES.labels("updated")
+    before = updated.value
+
+    response = client.post("/login", json={"email": "rehash@example.com", "password": "secreta123"})
+    assert response.status_code == 200
+    new_hash = stored_hash(user_id)
+    assert new_hash.startswith(f"$2b${settings.BCRYPT_ROUNDS:02d}$")
+    assert updated.value == before + 1
+    # El hash nuevo sigue validando la misma contraseña y ya no se recalcula
+    response = client.post("/login", json={"email": "rehash@example.com", "password": "secreta123"})
+    assert response.status_code == 200
+    assert stored_hash(user_id) == new_hash
+
+def test_store_rehash_keeps_concurrently_changed_password():
+    user_id, verified_hash = add_user("concurrente@example.com", "anterior", bcrypt_rounds=4)
+    # Otro proceso cambió la contraseña entre la verificación y el guardado
+    changed_hash = password_context("bcrypt").hash("nueva")
+    with SessionLocal() as db:
+        db.get(User, user_id).hashed_password = changed_hash
+        db.commit()
+
+    rehashed = password_context("bcrypt").hash("anterior")
+    assert store_rehash(SessionLocal(), user_id, verified_hash, rehashed) is False
+    assert stored_hash(user_id) == changed_hash
+
+    assert store_rehash(SessionLocal(), user_id, changed_hash, rehashed) is True
+    assert stored_hash(user_id) == rehashed
+
+def test_calibrate_picks_largest_cost_under_target(monkeypatch):
+    latencies = {4: 5.0, 5: 10.0, 6: 20.0, 7: 40.0, 8: 80.0}
+    monkeypatch.setattr(calibrate_hashing, "candidates", lambda scheme, memory_kib: ((c, c) for c in latencies))
+    monkeypatch.setattr(calibrate_hashing, "verify_ms", lambda context, repeat: latencies[context])
+    monkeypatch.setattr(settings, "HASHING_WORKERS", 2)
+
+    result = calibrate_hashing.calibrate("bcrypt", target_ms=30, repeat=1, memory_kib=0)
+    assert result["cost"] == 6
+    assert result["verify_ms"] == 20.0
+    assert result["logins_per_second"] == 100.0
+    assert result["env"] == {"PASSWORD_HASH_SCHEME": "bcrypt", "BCRYPT_ROUNDS": 6}
+    # Se deja de medir en el primer costo que supera el objetivo
+    assert [m["cost"] for m in result["measurements"]] == [4, 5, 6, 7]
+
+    # Si ni el costo mínimo cumple el objetivo se usa el mínimo
+    assert calibrate_hashing.calibrate("bcrypt", target_ms=1, repeat=1, memory_kib=0)["cost"] == 4
+
+def test_password_context_requires_scheme_backend():
+    try:
+        import argon2  # noqa: F401 (argon2-cffi)
+    except ImportError:
+        # Sin argon2-cffi el error aparece al crear el contexto, es decir al arrancar
+        with pytest.raises(MissingBackendError, match="argon2-cffi"):
+            password_context("argon2")
+    else:
+        assert password_context("argon2").hash("secreta123").startswith("$argon2")
+    with pytest.raises(ValueError):
+        password_context("md5")
+
+def test_calibrate_measures_real_bcrypt():
+    result = calibrate_hashing.calibrate("bcrypt", target_ms=0, repeat=1, memory_kib=0)
+    assert result["cost"] == calibrate_hashing.BCRYPT_ROUNDS[0]
+    assert result["measurements"][0]["verify_ms"] > 0
+
+def test_hashing_pool_rejects_when_saturated():
+    pool = HashingPool("thread", workers=1, max_queue=1, retry_after=2)
+    release = threading.Event()
+
+    def blocked(value):
+        release.wait(5)
+        return value * 2
+
+    async def scenario():
+        running = [asyncio.create_task(pool.run(blocked, n)) for n in (1, 2)]
+        await asyncio.sleep(0)
+        assert pool.in_flight == 2
+        # Un worker ocupado y un lugar en cola: la tercera operación se rechaza sin encolarse
+        with pytest.raises(HashingPoolSaturated) as exc_info:
+            await pool.run(blocked, 3)
+        assert exc_info.value.retry_after == 2
+        release.set()
+        assert await asyncio.gather(*running) == [2, 4]
+        # Con el pool libre se vuelve a admitir
+        assert await pool.run(blocked, 5) == 10
+
+    try:
+        run(scenario())
+    finally:
+        pool.shutdown()
+    stats = pool.stats()
+    assert stats["rejected"] == 1
+    assert stats["in_flight"] == 0
+    assert stats["hash_latency"]["count"] == 3
+
+def test_hashing_pool_rejects_on_expected_queue_wait():
+    pool = HashingPool("thread", workers=2, max_queue=10, retry_after=1, max_queue_wait=0.5)
+    pool.recent_latency = 0.4
+    pool.in_flight = 2
+    pool.check_admission()  # una operación por delante: 0.2 s de espera
+    pool.in_flight = 4
+    with pytest.raises(HashingPoolSaturated) as exc_info:
+        pool.check_admission()  # 3 por delante: 0.6 s
+    assert exc_info.value.retry_after == 1
+    pool.recent_latency = 4.0
+    with pytest.raises(HashingPoolSaturated) as exc_info:
+        pool.check_admission()
+    assert exc_info.value.retry_after == 6
+
+def test_saturated_hashing_pool_returns_503(monkeypatch):
+    add_user("saturado@example.com", "secreta123")
+    credentials = {"email": "saturado@example.com", "password": "secreta123"}
+    monkeypatch.setattr(hashing_pool, "in_flight", hashing_pool.workers + hashing_pool.max_queue)
+    for path, payload in (("/login", credentials), ("/register", register_payload("saturado2@example.com"))):
+        response = client.post(path, json=payload)
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == str(hashing_pool.retry_after)
+
+    monkeypatch.setattr(hashing_pool, "in_flight", 0)
+    assert client.post("/login", json=credentials).status_code == 200
+
+def cached_user(user_id, email):
+    return UserResponse(id=user_id, email=email, first_name="Ana", last_name="Pérez",
+                        role=UserRole.PACIENTE, created_at="2024-01-01T00:00:00Z")
+
+def test_user_cache_hit_miss_and_ttl(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(user_cache_module.time, "monotonic", lambda: clock[0])
+    cache = UserCache(ttl=60, max_size=2)
+
+    assert cache.get("ana@example.com") is None
+    cache.set(cached_user(1, "ana@example.com"))
+    assert cache.get("ana@example.com").id == 1
+    clock[0] += 59
+    assert cache.get("ana@example.com") is not None
+    clock[0] += 1
+    assert cache.get("ana@example.com") is None  # vencida: se elimina
+    assert cache.stats() == {"size": 0, "hits": 2, "misses": 2, "hit_rate": 0.5, "invalidations": 0}
+
+    # Tamaño acotado: se descarta la menos usada; un email nuevo para el mismo id reemplaza al anterior
+    for user_id in (1, 2, 3):
+        cache.set(cached_user(user_id, f"u{user_id}@example.com"))
+    assert cache.get("u1@example.com") is None
+    cache.set(cached_user(3, "cambiado@example.com"))
+    assert cache.get("u3@example.com") is None
+    assert cache.get("cambiado@example.com").id == 3
+    cache.invalidate(user_id=2)
+    assert cache.stats()["size"] == 1
+    assert cache.stats()["invalidations"] == 1
+
+def test_user_cache_is_invalidated_on_profile_and_role_update():
+    user_id, _ = add_user("perfil@example.com", "secreta123")
+    user_cache.clear()
+    with SessionLocal() as db:
+        assert get_cached_user(db, "perfil@example.com").first_name == "Ana"
+        assert user_cache.get("perfil@example.com") is not None
+
+        db.get(User, user_id).first_name = "Ana María"
+        db.commit()
+        assert user_cache.get("perfil@example.com") is None
+        assert get_cached_user(db, "perfil@example.com").first_name == "Ana María"
+
+        db.get(User, user_id).role = UserRole.MEDICO
+        db.commit()
+        assert user_cache.get("perfil@example.com") is None
+        assert get_cached_user(db, "perfil@example.com").role == UserRole.MEDICO
+
+        db.delete(db.get(User, user_id))
+        db.commit()
+        assert user_cache.get("perfil@example.com") is None
+        assert get_cached_user(db, "perfil@example.com") is None
+
+def test_stats_endpoints_require_stats_enabled(monkeypatch):
+    paths = ("/stats/hashing", "/stats/rate-limit", "/stats/tokens", "/stats/users", "/stats/db")
+    for enabled, expected in ((False, 404), (True, 200)):
+        monkeypatch.setattr(settings, "STATS_ENABLED", enabled)
+        app_client = TestClient(main.create_app())
+        assert [app_client.get(path).status_code for path in paths] == [expected] * len(paths)
+        assert app_client.get("/health").status_code == 200
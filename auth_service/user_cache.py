@@ -0,0 +1,84 @@
+"""
+Caché en proceso de los usuarios autenticados.
+
+get_current_user resolvía el usuario del token con una consulta por email en
+cada petición. Los usuarios se guardan como instantáneas inmutables
+(UserResponse) indexadas por email y por id, con TTL y tamaño acotados. Toda
+modificación o eliminación de un User a través del ORM invalida su entrada; el
+TTL acota la desactualización entre procesos distintos.
+"""
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from sqlalchemy import event
+
+from config import settings
+from database import User
+from schemas import UserResponse
+
+class UserCache:
+    """Caché LRU con TTL de UserResponse por email, con índice por id para invalidar"""
+
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._emails_by_id = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, email: str) -> Optional[UserResponse]:
+        entry = self._entries.get(email)
+        if entry is None or entry[0] <= time.monotonic():
+            if entry is not None:
+                self._remove(email)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(email)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, user: UserResponse) -> None:
+        if self.max_size <= 0:
+            return
+        self.invalidate(user_id=user.id, count=False)
+        self._entries[user.email] = (time.monotonic() + self.ttl, user)
+        self._emails_by_id[user.id] = user.email
+        while len(self._entries) > self.max_size:
+            email, (_, evicted) = self._entries.popitem(last=False)
+            self._emails_by_id.pop(evicted.id, None)
+
+    def _remove(self, email: str) -> None:
+        _, user = self._entries.pop(email)
+        self._emails_by_id.pop(user.id, None)
+
+    def invalidate(self, user_id: Optional[int] = None, email: Optional[str] = None, count: bool = True) -> None:
+        """Eliminar la entrada del usuario (por id, por email o ambos)"""
+        for key in {self._emails_by_id.get(user_id), email}:
+            if key is not None and key in self._entries:
+                self._remove(key)
+                if count:
+                    self.invalidations += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._emails_by_id.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "invalidations": self.invalidations,
+        }
+
+user_cache = UserCache(settings.USER_CACHE_TTL_SECONDS, settings.USER_CACHE_MAX_SIZE)
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_changed_user(mapper, connection, target):
+    user_cache.invalidate(user_id=target.id, email=target.email)
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Benchmark de concurrencia del servicio de turnos (carga mixta lectura/escritura).
+
+Levanta la aplicación de appointments_service en el mismo proceso (transporte
+ASGI de httpx) sobre una base SQLite temporal y lanza clientes concurrentes que
+crean y listan citas mientras una sonda consulta /health. Si el acceso a datos
+bloquea el event loop, la latencia de /health crece con la carga.
+
+Uso (ejecutar en cada commit a comparar):
+    python benchmarks/bench_appointments_concurrency.py --clients 50 --requests 40
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+SERVICE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "appointments_service")
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+def summarize(latencies):
+    return {
+        "count": len(latencies),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 2) if latencies else 0.0,
+    }
+
+def seed(database, rows_per_patient, patients, doctors):
+    """Precargar historial para que los listados tengan trabajo real"""
+    from sqlalchemy.orm import Session
+
+    base = datetime(2030, 1, 1, 8, 0, tzinfo=timezone.utc)
+    with Session(database.engine) as session:
+        for patient_id in range(1, patients + 1):
+            for i in range(rows_per_patient):
+                session.add(database.Appointment(
+                    patient_id=patient_id,
+                    doctor_id=1000 + (patient_id * rows_per_patient + i) % doctors,
+                    title="Historial",
+                    appointment_datetime=base + timedelta(days=patient_id, hours=i),
+                    duration_minutes=30,
+                ))
+        session.commit()
+
+async def run_benchmark(args):
+    import httpx
+    from jose import jwt
+
+    import database
+    from config import settings
+    from main import app
+
+    database.create_tables()
+    seed(database, args.history, args.clients, args.doctors)
+
+    def token_for(user_id, role):
+        payload = {
+            "sub": f"user{user_id}@example.com",
+            "user_id": user_id,
+            "role": role,
+            "exp": datetime.utcnow() + timedelta(hours=1),
+        }
+        return jwt.encode(payload, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
+
+    latencies = {"POST /appointments": [], "GET /appointments": [], "GET /health": []}
+    errors = {"count": 0}
+    done = asyncio.Event()
+    transport = httpx.ASGITransport(app=app)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+
+        async def patient_client(patient_id):
+            rng = random.Random(patient_id)
+            headers = {"Authorization": f"Bearer {token_for(patient_id, 'paciente')}"}
+            start = datetime.now(timezone.utc) + timedelta(days=400 + patient_id)
+            for i in range(args.requests):
+                if rng.random() < args.write_ratio:
+                    body = {
+                        "doctor_id": rng.randint(1000, 1000 + args.doctors - 1),
+                        "title": "Consulta",
+                        "appointment_datetime": (start + timedelta(hours=i)).isoformat(),
+                        "duration_minutes": 30,
+                    }
+                    name, began = "POST /appointments", time.perf_counter()
+                    response = await client.post("/appointments", json=body, headers=headers)
+                else:
+                    name, began = "GET /appointments", time.perf_counter()
+                    response = await client.get("/appointments", headers=headers)
+                latencies[name].append(time.perf_counter() - began)
+                if response.status_code >= 500:
+                    errors["count"] += 1
+
+        async def health_probe():
+            # La latencia se mide desde el instante previsto de envío: si el event loop
+            # está bloqueado, el retraso acumulado se refleja en los percentiles
+            interval = 0.005
+            scheduled = time.perf_counter()
+            while not done.is_set():
+                scheduled += interval
+                await asyncio.sleep(max(0.0, scheduled - time.perf_counter()))
+                await client.get("/health")
+                latencies["GET /health"].append(time.perf_counter() - scheduled)
+
+        probe = asyncio.create_task(health_probe())
+        began = time.perf_counter()
+        await asyncio.gather(*(patient_client(patient_id) for patient_id in range(1, args.clients + 1)))
+        elapsed = time.perf_counter() - began
+        done.set()
+        await probe
+
+    total = sum(len(values) for name, values in latencies.items() if name != "GET /health")
+    return {
+        "clients": args.clients,
+        "requests_per_client": args.requests,
+        "write_ratio": args.write_ratio,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(total / elapsed, 1),
+        "server_errors": errors["count"],
+        "endpoints": {name: summarize(values) for name, values in latencies.items()},
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=40)
+    parser.add_argument("--write-ratio", type=float, default=0.3)
+    parser.add_argument("--history", type=int, default=200, help="citas precargadas por paciente")
+    parser.add_argument("--doctors", type=int, default=20)
+    parser.add_argument("--json", help="guardar el resultado en este archivo")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_appointments_")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'appointments.db')}"
+    sys.path.insert(0, SERVICE_DIR)
+
+    result = asyncio.run(run_benchmark(args))
+
+    print(f"🚀 {args.clients} clientes x {args.requests} peticiones "
+          f"({result['throughput_rps']} req/s, {result['elapsed_s']} s, "
+          f"{result['server_errors']} errores 5xx)")
+    for name, stats in result["endpoints"].items():
+        print(f"  {name:<22} n={stats['count']:<6} p50={stats['p50_ms']:>8} ms  "
+              f"p95={stats['p95_ms']:>8} ms  p99={stats['p99_ms']:>8} ms")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"✅ Resultado guardado en {args.json}")
+
+if __name__ == "__main__":
+    main()
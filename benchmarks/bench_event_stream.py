@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Prueba de carga del flujo de eventos en tiempo real (GET /events).
+
+Levanta appointments_service con uvicorn (un solo worker, base SQLite
+temporal) y abre --connections conexiones SSE inactivas repartidas entre
+--doctors médicos. Luego un paciente crea --appointments citas y se mide:
+
+- latencia de entrega: desde que se envía el POST hasta que el evento
+  appointment.created llega a cada médico suscrito,
+- latencia de /health con todas las conexiones abiertas,
+- memoria residente del proceso del servidor antes y después de conectar.
+
+Uso:
+    python benchmarks/bench_event_stream.py --connections 2000 --appointments 50
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+SERVICE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "appointments_service")
+
+PATIENT_ID = 100000
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def rss_mb(pid):
+    """Memoria residente de un proceso (Linux)"""
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return round(int(line.split()[1]) / 1024, 1)
+    return 0.0
+
+def make_token(user_id, role):
+    sys.path.insert(0, SERVICE_DIR)
+    from jose import jwt
+    from config import settings
+
+    expire = datetime.utcnow() + timedelta(hours=1)
+    return jwt.encode(
+        {"sub": f"user{user_id}@example.com", "user_id": user_id, "role": role, "exp": expire},
+        settings.SECRET_KEY,
+        algorithm=settings.ALGORITHM,
+    )
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+async def listen(client, token, ready, arrivals):
+    """Conexión SSE de un médico: registra cuándo llega cada cita creada"""
+    async with client.stream("GET", "/events", headers={"Authorization": f"Bearer {token}"}) as response:
+        response.raise_for_status()
+        ready.release()
+        event = None
+        async for line in response.aiter_lines():
+            if line.startswith("event: "):
+                event = line[7:]
+            elif line.startswith("data: ") and event == "appointment.created":
+                arrivals.append((json.loads(line[6:])["id"], time.perf_counter()))
+
+async def run_benchmark(args, base_url, server_pid):
+    import httpx
+
+    doctor_tokens = [make_token(doctor_id, "médico") for doctor_id in range(1, args.doctors + 1)]
+    patient_token = make_token(PATIENT_ID, "paciente")
+    limits = httpx.Limits(max_connections=args.connections + 10, max_keepalive_connections=10)
+    timeout = httpx.Timeout(30.0, read=None)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=timeout) as client:
+        rss_before = rss_mb(server_pid)
+        ready = asyncio.Semaphore(0)
+        arrivals = [[] for _ in range(args.connections)]
+        listeners = [
+            asyncio.create_task(listen(client, doctor_tokens[index % args.doctors], ready, arrivals[index]))
+            for index in range(args.connections)
+        ]
+        began = time.perf_counter()
+        for _ in range(args.connections):
+            await ready.acquire()
+        connect_seconds = time.perf_counter() - began
+        rss_after = rss_mb(server_pid)
+
+        health = []
+        for _ in range(20):
+            began = time.perf_counter()
+            (await client.get("/health")).raise_for_status()
+            health.append(time.perf_counter() - began)
+
+        sent = {}
+        start = datetime(2032, 1, 1, 8, 0, tzinfo=timezone.utc)
+        for index in range(args.appointments):
+            doctor_id = index % args.doctors + 1
+            payload = {
+                "doctor_id": doctor_id,
+                "title": "Consulta",
+                "appointment_datetime": (start + timedelta(minutes=30 * index)).isoformat(),
+                "duration_minutes": 30,
+            }
+            began = time.perf_counter()
+            response = await client.post(
+                "/appointments", json=payload, headers={"Authorization": f"Bearer {patient_token}"}
+            )
+            response.raise_for_status()
+            sent[response.json()["id"]] = began
+        await asyncio.sleep(args.settle)
+        stats = (await client.get("/stats/events")).json()
+
+        for listener in listeners:
+            listener.cancel()
+        await asyncio.gather(*listeners, return_exceptions=True)
+
+    latencies = [
+        (arrived - sent[appointment_id]) * 1000
+        for per_connection in arrivals
+        for appointment_id, arrived in per_connection
+        if appointment_id in sent
+    ]
+    expected = sum(
+        1 for index in range(args.connections) for apt in range(args.appointments)
+        if apt % args.doctors == index % args.doctors
+    )
+    return {
+        "connections": args.connections,
+        "doctors": args.doctors,
+        "appointments": args.appointments,
+        "connect_seconds": round(connect_seconds, 2),
+        "expected_deliveries": expected,
+        "deliveries": len(latencies),
+        "delivery_p50_ms": round(statistics.median(latencies), 2) if latencies else None,
+        "delivery_p99_ms": round(percentile(latencies, 0.99), 2) if latencies else None,
+        "health_p50_ms": round(statistics.median(health) * 1000, 2),
+        "server_rss_before_mb": rss_before,
+        "server_rss_after_mb": rss_after,
+        "hub": stats,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--connections", type=int, default=2000, help="conexiones SSE inactivas")
+    parser.add_argument("--doctors", type=int, default=100, help="médicos entre los que se reparten")
+    parser.add_argument("--appointments", type=int, default=50)
+    parser.add_argument("--settle", type=float, default=1.0, help="segundos de espera tras la última cita")
+    parser.add_argument("--json", help="guardar el resultado en este archivo")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_events_")
+    port = free_port()
+    env = dict(
+        os.environ,
+        DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'appointments.db')}",
+        EVENTS_MAX_CONNECTIONS=str(args.connections + 100),
+        STATS_ENABLED="true",  # /stats/events
+    )
+    # El servicio no crea tablas al arrancar: el esquema lo prepara migrate.py
+    subprocess.run([sys.executable, "migrate.py"], cwd=SERVICE_DIR, env=env, check=True, stdout=subprocess.DEVNULL)
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=SERVICE_DIR, env=env,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        import httpx
+
+        for _ in range(100):
+            try:
+                httpx.get(f"{base_url}/health").raise_for_status()
+                break
+            except httpx.HTTPError:
+                time.sleep(0.1)
+        result = asyncio.run(run_benchmark(args, base_url, server.pid))
+    finally:
+        server.terminate()
+        server.wait()
+
+    print(f"🚀 {result['connections']} conexiones SSE inactivas ({result['doctors']} médicos), "
+          f"abiertas en {result['connect_seconds']} s")
+    print(f"  entregas          {result['deliveries']}/{result['expected_deliveries']}")
+    print(f"  latencia entrega  p50 {result['delivery_p50_ms']} ms  p99 {result['delivery_p99_ms']} ms")
+    print(f"  /health           p50 {result['health_p50_ms']} ms")
+    print(f"  memoria servidor  {result['server_rss_before_mb']} MB -> {result['server_rss_after_mb']} MB")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"✅ Resultado guardado en {args.json}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Benchmark de la búsqueda de horarios libres sobre un mes completo de agenda.
+
+Precarga en una base SQLite temporal la agenda de un médico con turnos de
+30 minutos de 8:00 a 18:00 todos los días de un mes, dejando libre una
+fracción de ellos. Compara find_free_slots (una consulta y un recorrido de los
+bloques ocupados) con la estrategia de prueba y error: un
+check_appointment_conflicts por cada horario candidato.
+
+Uso:
+    python benchmarks/bench_free_slots.py --days 31 --free-ratio 0.05
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+SERVICE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "appointments_service")
+
+DOCTOR_ID = 1
+
+def seed(database, base, days, free_ratio, seed_value):
+    """Agenda de 8:00 a 18:00 con turnos de 30 minutos; free_ratio de ellos quedan libres"""
+    from sqlalchemy.orm import Session
+
+    rng = random.Random(seed_value)
+    booked = 0
+    with Session(database.engine) as session:
+        for day in range(days):
+            for slot in range(20):
+                if rng.random() < free_ratio:
+                    continue
+                session.add(database.Appointment(
+                    patient_id=1000 + booked,
+                    doctor_id=DOCTOR_ID,
+                    title="Consulta",
+                    appointment_datetime=base + timedelta(days=day, minutes=30 * slot),
+                    duration_minutes=30,
+                ))
+                booked += 1
+        session.commit()
+    return booked
+
+async def timed(repeat, func):
+    durations = []
+    result = None
+    for _ in range(repeat):
+        began = time.perf_counter()
+        result = await func()
+        durations.append(time.perf_counter() - began)
+    return result, durations
+
+async def run_benchmark(args):
+    import database
+    from appointments import check_appointment_conflicts, find_free_slots
+
+    base = datetime(2031, 1, 1, 8, 0, tzinfo=timezone.utc)
+    database.create_tables()
+    booked = seed(database, base, args.days, args.free_ratio, args.seed)
+    date_from, date_to = base, base + timedelta(days=args.days)
+
+    async def sweep():
+        async with database.AsyncSessionLocal() as db:
+            return await find_free_slots(db, DOCTOR_ID, date_from, date_to, args.duration, args.step)
+
+    async def trial_and_error():
+        slots = []
+        step = timedelta(minutes=args.step or args.duration)
+        async with database.AsyncSessionLocal() as db:
+            start = date_from
+            while start + timedelta(minutes=args.duration) <= date_to:
+                errors = await check_appointment_conflicts(db, DOCTOR_ID, 0, start, args.duration)
+                if not errors:
+                    slots.append((start, start + timedelta(minutes=args.duration)))
+                start += step
+        return slots
+
+    sweep_slots, sweep_times = await timed(args.repeat, sweep)
+    naive_slots, naive_times = await timed(args.naive_repeat, trial_and_error)
+    assert sweep_slots == naive_slots, "Los resultados no coinciden"
+
+    await database.async_engine.dispose()
+    return {
+        "days": args.days,
+        "booked_appointments": booked,
+        "free_slots": len(sweep_slots),
+        "find_free_slots_ms": round(statistics.median(sweep_times) * 1000, 2),
+        "trial_and_error_ms": round(statistics.median(naive_times) * 1000, 2),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--days", type=int, default=31)
+    parser.add_argument("--free-ratio", type=float, default=0.05, help="fracción de turnos libres")
+    parser.add_argument("--duration", type=int, default=30)
+    parser.add_argument("--step", type=int, default=None, help="minutos entre candidatos (por defecto, la duración)")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--naive-repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", help="guardar el resultado en este archivo")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_free_slots_")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'appointments.db')}"
+    sys.path.insert(0, SERVICE_DIR)
+
+    result = asyncio.run(run_benchmark(args))
+
+    print(f"🚀 {result['days']} días, {result['booked_appointments']} citas, "
+          f"{result['free_slots']} horarios libres")
+    print(f"  find_free_slots      {result['find_free_slots_ms']:>10} ms")
+    print(f"  prueba y error       {result['trial_and_error_ms']:>10} ms")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"✅ Resultado guardado en {args.json}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+"""
+Prueba de carga HTTP del flujo completo: registro → login → reservar → listar.
+
+Levanta auth_service y appointments_service con uvicorn sobre bases SQLite
+temporales (o usa servicios ya levantados con --auth-url / --appointments-url,
+por ejemplo contra PostgreSQL local) y lanza --users usuarios virtuales
+concurrentes. Cada paciente se registra, inicia sesión y ejecuta --iterations
+operaciones elegidas según la mezcla --mix (crear, listar, ver, modificar y
+eliminar sus propias citas, y listar con datos de usuarios).
+
+Informa por endpoint: peticiones, errores, throughput y latencias p50/p95/p99.
+El resultado se guarda en JSON con --json; con --baseline se compara contra
+una corrida anterior y se marcan las regresiones (p95 o throughput peor que
+--tolerance), terminando con código 1 si hay alguna.
+
+Uso:
+    python benchmarks/bench_http_flow.py --users 20 --iterations 30 --json run.json
+    python benchmarks/bench_http_flow.py --users 20 --iterations 30 --baseline run.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_MIX = "create=25,list=35,list_users=10,get=15,update=10,delete=5"
+PASSWORD = "paciente123"
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, weight = part.split("=")
+        mix[name.strip()] = float(weight)
+    unknown = set(mix) - set(OPERATIONS)
+    if unknown:
+        raise SystemExit(f"Operaciones desconocidas en --mix: {', '.join(sorted(unknown))}")
+    return mix
+
+class Recorder:
+    """Latencias y errores por endpoint"""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.requests = defaultdict(int)
+        self.errors = defaultdict(int)
+
+    async def request(self, client, name, method, url, expected, **kwargs):
+        self.requests[name] += 1
+        began = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+        except Exception:
+            self.errors[name] += 1
+            return None
+        self.latencies[name].append(time.perf_counter() - began)
+        if response.status_code != expected:
+            self.errors[name] += 1
+            return None
+        return response
+
+    def summary(self, elapsed):
+        endpoints = {}
+        for name in sorted(self.requests):
+            latencies = self.latencies[name]
+            endpoints[name] = {
+                "requests": self.requests[name],
+                "errors": self.errors[name],
+                "throughput_rps": round(len(latencies) / elapsed, 2),
+                "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+                "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+                "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+            }
+        return endpoints
+
+class VirtualUser:
+    """Paciente que se registra, inicia sesión y opera sobre sus citas"""
+
+    def __init__(self, index, run_id, doctor_ids, recorder, rng):
+        self.index = index
+        self.email = f"carga{run_id}-{index}@example.com"
+        self.doctor_ids = doctor_ids
+        self.recorder = recorder
+        self.rng = rng
+        self.headers = {}
+        self.appointments = []
+        self.slot = 0
+        # Cada usuario reserva en su propia franja para que los conflictos no dominen la mezcla
+        self.base = datetime(2035, 1, 1, tzinfo=timezone.utc) + timedelta(days=30 * index)
+
+    def next_slot(self):
+        self.slot += 1
+        return (self.base + timedelta(minutes=45 * self.slot)).isoformat()
+
+    async def sign_in(self, auth):
+        user = {"email": self.email, "password": PASSWORD, "first_name": "Carga",
+                "last_name": str(self.index), "role": "paciente"}
+        await self.recorder.request(auth, "POST /register", "POST", "/register", 201, json=user)
+        response = await self.recorder.request(
+            auth, "POST /login", "POST", "/login", 200, json={"email": self.email, "password": PASSWORD}
+        )
+        if response is None:
+            return False
+        self.headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        return True
+
+    async def create(self, api):
+        payload = {"doctor_id": self.rng.choice(self.doctor_ids), "title": "Consulta",
+                   "appointment_datetime": self.next_slot(), "duration_minutes": 30}
+        response = await self.recorder.request(
+            api, "POST /appointments", "POST", "/appointments", 201, json=payload, headers=self.headers
+        )
+        if response is not None:
+            self.appointments.append(response.json()["id"])
+
+    async def list(self, api):
+        await self.recorder.request(api, "GET /appointments", "GET", "/appointments", 200, headers=self.headers)
+
+    async def list_users(self, api):
+        await self.recorder.request(
+            api, "GET /appointments?include_users", "GET", "/appointments", 200,
+            params={"include_users": "true"}, headers=self.headers
+        )
+
+    async def get(self, api):
+        if not self.appointments:
+            return await self.create(api)
+        appointment_id = self.rng.choice(self.appointments)
+        await self.recorder.request(
+            api, "GET /appointments/{id}", "GET", f"/appointments/{appointment_id}", 200, headers=self.headers
+        )
+
+    async def update(self, api):
+        if not self.appointments:
+            return await self.create(api)
+        appointment_id = self.rng.choice(self.appointments)
+        await self.recorder.request(
+            api, "PUT /appointments/{id}", "PUT", f"/appointments/{appointment_id}", 200,
+            json={"appointment_datetime": self.next_slot()}, headers=self.headers
+        )
+
+    async def delete(self, api):
+        if not self.appointments:
+            return await self.create(api)
+        appointment_id = self.appointments.pop(self.rng.randrange(len(self.appointments)))
+        await self.recorder.request(
+            api, "DELETE /appointments/{id}", "DELETE", f"/appointments/{appointment_id}", 204,
+            headers=self.headers
+        )
+
+OPERATIONS = {
+    "create": VirtualUser.create,
+    "list": VirtualUser.list,
+    "list_users": VirtualUser.list_users,
+    "get": VirtualUser.get,
+    "update": VirtualUser.update,
+    "delete": VirtualUser.delete,
+}
+
+async def register_doctors(auth, run_id, count):
+    doctor_ids = []
+    for index in range(count):
+        response = await auth.post("/register", json={
+            "email": f"medico{run_id}-{index}@example.com", "password": "doctor123",
+            "first_name": "Dr.", "last_name": str(index), "role": "médico",
+        })
+        response.raise_for_status()
+        doctor_ids.append(response.json()["id"])
+    return doctor_ids
+
+async def run_load(args, auth_url, appointments_url):
+    import httpx
+
+    mix = parse_mix(args.mix)
+    names, weights = list(mix), list(mix.values())
+    run_id = f"{int(time.time())}{os.getpid()}"
+    recorder = Recorder()
+    limits = httpx.Limits(max_connections=args.users * 2, max_keepalive_connections=args.users * 2)
+
+    async with httpx.AsyncClient(base_url=auth_url, limits=limits, timeout=args.timeout) as auth, \
+            httpx.AsyncClient(base_url=appointments_url, limits=limits, timeout=args.timeout) as api:
+        doctor_ids = await register_doctors(auth, run_id, args.doctors)
+
+        async def user_flow(index):
+            rng = random.Random(args.seed * 100003 + index)
+            user = VirtualUser(index, run_id, doctor_ids, recorder, rng)
+            if not await user.sign_in(auth):
+                return
+            for _ in range(args.iterations):
+                await OPERATIONS[rng.choices(names, weights)[0]](user, api)
+
+        began = time.perf_counter()
+        await asyncio.gather(*(user_flow(index) for index in range(args.users)))
+        elapsed = time.perf_counter() - began
+
+    endpoints = recorder.summary(elapsed)
+    total_requests = sum(recorder.requests.values())
+    all_latencies = [value for latencies in recorder.latencies.values() for value in latencies]
+    return {
+        "config": {
+            "users": args.users, "iterations": args.iterations, "doctors": args.doctors,
+            "mix": mix, "seed": args.seed, "auth_url": auth_url, "appointments_url": appointments_url,
+        },
+        "elapsed_seconds": round(elapsed, 2),
+        "total": {
+            "requests": total_requests,
+            "errors": sum(recorder.errors.values()),
+            "throughput_rps": round(total_requests / elapsed, 2),
+            "p50_ms": round(percentile(all_latencies, 50) * 1000, 2),
+            "p95_ms": round(percentile(all_latencies, 95) * 1000, 2),
+            "p99_ms": round(percentile(all_latencies, 99) * 1000, 2),
+        },
+        "endpoints": endpoints,
+    }
+
+def compare(result, baseline, tolerance):
+    """Regresiones respecto de una corrida anterior: p95 más alto o throughput más bajo"""
+    regressions = []
+    for name, current in result["endpoints"].items():
+        previous = baseline.get("endpoints", {}).get(name)
+        if not previous:
+            continue
+        if previous["p95_ms"] and current["p95_ms"] > previous["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {previous['p95_ms']} ms -> {current['p95_ms']} ms")
+        if previous["throughput_rps"] and current["throughput_rps"] < previous["throughput_rps"] * (1 - tolerance):
+            regressions.append(
+                f"{name}: throughput {previous['throughput_rps']} -> {current['throughput_rps']} req/s"
+            )
+        if current["errors"] > previous["errors"]:
+            regressions.append(f"{name}: errores {previous['errors']} -> {current['errors']}")
+    return regressions
+
+def start_service(service, port, env):
+    # El servicio no crea tablas al arrancar: el esquema lo prepara migrate.py
+    subprocess.run([sys.executable, "migrate.py"], cwd=os.path.join(ROOT, service), env=env, check=True,
+                   stdout=subprocess.DEVNULL)
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning",
+         "--workers", "1"],
+        cwd=os.path.join(ROOT, service), env=env,
+    )
+
+def wait_healthy(url):
+    import httpx
+
+    for _ in range(150):
+        try:
+            httpx.get(f"{url}/health").raise_for_status()
+            return
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    raise SystemExit(f"❌ El servicio en {url} no respondió a /health")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20, help="usuarios virtuales concurrentes")
+    parser.add_argument("--iterations", type=int, default=30, help="operaciones por usuario tras el login")
+    parser.add_argument("--doctors", type=int, default=5)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"pesos por operación (por defecto {DEFAULT_MIX})")
+    parser.add_argument("--seed", type=int, default=11)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--auth-url", help="usar un auth_service ya levantado")
+    parser.add_argument("--appointments-url", help="usar un appointments_service ya levantado")
+    parser.add_argument("--json", help="guardar el resultado en este archivo")
+    parser.add_argument("--baseline", help="resultado JSON anterior contra el cual comparar")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="margen antes de marcar una regresión")
+    args = parser.parse_args()
+
+    servers = []
+    auth_url, appointments_url = args.auth_url, args.appointments_url
+    try:
+        if not (auth_url and appointments_url):
+            workdir = tempfile.mkdtemp(prefix="bench_http_flow_")
+            auth_port, appointments_port = free_port(), free_port()
+            auth_url = f"http://127.0.0.1:{auth_port}"
+            appointments_url = f"http://127.0.0.1:{appointments_port}"
+            servers.append(start_service("auth_service", auth_port, dict(
+                os.environ, DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'auth.db')}",
+            )))
+            servers.append(start_service("appointments_service", appointments_port, dict(
+                os.environ, DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'appointments.db')}",
+                AUTH_SERVICE_URL=auth_url,
+            )))
+        wait_healthy(auth_url)
+        wait_healthy(appointments_url)
+        result = asyncio.run(run_load(args, auth_url, appointments_url))
+    finally:
+        for server in servers:
+            server.terminate()
+            server.wait()
+
+    total = result["total"]
+    print(f"🚀 {args.users} usuarios x {args.iterations} operaciones en {result['elapsed_seconds']} s: "
+          f"{total['requests']} peticiones, {total['throughput_rps']} req/s, {total['errors']} errores")
+    print(f"  {'endpoint':<32} {'req':>6} {'err':>5} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, stats in result["endpoints"].items():
+        print(f"  {name:<32} {stats['requests']:>6} {stats['errors']:>5} {stats['throughput_rps']:>8} "
+              f"{stats['p50_ms']:>9} {stats['p95_ms']:>9} {stats['p99_ms']:>9}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+        print(f"✅ Resultado guardado en {args.json}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(result, json.load(f), args.tolerance)
+        if regressions:
+            print(f"❌ Regresiones respecto de {args.baseline}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print(f"✅ Sin regresiones respecto de {args.baseline} (tolerancia {args.tolerance:.0%})")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Benchmark de la serialización de listados de citas (1k / 10k / 100k filas).
+
+Compara, sobre una base SQLite temporal con un médico que tiene N citas:
+
+- modelo: la ruta anterior. Carga objetos ORM, construye un
+  AppointmentResponse por fila y repite lo que hace FastAPI con
+  response_model: volcar a dict, validar de nuevo, serializar y json.dumps.
+- rápido: filas de columnas y appointments_to_json (una sola pasada a bytes).
+
+Se informa el tiempo de consulta + serialización y se verifica que ambos
+caminos produzcan exactamente los mismos bytes.
+
+Uso:
+    python benchmarks/bench_listing_serialization.py --rows 1000 10000 100000
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from typing import List
+
+SERVICE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "appointments_service")
+
+DOCTOR_ID = 1
+
+def seed(database, rows):
+    """Insertar rows citas de un mismo médico, en tandas"""
+    from sqlalchemy import insert
+
+    base = datetime(2030, 1, 1, 8, 0, tzinfo=timezone.utc)
+    batch = []
+    with database.engine.begin() as conn:
+        for i in range(rows):
+            start = base + timedelta(minutes=30 * i)
+            batch.append({
+                "patient_id": 1000 + i % 500,
+                "doctor_id": DOCTOR_ID,
+                "title": "Consulta de control",
+                "description": "Paciente con seguimiento mensual" if i % 3 else None,
+                "appointment_datetime": start,
+                "duration_minutes": 30,
+                "end_datetime": start + timedelta(minutes=30),
+            })
+            if len(batch) == 5000:
+                conn.execute(insert(database.Appointment), batch)
+                batch = []
+        if batch:
+            conn.execute(insert(database.Appointment), batch)
+
+async def run_size(rows, repeat):
+    import database
+    from pydantic import TypeAdapter
+    from sqlalchemy import delete, select
+    from appointments import LISTING_COLUMNS
+    from schemas import AppointmentDetailResponse, AppointmentResponse
+    from serialization import appointments_to_json
+
+    with database.engine.begin() as conn:
+        conn.execute(delete(database.Appointment))
+    seed(database, rows)
+    response_field = TypeAdapter(List[AppointmentDetailResponse])
+
+    async def model_path():
+        async with database.AsyncSessionLocal() as db:
+            result = await db.execute(
+                select(database.Appointment).where(database.Appointment.doctor_id == DOCTOR_ID)
+                .order_by(database.Appointment.appointment_datetime, database.Appointment.id)
+            )
+            models = [AppointmentResponse.from_orm(apt) for apt in result.scalars()]
+        # Lo que FastAPI hace con response_model: dict, validación, serialización, json.dumps
+        content = [model.model_dump(exclude_unset=True) for model in models]
+        validated = response_field.validate_python(content)
+        serialized = response_field.dump_python(validated, mode="json", exclude_unset=True)
+        return json.dumps(serialized, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+    async def fast_path():
+        async with database.AsyncSessionLocal() as db:
+            result = await db.execute(
+                select(*LISTING_COLUMNS).where(database.Appointment.doctor_id == DOCTOR_ID)
+                .order_by(database.Appointment.appointment_datetime, database.Appointment.id)
+            )
+            return appointments_to_json(list(result))
+
+    timings = {}
+    outputs = {}
+    for name, path in (("modelo", model_path), ("rápido", fast_path)):
+        durations = []
+        for _ in range(repeat):
+            began = time.perf_counter()
+            outputs[name] = await path()
+            durations.append(time.perf_counter() - began)
+        timings[name] = round(statistics.median(durations) * 1000, 2)
+    assert outputs["modelo"] == outputs["rápido"], "La salida no es idéntica"
+
+    return {
+        "rows": rows,
+        "bytes": len(outputs["rápido"]),
+        "model_path_ms": timings["modelo"],
+        "fast_path_ms": timings["rápido"],
+    }
+
+async def run_benchmark(args):
+    import database
+
+    database.create_tables()
+    results = []
+    for rows in args.rows:
+        results.append(await run_size(rows, args.repeat))
+    await database.async_engine.dispose()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", help="guardar el resultado en este archivo")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_listing_")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'appointments.db')}"
+    sys.path.insert(0, SERVICE_DIR)
+
+    results = asyncio.run(run_benchmark(args))
+
+    print("🚀 Listado de citas de un médico (consulta + serialización, mediana)")
+    for result in results:
+        speedup = result["model_path_ms"] / result["fast_path_ms"] if result["fast_path_ms"] else 0.0
+        print(f"  {result['rows']:>7} filas  modelo {result['model_path_ms']:>10} ms  "
+              f"rápido {result['fast_path_ms']:>10} ms  (x{speedup:.1f}, {result['bytes']} bytes)")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"✅ Resultado guardado en {args.json}")
+
+if __name__ == "__main__":
+    main()
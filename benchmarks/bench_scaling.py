@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+Benchmark de escalabilidad de las funciones de acceso a datos de citas.
+
+Precarga en una base SQLite temporal agendas sintéticas de 10³ a 10⁶ citas.
+Cada médico tiene --rows-per-doctor citas (turnos de 30 minutos de 8:00 a
+18:00, con --density de ocupación) y la cantidad de médicos crece con la
+tabla: lo que cambia entre tamaños es solo el tamaño de la tabla, no el de
+cada agenda. Para cada tamaño se mide directamente:
+
+- check_appointment_conflicts
+- create_appointment
+- get_appointments_by_doctor (primera página y ventana de una semana)
+- get_appointments_by_patient (primera página)
+- find_free_slots (un día)
+
+Por llamada se informa la mediana de tiempo, las consultas emitidas y el
+trabajo de SQLite: las sentencias de una llamada se repiten en una conexión
+sqlite3 aparte contando pasos de la máquina virtual (proporcional a las filas
+leídas) y se revisa su plan para detectar recorridos completos de la tabla.
+
+Con los pasos de cada tamaño se estima el exponente k de trabajo ~ filas^k. Las
+funciones deben ser sublineales (usan índices y páginas acotadas): si alguna
+supera --max-exponent o recorre la tabla completa, el benchmark termina con
+código 1.
+
+Uso:
+    python benchmarks/bench_scaling.py --sizes 1000 10000 100000
+    python benchmarks/bench_scaling.py --sizes 1000 10000 100000 1000000 --rows-per-doctor 2000
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+SERVICE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "appointments_service")
+
+BASE = datetime(2030, 1, 1, 8, 0, tzinfo=timezone.utc)
+SLOTS_PER_DAY = 20
+PATIENTS_PER_DOCTOR = 10
+
+def seed(database, doctors, rows_per_doctor, density, rng):
+    """rows_per_doctor citas para cada uno de doctors médicos, ocupando density de sus turnos"""
+    from sqlalchemy import delete, insert
+
+    with database.engine.begin() as conn:
+        conn.execute(delete(database.Appointment))
+    # Turnos necesarios para que rows_per_doctor citas ocupen density de la agenda
+    slots = max(rows_per_doctor, int(rows_per_doctor / density))
+    batch = []
+    with database.engine.begin() as conn:
+        for doctor_id in range(1, doctors + 1):
+            for slot in sorted(rng.sample(range(slots), rows_per_doctor)):
+                day, index = divmod(slot, SLOTS_PER_DAY)
+                start = BASE + timedelta(days=day, minutes=30 * index)
+                batch.append({
+                    "patient_id": doctor_id * PATIENTS_PER_DOCTOR + slot % PATIENTS_PER_DOCTOR,
+                    "doctor_id": doctor_id,
+                    "title": "Consulta",
+                    "appointment_datetime": start,
+                    "duration_minutes": 30,
+                    "end_datetime": start + timedelta(minutes=30),
+                })
+                if len(batch) == 10000:
+                    conn.execute(insert(database.Appointment), batch)
+                    batch = []
+        if batch:
+            conn.execute(insert(database.Appointment), batch)
+    return rows_per_doctor * doctors, slots // SLOTS_PER_DAY + 1
+
+class QueryLog:
+    """Sentencias emitidas por la sesión asíncrona durante una llamada"""
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+
+        self.statements = []
+        event.listen(engine.sync_engine, "before_cursor_execute", self._record)
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append((statement, parameters, executemany))
+
+    def take(self):
+        statements, self.statements = self.statements, []
+        return statements
+
+def replay(path, statements):
+    """Repetir las sentencias en sqlite3 contando pasos de la VM y recorridos completos"""
+    steps = {"count": 0}
+
+    def progress():
+        steps["count"] += 1
+        return 0
+
+    conn = sqlite3.connect(path, isolation_level=None)
+    full_scans = []
+    try:
+        conn.execute("BEGIN")
+        for statement, parameters, executemany in statements:
+            for detail in conn.execute("EXPLAIN QUERY PLAN " + statement,
+                                       parameters[0] if executemany else parameters):
+                plan = detail[-1]
+                if plan.startswith("SCAN appointments") and "USING" not in plan:
+                    full_scans.append(plan)
+            conn.set_progress_handler(progress, 1)
+            if executemany:
+                conn.executemany(statement, parameters).fetchall()
+            else:
+                conn.execute(statement, parameters).fetchall()
+            conn.set_progress_handler(None, 1)
+    finally:
+        conn.execute("ROLLBACK")
+        conn.close()
+    return steps["count"], full_scans
+
+async def measure_size(args, database, path, rows, query_log, rng):
+    from appointments import (
+        check_appointment_conflicts,
+        create_appointment,
+        find_free_slots,
+        get_appointments_by_doctor,
+        get_appointments_by_patient,
+    )
+    from schemas import AppointmentCreate
+
+    doctors = max(1, rows // args.rows_per_doctor)
+    seeded, days = seed(database, doctors, args.rows_per_doctor, args.density, rng)
+    created = {"count": 0}
+
+    def random_start():
+        day, index = rng.randrange(days), rng.randrange(SLOTS_PER_DAY)
+        return BASE + timedelta(days=day, minutes=30 * index)
+
+    async def conflicts(db):
+        await check_appointment_conflicts(db, rng.randint(1, doctors), 1, random_start(), 30)
+
+    async def create(db):
+        # Turnos posteriores a toda la agenda precargada: nunca hay conflicto
+        created["count"] += 1
+        start = BASE + timedelta(days=days + 1, minutes=30 * created["count"])
+        doctor_id = rng.randint(1, doctors)
+        await create_appointment(
+            db, AppointmentCreate(doctor_id=doctor_id, title="Nueva", appointment_datetime=start,
+                                  duration_minutes=30), 10 ** 8 + created["count"]
+        )
+
+    async def doctor_page(db):
+        await get_appointments_by_doctor(db, rng.randint(1, doctors))
+
+    async def doctor_week(db):
+        date_from = BASE + timedelta(days=rng.randrange(days))
+        await get_appointments_by_doctor(db, rng.randint(1, doctors), date_from, date_from + timedelta(days=7))
+
+    async def patient_page(db):
+        doctor_id = rng.randint(1, doctors)
+        await get_appointments_by_patient(db, doctor_id * PATIENTS_PER_DOCTOR + rng.randrange(PATIENTS_PER_DOCTOR))
+
+    async def free_slots(db):
+        date_from = BASE + timedelta(days=rng.randrange(days))
+        await find_free_slots(db, rng.randint(1, doctors), date_from, date_from + timedelta(days=1), 30)
+
+    functions = {
+        "check_appointment_conflicts": conflicts,
+        "create_appointment": create,
+        "get_appointments_by_doctor": doctor_page,
+        "get_appointments_by_doctor (semana)": doctor_week,
+        "get_appointments_by_patient": patient_page,
+        "find_free_slots (1 día)": free_slots,
+    }
+    results = {}
+    for name, func in functions.items():
+        durations, queries, steps, full_scans = [], [], [], []
+        for _ in range(args.repeat):
+            async with database.AsyncSessionLocal() as db:
+                query_log.take()
+                began = time.perf_counter()
+                await func(db)
+                durations.append(time.perf_counter() - began)
+            statements = query_log.take()
+            queries.append(len(statements))
+            # Las escrituras ya se confirmaron: se repiten solo las lecturas
+            reads = [entry for entry in statements if entry[0].lstrip().upper().startswith("SELECT")]
+            call_steps, call_scans = replay(path, reads)
+            steps.append(call_steps)
+            full_scans.extend(call_scans)
+        results[name] = {
+            "median_us": round(statistics.median(durations) * 1e6, 1),
+            "queries_per_call": round(statistics.fmean(queries), 2),
+            "vm_steps_per_call": round(statistics.median(steps)),
+            "full_scans": sorted(set(full_scans)),
+        }
+    return {"rows": seeded, "doctors": doctors, "functions": results}
+
+def exponent(sizes, values):
+    """Pendiente de log(valor) vs log(filas) por mínimos cuadrados"""
+    points = [(math.log(size), math.log(max(value, 1))) for size, value in zip(sizes, values)]
+    mean_x = statistics.fmean(x for x, _ in points)
+    mean_y = statistics.fmean(y for _, y in points)
+    denominator = sum((x - mean_x) ** 2 for x, _ in points)
+    if not denominator:
+        return 0.0
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / denominator
+
+async def run_benchmark(args, path):
+    import database
+
+    database.create_tables()
+    query_log = QueryLog(database.async_engine)
+    rng = random.Random(args.seed)
+    sizes = []
+    for rows in args.sizes:
+        sizes.append(await measure_size(args, database, path, rows, query_log, rng))
+    await database.async_engine.dispose()
+    return sizes
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--rows-per-doctor", type=int, default=500, help="citas en la agenda de cada médico")
+    parser.add_argument("--density", type=float, default=0.8, help="fracción de turnos ocupados")
+    parser.add_argument("--repeat", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=5)
+    parser.add_argument("--max-exponent", type=float, default=0.5,
+                        help="exponente máximo de trabajo ~ filas^k antes de marcar una regresión")
+    parser.add_argument("--json", help="guardar el resultado en este archivo")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_scaling_")
+    path = os.path.join(workdir, "appointments.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+    os.environ.setdefault("OUTBOX_RELAY_ENABLED", "false")
+    sys.path.insert(0, SERVICE_DIR)
+
+    sizes = asyncio.run(run_benchmark(args, path))
+
+    print(f"🚀 Escalabilidad con {args.rows_per_doctor} citas por médico y {args.density:.0%} de ocupación")
+    failures = []
+    summary = {}
+    for name in sizes[0]["functions"]:
+        rows = [size["rows"] for size in sizes]
+        steps = [size["functions"][name]["vm_steps_per_call"] for size in sizes]
+        k = exponent(rows, steps) if len(sizes) > 1 else 0.0
+        scans = sorted({scan for size in sizes for scan in size["functions"][name]["full_scans"]})
+        summary[name] = {"exponent": round(k, 3), "full_scans": scans}
+        print(f"  {name}  (trabajo ~ filas^{k:.2f})")
+        for size in sizes:
+            stats = size["functions"][name]
+            print(f"    {size['rows']:>8} filas ({size['doctors']:>5} médicos)  {stats['median_us']:>10} µs  "
+                  f"{stats['queries_per_call']:>5} consultas  {stats['vm_steps_per_call']:>10} pasos VM")
+        if k > args.max_exponent:
+            failures.append(f"{name}: trabajo ~ filas^{k:.2f} (máximo {args.max_exponent})")
+        for scan in scans:
+            failures.append(f"{name}: recorrido completo ({scan})")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"config": vars(args), "sizes": sizes, "summary": summary}, f, indent=2, ensure_ascii=False)
+        print(f"✅ Resultado guardado en {args.json}")
+    if failures:
+        print("❌ Regresiones de complejidad:")
+        for failure in failures:
+            print(f"  {failure}")
+        sys.exit(1)
+    print("✅ Todas las funciones escalan de forma sublineal")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Benchmark del arranque de cada servicio: del import a listo para atender.
+
+Para cada servicio prepara el esquema una vez con migrate.py sobre una base
+SQLite temporal (o usa --auth-database-url / --appointments-database-url, por
+ejemplo PostgreSQL local) y mide --repeat veces, cada una en un proceso nuevo:
+
+- import: tiempo de `import main`, con las sentencias SQL y las conexiones
+  abiertas durante el import (deben ser 0: nada de DDL al importar),
+- lifespan: tiempo del calentamiento de arranque (conexión inicial del pool,
+  backend de bcrypt) y sus sentencias y conexiones,
+- listo: desde que se lanza uvicorn hasta la primera respuesta de /health,
+  lo que tarda una réplica nueva en poder recibir tráfico.
+
+Si el import de algún servicio ejecuta SQL o abre conexiones, o el lifespan
+ejecuta más de --max-startup-statements sentencias, el benchmark termina con
+código 1.
+
+Uso:
+    python benchmarks/bench_startup.py --repeat 5
+    python benchmarks/bench_startup.py --appointments-database-url postgresql://... --json startup.json
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVICES = ("auth_service", "appointments_service")
+
+# Se ejecuta en un proceso nuevo dentro del directorio del servicio
+PROBE = r"""
+import asyncio, json, time
+started = time.perf_counter()
+from sqlalchemy import event
+import database
+
+counts = {"statements": 0, "connections": 0}
+engines = [database.engine]
+if hasattr(database, "async_engine"):
+    engines.append(database.async_engine.sync_engine)
+for engine in engines:
+    event.listen(engine, "before_cursor_execute", lambda *args: counts.__setitem__("statements", counts["statements"] + 1))
+    event.listen(engine.pool, "connect", lambda *args: counts.__setitem__("connections", counts["connections"] + 1))
+
+import main
+result = {"import_ms": (time.perf_counter() - started) * 1000, "import_statements": counts["statements"],
+          "import_connections": counts["connections"]}
+
+async def startup():
+    began = time.perf_counter()
+    async with main.app.router.lifespan_context(main.app):
+        result["lifespan_ms"] = (time.perf_counter() - began) * 1000
+
+asyncio.run(startup())
+result["lifespan_statements"] = counts["statements"] - result["import_statements"]
+result["lifespan_connections"] = counts["connections"] - result["import_connections"]
+print(json.dumps(result))
+"""
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def probe(service, env):
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE], cwd=os.path.join(ROOT, service), env=env,
+        capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def time_to_ready(service, env, timeout):
+    """Segundos desde lanzar uvicorn hasta la primera respuesta 200 de /health"""
+    import httpx
+
+    port = free_port()
+    began = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=os.path.join(ROOT, service), env=env,
+    )
+    try:
+        while time.perf_counter() - began < timeout:
+            try:
+                if httpx.get(f"http://127.0.0.1:{port}/health", timeout=1).status_code == 200:
+                    return time.perf_counter() - began
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.01)
+        raise SystemExit(f"❌ {service} no respondió a /health en {timeout} s")
+    finally:
+        server.terminate()
+        server.wait()
+
+def measure(service, database_url, args):
+    env = dict(os.environ, DATABASE_URL=database_url, OUTBOX_RELAY_ENABLED="false")
+    subprocess.run([sys.executable, "migrate.py"], cwd=os.path.join(ROOT, service), env=env, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    probes = [probe(service, env) for _ in range(args.repeat)]
+    ready = [time_to_ready(service, env, args.timeout) for _ in range(args.repeat)]
+    median = lambda key: round(statistics.median(run[key] for run in probes), 1)
+    return {
+        "import_ms": median("import_ms"),
+        "lifespan_ms": median("lifespan_ms"),
+        "ready_ms": round(statistics.median(ready) * 1000, 1),
+        "ready_max_ms": round(max(ready) * 1000, 1),
+        "import_statements": max(run["import_statements"] for run in probes),
+        "import_connections": max(run["import_connections"] for run in probes),
+        "lifespan_statements": max(run["lifespan_statements"] for run in probes),
+        "lifespan_connections": max(run["lifespan_connections"] for run in probes),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5, help="arranques por servicio")
+    parser.add_argument("--auth-database-url", help="base de auth_service (por defecto SQLite temporal)")
+    parser.add_argument("--appointments-database-url", help="base de appointments_service (por defecto SQLite temporal)")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--max-startup-statements", type=int, default=2,
+                        help="sentencias SQL permitidas en el lifespan (calentamiento)")
+    parser.add_argument("--json", help="guardar el resultado en este archivo")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_startup_")
+    urls = {
+        "auth_service": args.auth_database_url or f"sqlite:///{os.path.join(workdir, 'auth.db')}",
+        "appointments_service": args.appointments_database_url or f"sqlite:///{os.path.join(workdir, 'appointments.db')}",
+    }
+    results = {service: measure(service, urls[service], args) for service in SERVICES}
+
+    print(f"🚀 Arranque de los servicios (mediana de {args.repeat})")
+    failures = []
+    for service, stats in results.items():
+        print(f"  {service:<22} import {stats['import_ms']:>7} ms  lifespan {stats['lifespan_ms']:>7} ms  "
+              f"listo {stats['ready_ms']:>7} ms (máx {stats['ready_max_ms']} ms)")
+        print(f"  {'':<22} SQL al importar {stats['import_statements']} sentencias / "
+              f"{stats['import_connections']} conexiones, en el lifespan {stats['lifespan_statements']} / "
+              f"{stats['lifespan_connections']}")
+        if stats["import_statements"] or stats["import_connections"]:
+            failures.append(f"{service}: el import usa la base de datos")
+        if stats["lifespan_statements"] > args.max_startup_statements:
+            failures.append(f"{service}: {stats['lifespan_statements']} sentencias SQL en el arranque")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"config": vars(args), "services": results}, f, indent=2, ensure_ascii=False)
+        print(f"✅ Resultado guardado en {args.json}")
+    if failures:
+        print("❌ Regresiones de arranque:")
+        for failure in failures:
+            print(f"  {failure}")
+        sys.exit(1)
+    print("✅ Ningún servicio toca la base de datos al importarse")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark del costo de autenticación por petición (verify_token).
+
+Para cada servicio compara la verificación completa (decode_token, lo que se
+hacía en cada petición) con verify_token y su caché de payloads. Simula a
+varios clientes que reutilizan su token durante su vigencia: cada petición
+elige uno de --tokens tokens distintos.
+
+Uso:
+    python benchmarks/bench_token_verification.py --requests 20000 --tokens 200
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVICES = {
+    "auth_service": "auth",
+    "appointments_service": "appointments",
+}
+
+def measure(func, tokens, order):
+    began = time.perf_counter()
+    for index in order:
+        func(tokens[index])
+    return (time.perf_counter() - began) / len(order) * 1e6
+
+def run_service(service, args):
+    """Ejecutar la medición dentro del proceso del servicio (sys.path propio)"""
+    os.environ.setdefault("DATABASE_URL", "sqlite://")
+    sys.path.insert(0, os.path.join(ROOT, service))
+    from jose import jwt
+    from config import settings
+    from token_cache import token_cache
+    module = __import__(SERVICES[service])
+
+    expire = datetime.utcnow() + timedelta(minutes=30)
+    tokens = [
+        jwt.encode(
+            {"sub": f"user{i}@example.com", "user_id": i, "role": "paciente", "exp": expire},
+            settings.SECRET_KEY,
+            algorithm=settings.ALGORITHM,
+        )
+        for i in range(args.tokens)
+    ]
+    rng = random.Random(args.seed)
+    order = [rng.randrange(args.tokens) for _ in range(args.requests)]
+
+    token_cache.clear()
+    full_us = measure(module.decode_token, tokens, order)
+    token_cache.clear()
+    token_cache.hits = token_cache.misses = 0
+    cached_us = measure(module.verify_token, tokens, order)
+    return {
+        "service": service,
+        "requests": args.requests,
+        "tokens": args.tokens,
+        "full_verification_us": round(full_us, 2),
+        "cached_verification_us": round(cached_us, 2),
+        "cache": token_cache.stats(),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--tokens", type=int, default=200, help="tokens distintos en circulación")
+    parser.add_argument("--seed", type=int, default=3)
+    parser.add_argument("--service", choices=sorted(SERVICES), help="medir un solo servicio")
+    parser.add_argument("--json", help="guardar el resultado en este archivo")
+    args = parser.parse_args()
+
+    if args.service:
+        print(json.dumps(run_service(args.service, args)))
+        return
+
+    # Cada servicio en su propio proceso: ambos tienen módulos config/main homónimos
+    results = []
+    for service in SERVICES:
+        output = subprocess.run(
+            [sys.executable, __file__, "--service", service, "--requests", str(args.requests),
+             "--tokens", str(args.tokens), "--seed", str(args.seed)],
+            check=True, capture_output=True, text=True,
+        ).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+
+    print(f"🚀 {args.requests} peticiones con {args.tokens} tokens distintos")
+    for result in results:
+        print(f"  {result['service']:<22} verificación completa {result['full_verification_us']:>8} µs  "
+              f"con caché {result['cached_verification_us']:>8} µs  "
+              f"(tasa de aciertos {result['cache']['hit_rate']:.2%})")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"✅ Resultado guardado en {args.json}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Desglose offline de las trazas exportadas por los servicios (OTLP/JSON).
+
+Lee los archivos de TRACE_EXPORT_PATH de ambos servicios (una línea
+resourceSpans por petición), une los spans por traceId y resume por servicio
+y nombre de span: cantidad, duración p50/p95 y tiempo propio (sin los spans
+hijos). Así se ve si una petición lenta pasó el tiempo en el JWT, en la base
+de citas, en la llamada a auth_service o en bcrypt.
+
+Uso:
+    python benchmarks/trace_breakdown.py appointments_service/traces-appointments_service.jsonl \\
+        auth_service/traces-auth_service.jsonl --root "GET /appointments/{appointment_id}"
+"""
+import argparse
+import json
+import statistics
+from collections import defaultdict
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+def load_spans(paths):
+    """Spans de todos los archivos, con su servicio y duración en ms"""
+    spans = []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                for resource in json.loads(line)["resourceSpans"]:
+                    service = next(
+                        (attr["value"]["stringValue"] for attr in resource["resource"]["attributes"]
+                         if attr["key"] == "service.name"), "desconocido"
+                    )
+                    for scope in resource["scopeSpans"]:
+                        for span in scope["spans"]:
+                            span["service"] = service
+                            span["duration_ms"] = (int(span["endTimeUnixNano"]) - int(span["startTimeUnixNano"])) / 1e6
+                            spans.append(span)
+    return spans
+
+def breakdown(spans, root_name=None):
+    traces = defaultdict(list)
+    for span in spans:
+        traces[span["traceId"]].append(span)
+
+    durations = defaultdict(list)
+    self_times = defaultdict(list)
+    selected = 0
+    for trace_spans in traces.values():
+        roots = [span for span in trace_spans if "parentSpanId" not in span]
+        if root_name and not any(span["name"] == root_name for span in roots):
+            continue
+        selected += 1
+        children_ms = defaultdict(float)
+        for span in trace_spans:
+            if "parentSpanId" in span:
+                children_ms[span["parentSpanId"]] += span["duration_ms"]
+        for span in trace_spans:
+            key = (span["service"], span["name"])
+            durations[key].append(span["duration_ms"])
+            self_times[key].append(max(span["duration_ms"] - children_ms[span["spanId"]], 0.0))
+
+    rows = []
+    for key, values in durations.items():
+        rows.append({
+            "service": key[0],
+            "span": key[1],
+            "count": len(values),
+            "p50_ms": round(percentile(values, 50), 3),
+            "p95_ms": round(percentile(values, 95), 3),
+            "self_total_ms": round(sum(self_times[key]), 3),
+            "self_mean_ms": round(statistics.fmean(self_times[key]), 3),
+        })
+    rows.sort(key=lambda row: row["self_total_ms"], reverse=True)
+    return selected, rows
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="+", help="archivos OTLP/JSON exportados")
+    parser.add_argument("--root", help="solo trazas cuyo span raíz tenga este nombre")
+    parser.add_argument("--json", help="guardar el resultado en este archivo")
+    args = parser.parse_args()
+
+    selected, rows = breakdown(load_spans(args.paths), args.root)
+    print(f"🚀 {selected} trazas" + (f" con raíz {args.root}" if args.root else ""))
+    print(f"  {'servicio':<22} {'span':<40} {'n':>6} {'p50 ms':>9} {'p95 ms':>9} {'propio ms':>10}")
+    for row in rows:
+        print(f"  {row['service']:<22} {row['span'][:40]:<40} {row['count']:>6} {row['p50_ms']:>9} "
+              f"{row['p95_ms']:>9} {row['self_mean_ms']:>10}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"traces": selected, "spans": rows}, f, indent=2, ensure_ascii=False)
+        print(f"✅ Resultado guardado en {args.json}")
+
+if __name__ == "__main__":
+    main()